@@ -21,7 +21,7 @@ Created on June 30, 2021
 Augmentor Base class
 """
 from abc import ABC, abstractmethod
-from typing import Any
+from typing import Any, List
 
 
 class FuseAugmentorBase(ABC):
@@ -63,3 +63,12 @@ class FuseAugmentorBase(ABC):
         """
         augmentation_desc = self.get_random_augmentation_desc()
         return self.apply_augmentation(sample, augmentation_desc)
+
+    def apply_batch(self, samples: List[Any]) -> List[Any]:
+        """
+        Generate random parameters and apply the augmentation to each sample of a batch, see FuseDatasetDefault.getitems()
+        Batch aware augmentors may override it to process the batch at once.
+        :param samples: list of samples
+        :return: list of augmented samples
+        """
+        return [self(sample) for sample in samples]
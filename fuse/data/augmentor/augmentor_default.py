@@ -20,7 +20,7 @@ Created on June 30, 2021
 """
 Augmentor Default class
 """
-from typing import Any, Iterable
+from typing import Any, Iterable, List
 
 from fuse.data.augmentor.augmentor_base import FuseAugmentorBase
 from fuse.utils.utils_hierarchical_dict import FuseUtilsHierarchicalDict
@@ -41,7 +41,11 @@ class FuseAugmentorDefault(FuseAugmentorBase):
             Element 1 - callback to a function performing the operation. This function expected to support input parameter 'aug_ingput'
             Element 2 - dictionary including the input parameters for the callback function. See AugmentorSamplerDefault
                         to learn how to use random numbers
-            Element 3 - general parameters: TBD
+            Element 3 - general parameters:
+                        'apply' - if sampled as False, the operation is skipped. Default True.
+                        'batch' - if True, when augmenting a batch (see apply_batch()) the operation is called once per batch:
+                                  aug_input is a list of the inputs of the samples and the random parameters are shared by the batch.
+                                  When augmenting a single sample, it's called with a list of a single input. Default False.
 
             Example:
                 See in aug_image_default_pipeline()
@@ -75,29 +79,76 @@ class FuseAugmentorDefault(FuseAugmentorBase):
                 continue
 
             # Extract augmentation input
-            if sample_keys is None:
-                aug_input = aug_sample
-            elif len(sample_keys) == 1:
-                aug_input = FuseUtilsHierarchicalDict.get(aug_sample, sample_keys[0])
-            else:
-                aug_input = tuple((FuseUtilsHierarchicalDict.get(aug_sample, key) for key in sample_keys))
             augment_function_parameters = augment_function_parameters.copy()
-            augment_function_parameters['aug_input'] = aug_input
+            aug_input = self._get_aug_input(aug_sample, sample_keys)
+            # batch operation - called with a batch of a single sample
+            is_batch_op = general_parameters.get('batch', False)
+            augment_function_parameters['aug_input'] = [aug_input] if is_batch_op else aug_input
 
             # apply augmentation
             aug_result = augment_function(**augment_function_parameters)
+            if is_batch_op:
+                aug_result = aug_result[0]
 
             # modify the sample accordingly
-            if sample_keys is None:
-                aug_sample = aug_result
-            elif len(sample_keys) == 1:
-                FuseUtilsHierarchicalDict.set(aug_sample, sample_keys[0], aug_result)
-            else:
-                for index, key in enumerate(sample_keys):
-                    FuseUtilsHierarchicalDict.set(aug_sample, key, aug_result[index])
+            aug_sample = self._set_aug_result(aug_sample, sample_keys, aug_result)
 
         return aug_sample
 
+    def apply_batch(self, samples: List[Any]) -> List[Any]:
+        """
+        See description in super class.
+        The random parameters are drawn per sample, except for the operations marked with general parameter 'batch',
+        which are called once per batch.
+        """
+        if not any(op_desc[3].get('batch', False) for op_desc in self.augmentation_pipeline):
+            return super().apply_batch(samples)
+
+        augmentation_descs = [self.get_random_augmentation_desc() for _ in samples]
+        aug_samples = list(samples)
+        for op_index, op_desc in enumerate(self.augmentation_pipeline):
+            if not op_desc[3].get('batch', False):
+                for sample_index, aug_sample in enumerate(aug_samples):
+                    aug_samples[sample_index] = self.apply_augmentation(aug_sample, augmentation_descs[sample_index][op_index:op_index + 1])
+                continue
+
+            # batch operation - the parameters drawn for the first sample are shared by the batch
+            sample_keys, augment_function, augment_function_parameters, general_parameters = augmentation_descs[0][op_index]
+            if not general_parameters.get('apply', True):
+                continue
+            augment_function_parameters = augment_function_parameters.copy()
+            augment_function_parameters['aug_input'] = [self._get_aug_input(aug_sample, sample_keys) for aug_sample in aug_samples]
+            aug_results = augment_function(**augment_function_parameters)
+            aug_samples = [self._set_aug_result(aug_sample, sample_keys, aug_result) for aug_sample, aug_result in zip(aug_samples, aug_results)]
+
+        return aug_samples
+
+    @staticmethod
+    def _get_aug_input(aug_sample: Any, sample_keys: Any) -> Any:
+        """
+        Extract the input of an augmentation operation from the sample
+        """
+        if sample_keys is None:
+            return aug_sample
+        if len(sample_keys) == 1:
+            return FuseUtilsHierarchicalDict.get(aug_sample, sample_keys[0])
+        return tuple((FuseUtilsHierarchicalDict.get(aug_sample, key) for key in sample_keys))
+
+    @staticmethod
+    def _set_aug_result(aug_sample: Any, sample_keys: Any, aug_result: Any) -> Any:
+        """
+        Modify the sample according to the output of an augmentation operation
+        :return: the modified sample
+        """
+        if sample_keys is None:
+            return aug_result
+        if len(sample_keys) == 1:
+            FuseUtilsHierarchicalDict.set(aug_sample, sample_keys[0], aug_result)
+        else:
+            for index, key in enumerate(sample_keys):
+                FuseUtilsHierarchicalDict.set(aug_sample, key, aug_result[index])
+        return aug_sample
+
     def summary(self) -> str:
         """
         String summary of the object
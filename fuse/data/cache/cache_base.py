@@ -22,11 +22,17 @@ Base class for caching
 """
 from abc import ABC, abstractmethod
 from multiprocessing import Manager
-from typing import Hashable, Any, List
+from typing import Hashable, Any, List, Optional, Dict, Sequence
+
+from fuse.data.cache.cache_stats import FuseCacheStats
 
 
 class FuseCacheBase(ABC):
 
+    def __init__(self):
+        # hits, misses, bytes and latencies - aggregated across processes
+        self._cache_stats = FuseCacheStats()
+
     @abstractmethod
     def __contains__(self, key: Hashable) -> bool:
         """
@@ -45,6 +51,23 @@ class FuseCacheBase(ABC):
         """
         raise NotImplementedError
 
+    def get_many(self, keys: Sequence[Hashable]) -> Dict[Hashable, Any]:
+        """
+        Get several items at once. Caches may override it to read the items in bulk (e.g. in storage order).
+        :param keys: list of keys
+        :return: map key to item, for the keys found in cache. Keys not found or evicted (see FuseCacheFiles max_bytes) are omitted.
+        """
+        values = {}
+        for key in keys:
+            if key in values or key not in self:
+                continue
+            try:
+                values[key] = self[key]
+            except KeyError:
+                # evicted from cache
+                continue
+        return values
+
     @abstractmethod
     def __delitem__(self, key: Hashable) -> None:
         """
@@ -96,10 +119,54 @@ class FuseCacheBase(ABC):
         """
         raise NotImplementedError
 
-    def start_caching(self, manager: Manager) -> None:
+    def start_caching(self, manager: Optional[Manager] = None) -> None:
         """
         start caching - the caching will be done in save().
-        :param manager: multiprocessing manager to create shared data structures
+        :param manager: multiprocessing manager to create shared data structures.
+                        Not required by caches that support multiprocess writing (see support_multiprocess_writing())
         :return: None
         """
         raise NotImplementedError
+
+    def refresh(self) -> None:
+        """
+        Update the cache index with the values written by other processes since loaded.
+        Relevant only for caches that support multiprocess writing, default implementation does nothing.
+        :return: None
+        """
+        pass
+
+    def support_multiprocess_writing(self) -> bool:
+        """
+        :return: True if worker processes can write directly to the cache without multiprocessing manager.
+                 The values written by all the processes are merged in save().
+                 Otherwise, the values should be sent to the main process and written by it.
+        """
+        return False
+
+    def is_compacted(self) -> bool:
+        """
+        :return: False if values written by several processes are still kept apart and will be merged by save() (e.g. journal fragments).
+                 Default implementation returns True.
+        """
+        return True
+
+    @property
+    def stats(self) -> FuseCacheStats:
+        """
+        :return: the statistics object of the cache, updated by all the processes (e.g. DataLoader workers)
+        """
+        return self._cache_stats
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Cache statistics aggregated across all the processes, see FuseCacheStats.get_stats()
+        :return: dictionary with the counters, hit rate and latency statistics
+        """
+        return self._cache_stats.get_stats()
+
+    def reset_stats(self) -> None:
+        """
+        Reset the cache statistics
+        """
+        self._cache_stats.reset()
@@ -0,0 +1,221 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Content addressed store of large tensors shared by several cache entries
+"""
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, Tuple
+
+import numpy as np
+import torch
+
+from fuse.data.cache.cache_codecs import FuseSampleSerializer
+from fuse.utils.file_io.atomic_file import AtomicFileWriter
+from fuse.utils.file_io.file_io import create_dir
+
+
+class FuseBlobRef:
+    """
+    Placeholder stored in the cache entry instead of a tensor or numpy array leaf kept in the blob store
+    """
+    __slots__ = ('digest',)
+
+    def __init__(self, digest: str):
+        self.digest = digest
+
+
+class FuseCacheBlobStore:
+    """
+    Blob store: tensor and numpy array leaves of at least min_size bytes are stored once, in a file named by the hash of their content.
+    Cache entries keep just a FuseBlobRef, so identical tensors stored under the same key (e.g. the same reference volume of many samples)
+    are written once. The key is part of the hash since the serializer might encode each key differently (codec and dtype policies).
+    Blobs read are kept decoded in memory, per process and up to a byte budget, so a shared tensor is read and decoded once per process.
+    Each restored sample gets its own copy of the blobs.
+    Several processes can store the same blob concurrently: the content is identical and each file is written atomically.
+    """
+    BLOB_DIR = 'blobs'
+
+    def __init__(self, cache_file_dir: str, serializer: FuseSampleSerializer, min_size: int = 2 ** 20, memory_budget: int = 2 ** 28):
+        """
+        :param cache_file_dir: path to cache dir, blobs are stored in sub dir 'blobs'
+        :param serializer: encodes the blobs
+        :param min_size: tensors and arrays smaller than min_size bytes are kept in the cache entry
+        :param memory_budget: max size (in bytes) of the decoded blobs kept in memory, per process
+        """
+        self._blob_dir = os.path.join(cache_file_dir, self.BLOB_DIR)
+        self._serializer = serializer
+        self._min_size = min_size
+        self._memory_budget = memory_budget
+        self._reset_memory()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_memory'] = OrderedDict()
+        state['_memory_size'] = 0
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def store(self, value: Any, key: str = '') -> Tuple[Any, int]:
+        """
+        Recursively write the large tensor and array leaves to the blob store and replace them with FuseBlobRef
+        :param value: the sample
+        :param key: hierarchical key of value in the sample, used by the serializer to select the codec and storage dtype
+        :return: tuple of the sample with the references and the number of bytes written (blobs already stored are not written)
+        """
+        num_bytes = [0]
+        value = self._store(value, key, num_bytes)
+        return value, num_bytes[0]
+
+    def restore(self, value: Any) -> Tuple[Any, int]:
+        """
+        Recursively replace FuseBlobRef with a copy of the blobs.
+        Raise FileNotFoundError if a blob was evicted.
+        :param value: the sample read from the cache
+        :return: tuple of the restored sample and the number of bytes read from disk
+        """
+        num_bytes = [0]
+        value = self._restore(value, num_bytes)
+        return value, num_bytes[0]
+
+    def get_entries(self) -> List[Tuple[str, int, float, float]]:
+        """
+        :return: list of the blob files: (file name relative to cache dir, size in bytes, last access time, creation time)
+        """
+        entries = []
+        if not os.path.isdir(self._blob_dir):
+            return entries
+        for dir_path, _, file_names in os.walk(self._blob_dir):
+            for file_name in file_names:
+                if file_name.endswith('.tmp'):
+                    # being written
+                    continue
+                file_path = os.path.join(dir_path, file_name)
+                try:
+                    stat = os.stat(file_path)
+                except FileNotFoundError:
+                    continue
+                entries.append((os.path.relpath(file_path, os.path.dirname(self._blob_dir)), stat.st_size, stat.st_atime, stat.st_mtime))
+        return entries
+
+    def _store(self, value: Any, key: str, num_bytes: List[int]) -> Any:
+        if isinstance(value, dict):
+            return {k: self._store(v, f'{key}.{k}' if key else str(k), num_bytes) for k, v in value.items()}
+        if type(value) in (list, tuple):
+            return type(value)([self._store(v, key, num_bytes) for v in value])
+
+        is_tensor = isinstance(value, torch.Tensor)
+        if is_tensor:
+            if value.dtype == torch.bfloat16 or value.is_sparse:
+                # not supported by numpy - keep it in the cache entry
+                return value
+            array = value.detach().cpu().numpy()
+        elif isinstance(value, np.ndarray):
+            array = value
+        else:
+            return value
+        if array.dtype.hasobject or array.nbytes < self._min_size:
+            return value
+
+        array = np.ascontiguousarray(array)
+        hasher = hashlib.blake2b(digest_size=16)
+        hasher.update(f'{key}:{array.dtype.str}:{array.shape}:{is_tensor}:'.encode())
+        hasher.update(array.reshape(-1).view(np.uint8))
+        digest = hasher.hexdigest()
+
+        blob_file_name = self._get_blob_file_name(digest)
+        try:
+            # already stored - mark it as recently created, so it's not evicted before the new entry
+            os.utime(blob_file_name)
+        except FileNotFoundError:
+            create_dir(os.path.dirname(blob_file_name))
+            data = self._serializer.serialize(value, key)
+            with AtomicFileWriter(blob_file_name) as blob_file:
+                blob_file.write(data)
+            num_bytes[0] += len(data)
+        return FuseBlobRef(digest)
+
+    def _restore(self, value: Any, num_bytes: List[int]) -> Any:
+        if isinstance(value, dict):
+            return {k: self._restore(v, num_bytes) for k, v in value.items()}
+        if type(value) in (list, tuple):
+            return type(value)([self._restore(v, num_bytes) for v in value])
+        if not isinstance(value, FuseBlobRef):
+            return value
+
+        with self._lock:
+            entry = self._memory.get(value.digest, None)
+            if entry is not None:
+                self._memory.move_to_end(value.digest)
+        if entry is not None:
+            return self._copy_blob(entry[0])
+
+        with open(self._get_blob_file_name(value.digest), 'rb') as blob_file:
+            data = blob_file.read()
+            self._touch(blob_file.fileno())
+        num_bytes[0] += len(data)
+        blob = self._serializer.deserialize(data)
+
+        size = blob.element_size() * blob.nelement() if isinstance(blob, torch.Tensor) else blob.nbytes
+        if size <= self._memory_budget:
+            with self._lock:
+                if value.digest not in self._memory:
+                    self._memory[value.digest] = (blob, size)
+                    self._memory_size += size
+                    # evict least recently used blobs
+                    while self._memory_size > self._memory_budget:
+                        _, (_, evicted_size) = self._memory.popitem(last=False)
+                        self._memory_size -= evicted_size
+            return self._copy_blob(blob)
+        return blob
+
+    @staticmethod
+    def _copy_blob(blob: Any) -> Any:
+        """
+        :return: a copy of a blob kept in memory, so the restored sample can be modified in-place
+        """
+        return blob.clone() if isinstance(blob, torch.Tensor) else blob.copy()
+
+    @staticmethod
+    def _touch(fd: int) -> None:
+        """
+        Set the access time of a file to now - used by the lru eviction policy
+        """
+        try:
+            os.utime(fd, ns=(time.time_ns(), os.fstat(fd).st_mtime_ns))
+        except OSError:
+            # e.g. read only file system
+            pass
+
+    def _get_blob_file_name(self, digest: str) -> str:
+        # two levels, to keep the number of files per dir reasonable
+        return os.path.join(self._blob_dir, digest[:2], f'{digest}.fsc')
+
+    def _reset_memory(self) -> None:
+        self._lock = threading.Lock()
+        self._memory: OrderedDict = OrderedDict()
+        self._memory_size = 0
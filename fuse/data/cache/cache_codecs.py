@@ -0,0 +1,500 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Compression codecs and sample serializer used by the disk caches
+"""
+import fnmatch
+import logging
+import pickle
+import struct
+import time
+import zlib
+from abc import ABC, abstractmethod
+from typing import Any, Dict, List, Optional, Tuple, Union
+
+import numpy as np
+import torch
+
+# optional codecs
+try:
+    import lz4.frame
+except:
+    lz4 = None
+try:
+    import zstandard
+except:
+    zstandard = None
+
+
+class FuseCodecBase(ABC):
+    """
+    Lossless codec: bytes to bytes
+    """
+
+    @abstractmethod
+    def encode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        """
+        :param data: the data to encode
+        :param itemsize: the size of a single element in bytes (e.g. 4 for float32 arrays), used by filters such as byte-shuffle
+        :return: encoded data
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def decode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        """
+        :param data: encoded data
+        :param itemsize: See encode()
+        :return: decoded data, might be a view of data (e.g. no compression)
+        """
+        raise NotImplementedError
+
+
+class FuseCodecNone(FuseCodecBase):
+    """
+    No compression
+    """
+
+    def encode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        return bytes(data)
+
+    def decode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> Union[bytes, memoryview]:
+        # a view of data, copied once by the caller if required
+        return data
+
+
+class FuseCodecGzip(FuseCodecBase):
+    """
+    Deflate (zlib) compression. Compatible with the compression used by previous versions of the cache
+    """
+
+    def __init__(self, level: int = 6):
+        self._level = level
+
+    def encode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        return zlib.compress(data, self._level)
+
+    def decode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        return zlib.decompress(data)
+
+
+class FuseCodecLz4(FuseCodecBase):
+    """
+    LZ4 compression - fast, moderate compression ratio. Requires lz4 package.
+    """
+
+    def __init__(self, level: int = 0):
+        if lz4 is None:
+            msg = 'lz4 codec requires lz4 package (pip install lz4)'
+            logging.getLogger('Fuse').error(msg)
+            raise Exception(msg)
+        self._level = level
+
+    def encode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        return lz4.frame.compress(data, compression_level=self._level)
+
+    def decode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        return lz4.frame.decompress(data)
+
+
+class FuseCodecZstd(FuseCodecBase):
+    """
+    Zstandard compression - level 1 (fast) to 22 (high compression ratio). Requires zstandard package.
+    """
+
+    def __init__(self, level: int = 3):
+        if zstandard is None:
+            msg = 'zstd codec requires zstandard package (pip install zstandard)'
+            logging.getLogger('Fuse').error(msg)
+            raise Exception(msg)
+        self._level = level
+
+    def encode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        return zstandard.ZstdCompressor(level=self._level).compress(data)
+
+    def decode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        return zstandard.ZstdDecompressor().decompress(data)
+
+
+class FuseCodecShuffle(FuseCodecBase):
+    """
+    Byte-shuffle filter: groups together the n-th byte of all the elements.
+    Not a compression by itself - improves the compression ratio of the following codec for numeric (especially float) arrays.
+    """
+
+    def encode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        if itemsize <= 1 or len(data) % itemsize != 0:
+            return bytes(data)
+        return np.frombuffer(data, dtype=np.uint8).reshape(-1, itemsize).T.tobytes()
+
+    def decode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        if itemsize <= 1 or len(data) % itemsize != 0:
+            return bytes(data)
+        return np.frombuffer(data, dtype=np.uint8).reshape(itemsize, -1).T.tobytes()
+
+
+class FuseCodecRle(FuseCodecBase):
+    """
+    Byte level run-length encoding - effective for masks and label maps with large uniform regions.
+    Encoded format: number of runs (uint64), the value of each run (uint8) and the length of each run (uint32)
+    """
+    _MAX_RUN_LENGTH = 2 ** 32 - 1
+
+    def encode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        array = np.frombuffer(data, dtype=np.uint8)
+        if len(array) == 0:
+            return struct.pack('<Q', 0)
+        run_starts = np.concatenate([[0], np.flatnonzero(array[1:] != array[:-1]) + 1])
+        run_lengths = np.diff(np.append(run_starts, len(array)))
+        if run_lengths.max() > self._MAX_RUN_LENGTH:
+            # split long runs
+            run_starts = np.concatenate([np.arange(start, start + length, self._MAX_RUN_LENGTH)
+                                         for start, length in zip(run_starts, run_lengths)])
+            run_lengths = np.diff(np.append(run_starts, len(array)))
+        values = array[run_starts]
+        return struct.pack('<Q', len(values)) + values.tobytes() + run_lengths.astype('<u4').tobytes()
+
+    def decode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        (num_runs,) = struct.unpack_from('<Q', data)
+        values = np.frombuffer(data, dtype=np.uint8, count=num_runs, offset=8)
+        run_lengths = np.frombuffer(data, dtype='<u4', count=num_runs, offset=8 + num_runs)
+        return np.repeat(values, run_lengths).tobytes()
+
+
+class FuseCodecChain(FuseCodecBase):
+    """
+    Apply a sequence of codecs, e.g. shuffle followed by zstd
+    """
+
+    def __init__(self, codecs: List[FuseCodecBase]):
+        self._codecs = codecs
+
+    def encode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        for codec in self._codecs:
+            data = codec.encode(data, itemsize)
+        return bytes(data)
+
+    def decode(self, data: Union[bytes, memoryview], itemsize: int = 1) -> bytes:
+        for codec in reversed(self._codecs):
+            data = codec.decode(data, itemsize)
+        return bytes(data)
+
+
+# codec name to codec class. Codecs that accept a level are specified as '<name>:<level>'
+CODECS = {
+    'none': FuseCodecNone,
+    'gzip': FuseCodecGzip,
+    'lz4': FuseCodecLz4,
+    'zstd': FuseCodecZstd,
+    'shuffle': FuseCodecShuffle,
+    'rle': FuseCodecRle,
+}
+
+
+def create_codec(codec_spec: str) -> FuseCodecBase:
+    """
+    Create codec given its specification
+    :param codec_spec: codec names separated by '+', each with an optional level separated by ':'.
+                       e.g. 'lz4', 'zstd:19', 'shuffle+lz4', 'rle+zstd:3'
+    :return: the codec object
+    """
+    codecs = []
+    for name in codec_spec.split('+'):
+        name, _, level = name.strip().partition(':')
+        if name not in CODECS:
+            msg = f'Unknown codec {name} in {codec_spec}, expecting one of {list(CODECS.keys())}'
+            logging.getLogger('Fuse').error(msg)
+            raise Exception(msg)
+        codecs.append(CODECS[name](int(level)) if level else CODECS[name]())
+    return codecs[0] if len(codecs) == 1 else FuseCodecChain(codecs)
+
+
+class FuseDtypePolicy:
+    """
+    Reduced precision storage of floating point arrays, selected by key.
+    The arrays are down converted when written and up converted to their original dtype when read.
+    Storage dtype specification: '<storage dtype>[:<max absolute error>]', e.g. 'float16', 'uint8:0.01'
+        'float16' / 'float32' - cast
+        'uint8' / 'uint16'    - linear quantization: value = stored * scale + offset, scale and offset per array (from its min and max)
+    When a max absolute error is specified and the error of an array exceeds it, the array is stored in full precision.
+    Regardless of the max absolute error, an array with finite values out of the range of the storage dtype is stored in full precision.
+    """
+    STORAGE_DTYPES = ('float16', 'float32', 'uint8', 'uint16')
+
+    def __init__(self, dtype_policy: Dict[str, str]):
+        """
+        :param dtype_policy: map key pattern (fnmatch style, e.g. 'data.input.*') to storage dtype specification.
+                             The first matching pattern is used. Keys not matched are stored in full precision.
+                             e.g. {'data.input.image': 'uint8:0.01', 'data.input.*': 'float16'}
+        """
+        self._dtype_policy = dtype_policy
+        self._specs: Dict[str, Tuple[np.dtype, Optional[float]]] = {}
+        for pattern, spec in dtype_policy.items():
+            storage_dtype, _, max_error = spec.strip().partition(':')
+            if storage_dtype not in self.STORAGE_DTYPES:
+                msg = f'Unknown storage dtype {storage_dtype} in {spec}, expecting one of {self.STORAGE_DTYPES}'
+                logging.getLogger('Fuse').error(msg)
+                raise Exception(msg)
+            self._specs[pattern] = (np.dtype(storage_dtype), float(max_error) if max_error else None)
+        # keys already reported exceeding the error bound
+        self._warned = set()
+
+    def get_spec(self, key: str) -> Optional[Tuple[np.dtype, Optional[float]]]:
+        """
+        :param key: hierarchical key of a sample field (e.g. 'data.input.image')
+        :return: tuple of storage dtype and max absolute error (None if not bounded), None if stored in full precision
+        """
+        for pattern, spec in self._specs.items():
+            if fnmatch.fnmatchcase(key, pattern):
+                return spec
+        return None
+
+    def encode(self, key: str, array: np.ndarray) -> Tuple[np.ndarray, Optional[Tuple[str, float, float]]]:
+        """
+        Down convert an array according to the policy
+        :param key: hierarchical key of the array in the sample
+        :param array: the array
+        :return: tuple of the array to store and the storage parameters (storage dtype, scale, offset) - None if stored as is
+        """
+        spec = self.get_spec(key)
+        if spec is None or array.dtype.kind != 'f' or array.size == 0:
+            return array, None
+        storage_dtype, max_error = spec
+
+        if storage_dtype.kind == 'f':
+            if storage_dtype.itemsize >= array.dtype.itemsize:
+                return array, None
+            with np.errstate(over='ignore'):
+                stored = array.astype(storage_dtype)
+            # out of range values are cast to inf - store in full precision
+            if np.any(np.isinf(stored) & np.isfinite(array)):
+                self._warn(key, f'FuseDtypePolicy: {key} out of the range of {storage_dtype}, stored in full precision')
+                return array, None
+            scale, offset = 1.0, 0.0
+        else:
+            min_value, max_value = float(array.min()), float(array.max())
+            if not np.isfinite(min_value) or not np.isfinite(max_value):
+                # can't be quantized
+                return array, None
+            scale = (max_value - min_value) / np.iinfo(storage_dtype).max if max_value > min_value else 1.0
+            offset = min_value
+            stored = np.rint((array.astype(np.float64) - offset) / scale).astype(storage_dtype)
+        storage = (storage_dtype.str, scale, offset)
+
+        if max_error is not None:
+            with np.errstate(invalid='ignore', over='ignore'):
+                error = float(np.max(np.abs(self.decode(stored, array.dtype, storage).astype(np.float64) - array)))
+            # not (error <= max_error) - also catches nan and inf
+            if not error <= max_error:
+                self._warn(key, f'FuseDtypePolicy: {key} error {error} exceeds {max_error}, stored in full precision')
+                return array, None
+        return stored, storage
+
+    def _warn(self, key: str, msg: str) -> None:
+        """
+        Log a warning once per key
+        """
+        if key not in self._warned:
+            self._warned.add(key)
+            logging.getLogger('Fuse').warning(msg)
+
+    @staticmethod
+    def decode(stored: np.ndarray, dtype: Union[str, np.dtype], storage: Tuple[str, float, float]) -> np.ndarray:
+        """
+        Up convert a stored array to its original dtype
+        :param stored: the stored array
+        :param dtype: the original dtype
+        :param storage: the storage parameters returned by encode()
+        :return: new array of the original dtype
+        """
+        dtype = np.dtype(dtype)
+        storage_dtype, scale, offset = storage
+        if np.dtype(storage_dtype).kind == 'f':
+            return stored.astype(dtype)
+        return stored.astype(dtype) * dtype.type(scale) + dtype.type(offset)
+
+
+class FuseEncodedArrayRef:
+    """
+    Placeholder stored in the pickled sample skeleton instead of an encoded array
+    """
+    __slots__ = ('codec_spec', 'dtype', 'shape', 'is_tensor', 'offset', 'length', 'storage')
+
+    def __init__(self, codec_spec: str, dtype: str, shape: Tuple[int, ...], is_tensor: bool, offset: int, length: int,
+                 storage: Optional[Tuple[str, float, float]] = None):
+        self.codec_spec = codec_spec
+        self.dtype = dtype
+        self.shape = shape
+        self.is_tensor = is_tensor
+        self.offset = offset
+        self.length = length
+        # reduced precision storage parameters, see FuseDtypePolicy
+        self.storage = storage
+
+
+class FuseSampleSerializer:
+    """
+    Serialize a sample to bytes, compressing each tensor / numpy array with the codec selected by its key.
+    Format: magic, the codec of the skeleton, the skeleton - the pickled sample with each array replaced by FuseEncodedArrayRef,
+    followed by the encoded arrays.
+    The format is self describing: deserialize() does not depend on the serializer configuration.
+    """
+    MAGIC = b'FSC1'
+    _HEADER = struct.Struct('<4sHQ')
+
+    def __init__(self, codec: str = 'none', codec_policy: Optional[Dict[str, str]] = None, dtype_policy: Optional[Dict[str, str]] = None):
+        """
+        :param codec: default codec specification, see create_codec(). Used for the skeleton and for arrays not matched by codec_policy.
+        :param codec_policy: Optional. map key pattern (fnmatch style, e.g. 'data.input.*') to codec specification.
+                             The first matching pattern is used.
+                             e.g. {'data.input.image': 'lz4', 'data.gt.mask': 'rle+zstd:3', '*': 'shuffle+zstd'}
+        :param dtype_policy: Optional. map key pattern to reduced precision storage dtype of floating point arrays,
+                             e.g. {'data.input.image': 'uint8:0.01'}. See FuseDtypePolicy
+        """
+        self._codec_spec = codec
+        self._codec_policy = codec_policy or {}
+        self._dtype_policy = FuseDtypePolicy(dtype_policy) if dtype_policy else None
+        self._codecs: Dict[str, FuseCodecBase] = {}
+        # create the codecs now to fail early
+        for codec_spec in [codec] + list(self._codec_policy.values()):
+            self._get_codec(codec_spec)
+
+    def __getstate__(self) -> dict:
+        # codec objects might hold native resources, re-created on demand
+        state = self.__dict__.copy()
+        state['_codecs'] = {}
+        return state
+
+    def serialize(self, sample: Any, key: str = '') -> bytes:
+        """
+        :param sample: the sample to serialize
+        :param key: Optional. hierarchical key of the serialized value when it's a part of a sample, used to select the codec and dtype
+        :return: serialized sample
+        """
+        payloads = []
+        skeleton = self._encode_arrays(sample, key, payloads, [0])
+        skeleton_codec_spec = self._codec_spec.encode()
+        skeleton_data = self._get_codec(self._codec_spec).encode(pickle.dumps(skeleton, protocol=pickle.HIGHEST_PROTOCOL))
+        header = self._HEADER.pack(self.MAGIC, len(skeleton_codec_spec), len(skeleton_data))
+        return b''.join([header, skeleton_codec_spec, skeleton_data] + payloads)
+
+    def deserialize(self, data: Union[bytes, memoryview], timings: Optional[Dict[str, float]] = None) -> Any:
+        """
+        :param data: serialized sample, or plain pickled sample (previous format)
+        :param timings: Optional. the time spent decoding (decompressing) will be added to timings['decompress'], in seconds
+        :return: the sample
+        """
+        data = memoryview(data)
+        if not self.is_serialized(data):
+            return pickle.loads(data)
+
+        _, codec_spec_length, skeleton_length = self._HEADER.unpack_from(data)
+        position = self._HEADER.size
+        skeleton_codec_spec = bytes(data[position:position + codec_spec_length]).decode()
+        position += codec_spec_length
+        start = time.perf_counter()
+        skeleton_data = self._get_codec(skeleton_codec_spec).decode(data[position:position + skeleton_length])
+        if timings is not None:
+            timings['decompress'] = timings.get('decompress', 0.0) + time.perf_counter() - start
+        skeleton = pickle.loads(skeleton_data)
+        return self._decode_arrays(skeleton, data[position + skeleton_length:], timings)
+
+    @classmethod
+    def is_serialized(cls, data: Union[bytes, memoryview]) -> bool:
+        """
+        :return: True if data was created by serialize() - pickled data never starts with the magic
+        """
+        return bytes(data[:len(cls.MAGIC)]) == cls.MAGIC
+
+    def get_codec_spec(self, key: str) -> str:
+        """
+        :param key: hierarchical key of a sample field (e.g. 'data.input.image')
+        :return: the codec specification used for this key
+        """
+        for pattern, codec_spec in self._codec_policy.items():
+            if fnmatch.fnmatchcase(key, pattern):
+                return codec_spec
+        return self._codec_spec
+
+    def _get_codec(self, codec_spec: str) -> FuseCodecBase:
+        codec = self._codecs.get(codec_spec, None)
+        if codec is None:
+            codec = create_codec(codec_spec)
+            self._codecs[codec_spec] = codec
+        return codec
+
+    def _encode_arrays(self, value: Any, key: str, payloads: List[bytes], position: List[int]) -> Any:
+        """
+        Recursively encode the array leaves and replace them with FuseEncodedArrayRef
+        """
+        if isinstance(value, dict):
+            return {k: self._encode_arrays(v, f'{key}.{k}' if key else str(k), payloads, position) for k, v in value.items()}
+        if type(value) in (list, tuple):
+            return type(value)([self._encode_arrays(v, key, payloads, position) for v in value])
+
+        is_tensor = isinstance(value, torch.Tensor)
+        if is_tensor:
+            if value.dtype == torch.bfloat16 or value.is_sparse:
+                # not supported by numpy - keep it in the skeleton
+                return value
+            array = value.detach().cpu().numpy()
+        elif isinstance(value, np.ndarray):
+            array = value
+        else:
+            return value
+        if array.dtype.hasobject:
+            return value
+
+        codec_spec = self.get_codec_spec(key)
+        array = np.ascontiguousarray(array)
+        stored, storage = self._dtype_policy.encode(key, array) if self._dtype_policy is not None else (array, None)
+        payload = self._get_codec(codec_spec).encode(stored.reshape(-1).view(np.uint8), stored.dtype.itemsize)
+        payloads.append(payload)
+        ref = FuseEncodedArrayRef(codec_spec, array.dtype.str, array.shape, is_tensor, position[0], len(payload), storage)
+        position[0] += len(payload)
+        return ref
+
+    def _decode_arrays(self, value: Any, payloads: memoryview, timings: Optional[Dict[str, float]] = None) -> Any:
+        """
+        Recursively replace FuseEncodedArrayRef with the decoded arrays
+        """
+        if isinstance(value, dict):
+            return {k: self._decode_arrays(v, payloads, timings) for k, v in value.items()}
+        if type(value) in (list, tuple):
+            return type(value)([self._decode_arrays(v, payloads, timings) for v in value])
+        if not isinstance(value, FuseEncodedArrayRef):
+            return value
+
+        dtype = np.dtype(value.dtype)
+        # written by previous versions - no storage attribute
+        storage = getattr(value, 'storage', None)
+        stored_dtype = np.dtype(storage[0]) if storage is not None else dtype
+        start = time.perf_counter()
+        data = self._get_codec(value.codec_spec).decode(payloads[value.offset:value.offset + value.length], stored_dtype.itemsize)
+        if timings is not None:
+            timings['decompress'] = timings.get('decompress', 0.0) + time.perf_counter() - start
+        if storage is not None:
+            array = FuseDtypePolicy.decode(np.frombuffer(data, dtype=stored_dtype), dtype, storage).reshape(value.shape)
+        else:
+            # decoded data or a view of the serialized sample (no compression) - copied once, to a writable array that owns its memory
+            array = np.frombuffer(data, dtype=dtype).reshape(value.shape).copy()
+        if value.is_tensor:
+            return torch.from_numpy(array)
+        return array
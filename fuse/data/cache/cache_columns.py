@@ -0,0 +1,343 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Columnar cache of sample fields
+"""
+import logging
+import os
+import pickle
+import time
+from multiprocessing import Manager
+from typing import Hashable, Any, List, Optional, Dict, Sequence, Tuple, Union
+
+import numpy as np
+import torch
+
+from fuse.data.cache.cache_base import FuseCacheBase
+from fuse.data.cache.cache_files import FuseCacheFiles
+from fuse.utils.file_io.atomic_file import AtomicFileWriter
+from fuse.utils.file_io.file_io import create_dir, remove_dir_content
+
+
+class FuseCacheColumns(FuseCacheBase):
+    """
+    Cache of sample fields (e.g. labels) stored in columnar format: a contiguous array per field and a descriptor index.
+    The keys are (sample descriptor, field) tuples, compatible with the cache used by dataset.cache_sample_fields().
+    Numeric scalars and small arrays of fixed shape are stored as numpy arrays (memory mapped when loaded from disk),
+    so get_column() reads a field of the entire dataset with a single vectorized operation.
+    Other values (strings, None, variable shapes) are stored in object arrays.
+    Values are written by a single process and merged into the columns in save().
+    A fields cache dir created by previous versions (FuseCacheFiles in single file mode) is converted on load.
+    """
+
+    def __init__(self, cache_file_dir: Optional[str], reset_cache: bool):
+        """
+        :param cache_file_dir: path to cache dir, None to keep the columns in memory only
+        :param reset_cache: reset previous cache if exist or continue
+        """
+        super().__init__()
+        self._cache_file_dir = cache_file_dir
+        self._cache_index_file_name = os.path.join(cache_file_dir, 'columns_index.pkl') if cache_file_dir is not None else None
+
+        if cache_file_dir is not None:
+            create_dir(cache_file_dir)
+
+        if reset_cache or cache_file_dir is None:
+            self.reset()
+        elif not os.path.exists(self._cache_index_file_name):
+            if os.path.exists(os.path.join(cache_file_dir, 'cache_index.pkl')):
+                self._convert_legacy_cache()
+            else:
+                if os.listdir(cache_file_dir):
+                    logging.getLogger('Fuse').warning(f'FuseCacheColumns: unknown content in fields cache dir {cache_file_dir} - deleted')
+                    remove_dir_content(cache_file_dir, force_reset=True)
+                self.reset()
+        else:
+            with open(self._cache_index_file_name, 'rb') as index_file:
+                index = pickle.load(index_file)
+            self._descriptors: List[Hashable] = index['descriptors']
+            self._descriptor_to_row = {desc: row for row, desc in enumerate(self._descriptors)}
+            # field name -> dict with the column properties: file name, is_tensor, is_object
+            self._fields: Dict[str, Dict[str, Any]] = index['fields']
+            self._columns: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}
+            self._pending: Dict[str, Dict[Hashable, Any]] = {}
+            self._cache_enable = False
+
+    def _convert_legacy_cache(self) -> None:
+        """
+        Convert a fields cache dir created by previous versions (FuseCacheFiles in single file mode) to columnar format.
+        If it can't be read, it's deleted and the fields will be cached again.
+        """
+        lgr = logging.getLogger('Fuse')
+        try:
+            legacy_cache = FuseCacheFiles(self._cache_file_dir, reset_cache=False)
+            values = {key: legacy_cache[key] for key in legacy_cache.get_all_keys(include_none=True)}
+        except Exception as e:
+            lgr.warning(f'FuseCacheColumns: failed to read legacy fields cache {self._cache_file_dir} - deleted: {e}')
+            values = {}
+        lgr.info(f'FuseCacheColumns: converting legacy fields cache {self._cache_file_dir} - {len(values)} values')
+
+        remove_dir_content(self._cache_file_dir, force_reset=True)
+        self.reset()
+        self.start_caching()
+        for key, value in values.items():
+            self[key] = value
+        self.save()
+
+    def __getstate__(self) -> dict:
+        # columns stored on disk are (memory) mapped again on demand
+        state = self.__dict__.copy()
+        if self._cache_file_dir is not None:
+            state['_columns'] = {}
+        return state
+
+    def __contains__(self, key: Hashable) -> bool:
+        """
+        See base class
+        """
+        desc, field = key
+        if desc in self._pending.get(field, {}):
+            return True
+        row = self._descriptor_to_row.get(desc, None)
+        if row is None or field not in self._fields:
+            return False
+        return bool(self._get_column(field)[1][row])
+
+    def __getitem__(self, key: Hashable) -> Any:
+        """
+        See base class
+        """
+        desc, field = key
+        pending = self._pending.get(field, {})
+        if desc in pending:
+            self._cache_stats.record(counters={'hits': 1})
+            return pending[desc]
+        if key not in self:
+            self._cache_stats.record(counters={'misses': 1})
+            return None
+        self._cache_stats.record(counters={'hits': 1})
+
+        values, _ = self._get_column(field)
+        value = values[self._descriptor_to_row[desc]]
+        if self._fields[field]['is_tensor']:
+            return torch.tensor(value)
+        return value
+
+    def __delitem__(self, key: Hashable) -> None:
+        """
+        Not supported
+        """
+        raise NotImplementedError
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        """
+        See base class
+        """
+        if not self._cache_enable:
+            raise Exception('First start caching using function start_caching()')
+        desc, field = key
+        self._pending.setdefault(field, {})[desc] = value
+        self._cache_stats.record(counters={'writes': 1})
+
+    def save(self) -> None:
+        """
+        Merge the values written into the columns and save them
+        """
+        self._cache_enable = False
+        if len(self._pending) == 0:
+            return
+
+        # extend the descriptor index
+        for desc_values in self._pending.values():
+            for desc in desc_values:
+                if desc not in self._descriptor_to_row:
+                    self._descriptor_to_row[desc] = len(self._descriptors)
+                    self._descriptors.append(desc)
+
+        # merge the pending values into the columns, including the columns not modified - extend them to the new length
+        for field in set(self._fields.keys()) | set(self._pending.keys()):
+            self._merge_column(field, self._pending.get(field, {}))
+        self._pending = {}
+
+        if self._cache_file_dir is not None:
+            with AtomicFileWriter(filename=self._cache_index_file_name) as index_file:
+                pickle.dump({'descriptors': self._descriptors, 'fields': self._fields}, index_file)
+            # map the saved columns
+            self._columns = {}
+
+    def exist(self) -> bool:
+        """
+        See base class
+        """
+        return len(self._descriptors) > 0
+
+    def reset(self) -> None:
+        """
+        See base class
+        """
+        if self._cache_file_dir is not None:
+            remove_dir_content(self._cache_file_dir)
+        self._descriptors = []
+        self._descriptor_to_row = {}
+        self._fields = {}
+        self._columns = {}
+        self._pending = {}
+        self._cache_enable = False
+
+    def get_all_keys(self, include_none: bool = False) -> List[Hashable]:
+        """
+        See base class
+        """
+        keys = []
+        for field in self._fields:
+            values, valid = self._get_column(field)
+            for row in np.flatnonzero(valid):
+                if include_none or values[row] is not None:
+                    keys.append((self._descriptors[row], field))
+        for field, desc_values in self._pending.items():
+            keys.extend([(desc, field) for desc, value in desc_values.items() if include_none or value is not None])
+        return keys
+
+    def start_caching(self, manager: Optional[Manager] = None) -> None:
+        """
+        See base class. Multiprocessing manager is not required - values are written only by the main process.
+        """
+        self._cache_enable = True
+
+    def get_column(self, field: str, descriptors: Sequence[Hashable]) -> Optional[Union[np.ndarray, torch.Tensor, List[Any]]]:
+        """
+        Get the values of a field for a list of samples
+        :param field: the field (key in sample_dict)
+        :param descriptors: samples descriptors
+        :return: numpy array (or tensor if the values were tensors) for numeric fields, list of values otherwise.
+                 None if the field is not cached for any of the descriptors.
+        """
+        if field not in self._fields or len(self._pending) != 0:
+            return None
+        start = time.perf_counter()
+        values, valid = self._get_column(field)
+
+        # fast path - the same descriptors, in the same order
+        if isinstance(descriptors, list) and descriptors == self._descriptors:
+            if not valid.all():
+                return None
+        else:
+            rows = np.fromiter((self._descriptor_to_row.get(desc, -1) for desc in descriptors), dtype=np.int64, count=len(descriptors))
+            if np.any(rows < 0) or not valid[rows].all():
+                return None
+            values = values[rows]
+
+        if values.dtype.hasobject:
+            self._cache_stats.record(counters={'hits': len(values)}, timers={'read': time.perf_counter() - start})
+            return list(values)
+        # copy - the column might be memory mapped (read only)
+        values = np.array(values)
+        self._cache_stats.record(counters={'hits': len(values), 'bytes_read': values.nbytes}, timers={'read': time.perf_counter() - start})
+        if self._fields[field]['is_tensor']:
+            return torch.from_numpy(values)
+        return values
+
+    def _get_column(self, field: str) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: the values and the valid mask of a column, loaded on demand
+        """
+        column = self._columns.get(field, None)
+        if column is None:
+            field_prop = self._fields[field]
+            file_name = os.path.join(self._cache_file_dir, field_prop['file_name'])
+            # object arrays cannot be memory mapped
+            values = np.load(file_name + '.npy', mmap_mode=None if field_prop['is_object'] else 'r', allow_pickle=field_prop['is_object'])
+            valid = np.load(file_name + '_valid.npy')
+            column = (values, valid)
+            self._columns[field] = column
+        return column
+
+    def _merge_column(self, field: str, desc_values: Dict[Hashable, Any]) -> None:
+        """
+        Create a column of the current length including the existing values of the field and the new ones
+        """
+        num_rows = len(self._descriptors)
+        if field in self._fields:
+            old_values, old_valid = self._get_column(field)
+            is_tensor = self._fields[field]['is_tensor']
+        else:
+            old_values, old_valid = np.empty(0, dtype=np.float64), np.zeros(0, dtype=bool)
+            is_tensor = None
+
+        rows = np.array([self._descriptor_to_row[desc] for desc in desc_values.keys()], dtype=np.int64)
+        new_values = list(desc_values.values())
+        if len(new_values) > 0:
+            values_is_tensor = all(isinstance(value, torch.Tensor) for value in new_values)
+            is_tensor = values_is_tensor if is_tensor is None else (is_tensor and values_is_tensor)
+        new_values = self._to_array(new_values)
+
+        # the column dtype - numeric if both the existing and the new values are numeric with the same shape
+        if old_values.dtype.hasobject or new_values.dtype.hasobject or \
+                (len(old_values) > 0 and len(new_values) > 0 and old_values.shape[1:] != new_values.shape[1:]):
+            dtype, shape = np.dtype(object), ()
+        else:
+            dtype = np.result_type(old_values, new_values) if len(old_values) > 0 else new_values.dtype
+            shape = new_values.shape[1:] if len(new_values) > 0 else old_values.shape[1:]
+
+        values = np.zeros((num_rows,) + shape, dtype=dtype)
+        valid = np.zeros(num_rows, dtype=bool)
+        if dtype.hasobject:
+            values[:len(old_values)] = self._to_object_array(old_values)
+            values[rows] = self._to_object_array(new_values)
+        else:
+            values[:len(old_values)] = old_values
+            values[rows] = new_values
+        valid[:len(old_valid)] = old_valid
+        valid[rows] = True
+
+        file_name = self._fields[field]['file_name'] if field in self._fields else f'column_{len(self._fields)}'
+        self._fields[field] = {'file_name': file_name, 'is_tensor': bool(is_tensor) and not dtype.hasobject, 'is_object': dtype.hasobject}
+        if self._cache_file_dir is not None:
+            file_name = os.path.join(self._cache_file_dir, file_name)
+            with AtomicFileWriter(filename=file_name + '.npy') as column_file:
+                np.save(column_file, values, allow_pickle=dtype.hasobject)
+            with AtomicFileWriter(filename=file_name + '_valid.npy') as column_file:
+                np.save(column_file, valid)
+        self._columns[field] = (values, valid)
+
+    @staticmethod
+    def _to_array(values: List[Any]) -> np.ndarray:
+        """
+        Convert list of values to a numeric array if possible, otherwise to an object array
+        """
+        try:
+            array = np.stack([value.detach().cpu().numpy() if isinstance(value, torch.Tensor) else np.asarray(value) for value in values]) \
+                if len(values) > 0 else np.empty(0)
+            if array.dtype.kind in 'biufc':
+                return array
+        except:
+            # different shapes
+            pass
+        return FuseCacheColumns._to_object_array(values)
+
+    @staticmethod
+    def _to_object_array(values: Union[List[Any], np.ndarray]) -> np.ndarray:
+        """
+        1D object array - each element is a value (avoid numpy creating a multi dimensional array of nested sequences)
+        """
+        array = np.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            array[i] = value
+        return array
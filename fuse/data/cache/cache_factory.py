@@ -0,0 +1,71 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Create cache object given the cache destination and type
+"""
+import logging
+
+from fuse.data.cache.cache_base import FuseCacheBase
+from fuse.data.cache.cache_files import FuseCacheFiles
+from fuse.data.cache.cache_memory import FuseCacheMemory
+from fuse.data.cache.cache_mmap import FuseCacheMmap
+from fuse.data.cache.cache_shards import FuseCacheShards
+from fuse.data.cache.cache_shared_memory import FuseCacheSharedMemory
+from fuse.data.cache.cache_tiered import FuseCacheTiered
+
+# disk cache types supported by create_cache()
+CACHE_TYPES = {
+    'files': FuseCacheFiles,
+    'shards': FuseCacheShards,
+    'mmap': FuseCacheMmap,
+    'shared_memory': FuseCacheSharedMemory,
+}
+
+
+def create_cache(cache_dest: str, reset_cache: bool, cache_type: str = 'files', memory_budget: int = 0, **cache_kwargs) -> FuseCacheBase:
+    """
+    Create cache object
+    :param cache_dest: 'memory' to cache to memory, otherwise path to cache dir
+    :param reset_cache: reset previous cache if exist or continue
+    :param cache_type: the disk cache type (ignored when cache_dest == 'memory', unless cache_type == 'shared_memory'):
+                       'files'  - file per sample (FuseCacheFiles)
+                       'shards' - samples appended to a few large shard files (FuseCacheShards)
+                       'mmap'   - zero copy, memory mapped tensors and numpy arrays (FuseCacheMmap)
+                       'shared_memory' - in-memory cache shared by all the processes, stored in /dev/shm (FuseCacheSharedMemory).
+                                         Use cache_dest='memory' for a temporary cache, or a path on tmpfs (e.g. '/dev/shm/my_cache')
+    :param memory_budget: if > 0, the most recently used samples will be kept in memory, up to memory_budget bytes per process,
+                          in front of the disk cache (FuseCacheTiered)
+    :param cache_kwargs: additional arguments for the cache constructor
+    :return: the cache object
+    """
+    if cache_dest == 'memory':
+        if cache_type == 'shared_memory':
+            return FuseCacheSharedMemory(None, reset_cache, **cache_kwargs)
+        return FuseCacheMemory()
+
+    if cache_type not in CACHE_TYPES:
+        msg = f'Unknown cache_type {cache_type}, expecting one of {list(CACHE_TYPES.keys())}'
+        logging.getLogger('Fuse').error(msg)
+        raise Exception(msg)
+
+    cache = CACHE_TYPES[cache_type](cache_dest, reset_cache, **cache_kwargs)
+    if memory_budget > 0:
+        cache = FuseCacheTiered(cache, memory_budget)
+    return cache
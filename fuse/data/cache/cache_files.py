@@ -21,31 +21,67 @@ Created on June 30, 2021
 Cache to file per sample
 """
 import gzip
+import itertools
 import logging
 import os
 import pickle
-import traceback
+import time
+import uuid
 from multiprocessing import Manager
-import multiprocessing
-from typing import Hashable, Any, List
+from typing import Hashable, Any, List, Optional, Dict, Tuple
 import torch
 torch.multiprocessing.set_sharing_strategy('file_system')
 
 from fuse.data.cache.cache_base import FuseCacheBase
+from fuse.data.cache.cache_blobs import FuseCacheBlobStore
+from fuse.data.cache.cache_codecs import FuseSampleSerializer
+from fuse.data.cache.cache_index_journal import FuseCacheIndexJournal
 from fuse.utils.file_io.atomic_file import AtomicFileWriter
 from fuse.utils.file_io.file_io import create_dir, remove_dir_content
 
 
 class FuseCacheFiles(FuseCacheBase):
-    def __init__(self, cache_file_dir: str, reset_cache: bool, single_file: bool=False):
+    EVICTION_POLICIES = ('lru', 'lrc')
+
+    def __init__(self, cache_file_dir: str, reset_cache: bool, single_file: bool=False,
+                 codec: Optional[str] = None, codec_policy: Optional[Dict[str, str]] = None,
+                 dtype_policy: Optional[Dict[str, str]] = None,
+                 max_bytes: Optional[int] = None, eviction_policy: str = 'lru',
+                 dedup_min_size: Optional[int] = None, dedup_memory_budget: int = 2 ** 28):
         """
         :param cache_file_dir: path to cache dir
         :param reset_cache: reset previous cache if exist or continue
+        :param codec: Optional. compression codec of the samples written, e.g. 'lz4', 'zstd:3', 'shuffle+zstd'.
+                      See fuse.data.cache.cache_codecs.create_codec(). If None and no codec_policy, samples are pickled and gzipped.
+        :param codec_policy: Optional. map key pattern to codec, See fuse.data.cache.cache_codecs.FuseSampleSerializer
+        :param dtype_policy: Optional. map key pattern to reduced precision storage dtype of floating point arrays,
+                             e.g. {'data.input.image': 'uint8:0.01'}. See fuse.data.cache.cache_codecs.FuseDtypePolicy
+        :param max_bytes: Optional. disk quota - once the sample files exceed max_bytes, samples are evicted (see evict()).
+                          Evicted samples are recomputed by the dataset on the next access.
+        :param eviction_policy: 'lru' - evict the least recently used samples first (the access time of each file is updated on read),
+                                'lrc' - evict the least recently created samples first
+        :param dedup_min_size: Optional. tensors and arrays of at least dedup_min_size bytes are stored once in a shared blob store,
+                               keyed by their content, so samples carrying the same tensor don't store a copy each.
+                               See fuse.data.cache.cache_blobs.FuseCacheBlobStore.
+                               Saved in the cache properties - an existing cache written with deduplication is read with it,
+                               regardless of this argument.
+        :param dedup_memory_budget: max size (in bytes) of the shared tensors kept in memory, per process. Used only with dedup_min_size.
         """
         super().__init__()
 
+        if eviction_policy not in self.EVICTION_POLICIES:
+            msg = f'FuseCacheFiles: unknown eviction policy {eviction_policy}, expected one of {self.EVICTION_POLICIES}'
+            logging.getLogger('Fuse').error(msg)
+            raise Exception(msg)
+        self._max_bytes = max_bytes
+        self._eviction_policy = eviction_policy
+        # bytes written by this process since the quota was checked
+        self._bytes_since_evict = 0
+
         self._cache_file_dir = cache_file_dir
-        self._save_cache_index = 100
+        # samples are written using the serializer, reading supports both formats
+        self._serializer = FuseSampleSerializer(codec or 'none', codec_policy, dtype_policy)
+        self._use_serializer = codec is not None or bool(codec_policy) or bool(dtype_policy)
 
         # create dir if not already exist
         create_dir(cache_file_dir)
@@ -53,28 +89,21 @@ class FuseCacheFiles(FuseCacheBase):
         # pointer to cache index
         self._cache_file_name = os.path.join(self._cache_file_dir, 'cache_index.pkl')
         self._cache_prop_file_name = os.path.join(self._cache_file_dir, 'cache_properties.pkl')
+        # the index is persisted as compacted index file and append-only journal
+        self._cache_index_journal = FuseCacheIndexJournal(self._cache_file_name)
 
         # reset or load from disk
-        if reset_cache or not os.path.exists(self._cache_file_name):
+        if reset_cache or not self._cache_index_journal.exist():
             self.reset()
             self.single_file = single_file
+            self._dedup_min_size = dedup_min_size
             # save initial properties
-            with AtomicFileWriter(filename=self._cache_prop_file_name) as cache_prop_file:
-                pickle.dump({'single_file': self.single_file}, cache_prop_file)
+            self._save_properties()
         else:
-            # get last modified time of the index
-            self._cache_index_mtime = os.path.getmtime(self._cache_file_name)
-
-            # load current cache
-            try:
-                with open(self._cache_file_name, 'rb') as cache_index_file:
-                    self._cache_index = pickle.load(cache_index_file)
-            except:
-                # backward compatibility - used to be saved in gz format
-                with gzip.open(self._cache_file_name, 'rb') as cache_index_file:
-                    self._cache_index = pickle.load(cache_index_file)
-            self._cache_list = list(self._cache_index.keys())
-            self._cache_size = len(self._cache_list)
+            # load current cache - compacted index and the journal tail
+            self._cache_index = self._cache_index_journal.load()
+            self._cache_enable = False
+            self._writer = None
 
             # load mode for backward compatibility
             try:
@@ -82,8 +111,36 @@ class FuseCacheFiles(FuseCacheBase):
                     cache_prop = pickle.load(cache_prop_file)
                     self.single_file = cache_prop['single_file']
             except:
+                cache_prop = {}
                 self.single_file = False
 
+            # the samples already written refer to the blob store - keep reading (and writing) with deduplication
+            self._dedup_min_size = cache_prop.get('dedup_min_size', None)
+            if dedup_min_size is not None and dedup_min_size != self._dedup_min_size and not self.single_file:
+                self._dedup_min_size = dedup_min_size
+                self._save_properties()
+
+        if max_bytes is not None and self.single_file:
+            msg = 'FuseCacheFiles: disk quota (max_bytes) is not supported in single_file mode'
+            logging.getLogger('Fuse').error(msg)
+            raise Exception(msg)
+        if dedup_min_size is not None and self.single_file:
+            msg = 'FuseCacheFiles: deduplication (dedup_min_size) is not supported in single_file mode'
+            logging.getLogger('Fuse').error(msg)
+            raise Exception(msg)
+
+        if self._dedup_min_size is not None:
+            blob_serializer = self._serializer if self._use_serializer else FuseSampleSerializer('gzip')
+            self._blob_store = FuseCacheBlobStore(cache_file_dir, blob_serializer, min_size=self._dedup_min_size,
+                                                  memory_budget=dedup_memory_budget)
+        else:
+            self._blob_store = None
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_writer'] = None
+        return state
+
     def __contains__(self, key: Hashable) -> bool:
         """
         See base class
@@ -95,28 +152,66 @@ class FuseCacheFiles(FuseCacheBase):
         See base class
         """
         if self.single_file:
-            return self._cache_index.get(key, None)
+            value = self._cache_index.get(key, None)
+            self._cache_stats.record(counters={'hits' if value is not None else 'misses': 1})
+            return value
 
         value_file_name = self._cache_index.get(key, None)
         if value_file_name is None:
+            self._cache_stats.record(counters={'misses': 1})
             return None
         value_file_name = os.path.join(self._cache_file_dir, value_file_name)
 
-        # make sure file not exist
-        if os.path.exists(value_file_name):
-            # store the file
-            with gzip.open(value_file_name, 'rb') as value_file:
-                value = pickle.load(value_file)
+        start = time.perf_counter()
+        try:
+            with open(value_file_name, 'rb') as value_file:
+                data = value_file.read()
+                if self._eviction_policy == 'lru':
+                    self._touch(value_file.fileno())
+        except FileNotFoundError:
+            # evicted, possibly by another process
+            self._cache_index.pop(key, None)
+            raise KeyError(f'cache file {value_file_name} not found, evicted from cache')
+        timers = {'read': time.perf_counter() - start}
+        start = time.perf_counter()
+        if value_file_name.endswith('.gz'):
+            value = pickle.loads(gzip.decompress(data))
         else:
-            raise Exception(f'cache file {value_file_name} not found')
+            value = self._serializer.deserialize(data, timers)
+        timers['unpickle'] = time.perf_counter() - start - timers.get('decompress', 0.0)
+        num_bytes = len(data)
+        if self._blob_store is not None:
+            start = time.perf_counter()
+            try:
+                value, blob_bytes = self._blob_store.restore(value)
+            except FileNotFoundError:
+                # a shared tensor was evicted - evict the sample as well
+                try:
+                    del self[key]
+                except KeyError:
+                    pass
+                raise KeyError(f'cache file {value_file_name} refers to a blob evicted from cache')
+            num_bytes += blob_bytes
+            timers['read'] += time.perf_counter() - start
+        self._cache_stats.record(counters={'hits': 1, 'bytes_read': num_bytes}, timers=timers)
 
         return value
 
     def __delitem__(self, key: Hashable) -> None:
         """
-        Not supported
+        See base class. Not supported in single_file mode.
+        Can be called by several processes, each of them records the deletion in its own journal fragment.
         """
-        raise NotImplementedError
+        if self.single_file:
+            raise NotImplementedError
+        value_file_name = self._cache_index.pop(key)
+        self._cache_index_journal.remove(key, value_file_name)
+        if value_file_name is not None:
+            try:
+                os.remove(os.path.join(self._cache_file_dir, value_file_name))
+            except FileNotFoundError:
+                # already evicted by another process
+                pass
 
     def __setitem__(self, key: Hashable, value: Any) -> None:
         """
@@ -125,45 +220,50 @@ class FuseCacheFiles(FuseCacheBase):
         if not self._cache_enable:
             raise Exception('First start caching using function start_caching()')
 
-        if self._cache_lock is None:
-            index = self._cache_size
-            self._cache_list.append(key)
-            self._cache_size = index + 1
-        else:
-            with self._cache_lock:
-                index = self._cache_size.value
-                self._cache_list.append(key)
-                self._cache_size.value = index + 1
-
+        self._cache_stats.record(counters={'writes': 1})
         # if value is none, just update cache index
         if value is None:
             self._cache_index[key] = None
+            self._cache_index_journal.append(key, None)
             return
         if self.single_file:
             self._cache_index[key] = value
+            self._cache_index_journal.append(key, value)
         else:
-            value_file_name = str(index).zfill(10) + '.pkl.gz'
+            value_file_name = self._get_value_file_name()
             value_abs_file_name = os.path.join(self._cache_file_dir, value_file_name)
-            self._cache_index[key] = value_file_name
 
             # make sure file not exist
             if os.path.exists(value_abs_file_name):
                 logging.getLogger('Fuse').warning(f'cache file {value_abs_file_name} unexpectedly exist, overriding it.')
 
             # store the file
+            start = time.perf_counter()
+            blob_bytes = 0
+            if self._blob_store is not None:
+                # the shared tensors are written here, counted in the encode time
+                value, blob_bytes = self._blob_store.store(value)
+            if self._use_serializer:
+                data = self._serializer.serialize(value)
+            else:
+                # compressed by AtomicFileWriter (.gz file name), so counted in the write time
+                data = pickle.dumps(value)
+            encode_time = time.perf_counter() - start
+            start = time.perf_counter()
             with AtomicFileWriter(value_abs_file_name) as value_file:
-                pickle.dump(value, value_file)
+                value_file.write(data)
+            self._cache_stats.record(counters={'bytes_written': len(data) + blob_bytes},
+                                     timers={'encode': encode_time, 'write': time.perf_counter() - start})
 
-            # store the cache index - just for a case of crashing
-            if index % self._save_cache_index == 0:
-                try:
-                    with AtomicFileWriter(filename=self._cache_file_name) as cache_index_file:
-                        pickle.dump(dict(self._cache_index), cache_index_file)
-                except:
-                    # do not trow error- just print warning
-                    lgr = logging.getLogger('Fuse')
-                    track = traceback.format_exc()
-                    lgr.warning(track)
+            # update the index and append it to the journal - just for a case of crashing
+            self._cache_index[key] = value_file_name
+            self._cache_index_journal.append(key, value_file_name)
+
+            # check the disk quota once in a while - every 10% of the quota written by this process
+            if self._max_bytes is not None:
+                self._bytes_since_evict += len(data) + blob_bytes
+                if self._bytes_since_evict >= self._max_bytes // 10:
+                    self.evict()
 
     def save(self) -> None:
         """
@@ -171,15 +271,14 @@ class FuseCacheFiles(FuseCacheBase):
         """
         # disable caching
         self._cache_enable = False
+        self._writer = None
 
-        with AtomicFileWriter(filename=self._cache_file_name) as cache_index_file:
-            pickle.dump(dict(self._cache_index), cache_index_file)
+        if self._max_bytes is not None:
+            self.evict()
 
-        # move back to simple data structures
-        self._cache_index = dict(self._cache_index)
-        self._cache_list = list(self._cache_list)
-        self._cache_size = len(self._cache_list)
-        self._cache_lock = None
+        # merge the updates of all the writers (processes) and compact the journal into the index file
+        self._cache_index = self._cache_index_journal.load()
+        self._cache_index_journal.compact(self._cache_index)
 
     def exist(self) -> bool:
         """
@@ -192,15 +291,13 @@ class FuseCacheFiles(FuseCacheBase):
         See base class
         """
         # make sure the dir content is empty
+        self._cache_index_journal.close()
         remove_dir_content(self._cache_file_dir)
 
         # create empty data structures
         self._cache_enable = False
         self._cache_index = {}
-        self._cache_list = []
-        self._cache_size = 0
-        self._cache_index_mtime = -1
-        self._cache_lock = None
+        self._writer = None
 
     def get_all_keys(self, include_none: bool = False) -> List[Hashable]:
         """
@@ -211,18 +308,139 @@ class FuseCacheFiles(FuseCacheBase):
         else:
             return [key for key, value in self._cache_index.items() if value is not None]
 
-    def start_caching(self, manager: Manager):
+    def start_caching(self, manager: Optional[Manager] = None):
         """
         See base class
+        Lock-free: each process writes its own files and journal fragment, merged by save().
+        Therefore multiprocessing manager is not required and ignored.
         """
         self._cache_enable = True
-        # if manager is  None assume that the it's not multiprocessing caching
-        if manager is not None:
-            # create dictionary and adds it one by one to workaround multiprocessing limitation
-            cache_index = manager.dict()
-            for k, v in self._cache_index.items():
-                cache_index[k] = v
-            self._cache_index = cache_index
-            self._cache_list = manager.list(self._cache_list)
-            self._cache_size = manager.Value("i", len(self._cache_list))
-            self._cache_lock = manager.Lock()
+
+    def refresh(self) -> None:
+        """
+        See base class
+        """
+        self._cache_index_journal.update(self._cache_index)
+
+    def support_multiprocess_writing(self) -> bool:
+        """
+        See base class
+        """
+        return True
+
+    def is_compacted(self) -> bool:
+        """
+        See base class
+        """
+        return len(self._cache_index_journal.get_journal_files()) == 0
+
+    def is_deduplicated(self) -> bool:
+        """
+        :return: True if large tensors are stored in the shared blob store (see dedup_min_size)
+        """
+        return self._blob_store is not None
+
+    def get_entries(self) -> List[Tuple[Hashable, str, int, float, float]]:
+        """
+        The sample files currently in cache, including the samples written by other processes, and the shared blob files (see dedup_min_size)
+        :return: list of (key, file name, size in bytes, last access time, creation time), key is None for blob files.
+                 Empty list in single_file mode.
+        """
+        if self.single_file:
+            return []
+        self.refresh()
+        entries = []
+        for key, value_file_name in list(self._cache_index.items()):
+            if value_file_name is None:
+                continue
+            try:
+                stat = os.stat(os.path.join(self._cache_file_dir, value_file_name))
+            except FileNotFoundError:
+                continue
+            entries.append((key, value_file_name, stat.st_size, stat.st_atime, stat.st_mtime))
+        if self._blob_store is not None:
+            entries.extend((None,) + entry for entry in self._blob_store.get_entries())
+        return entries
+
+    def remove_entry(self, key: Optional[Hashable], file_name: str) -> bool:
+        """
+        Remove an entry returned by get_entries(). The samples referring to a removed blob are evicted once read.
+        :param key: the key of a sample, None for a blob file
+        :param file_name: the file name, relative to the cache dir
+        :return: True if removed, False if already removed (e.g. by another process)
+        """
+        if key is not None:
+            try:
+                del self[key]
+            except KeyError:
+                return False
+            return True
+        try:
+            os.remove(os.path.join(self._cache_file_dir, file_name))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def evict(self, max_bytes: Optional[int] = None, eviction_policy: Optional[str] = None) -> int:
+        """
+        Evict samples, according to the eviction policy, until the sample files fit in the disk quota
+        :param max_bytes: Optional. the quota in bytes, if None, max_bytes given in the constructor is used
+        :param eviction_policy: Optional. 'lru' or 'lrc', if None, the eviction policy given in the constructor is used
+        :return: number of bytes freed
+        """
+        max_bytes = max_bytes if max_bytes is not None else self._max_bytes
+        eviction_policy = eviction_policy if eviction_policy is not None else self._eviction_policy
+        self._bytes_since_evict = 0
+        if max_bytes is None:
+            return 0
+
+        entries = self.get_entries()
+        total_size = sum(entry[2] for entry in entries)
+        if total_size <= max_bytes:
+            return 0
+
+        # order by last access time (lru) or creation time (lrc)
+        time_index = 3 if eviction_policy == 'lru' else 4
+        entries.sort(key=lambda entry: entry[time_index])
+        num_bytes_freed = 0
+        num_evicted = 0
+        for key, file_name, size, _, _ in entries:
+            if total_size - num_bytes_freed <= max_bytes:
+                break
+            if not self.remove_entry(key, file_name):
+                # evicted by another process
+                continue
+            num_bytes_freed += size
+            num_evicted += 1
+        self._cache_stats.record(counters={'evictions': num_evicted})
+        return num_bytes_freed
+
+    def _save_properties(self) -> None:
+        """
+        Save the properties required to read the cache: the mode and the deduplication settings
+        """
+        with AtomicFileWriter(filename=self._cache_prop_file_name) as cache_prop_file:
+            pickle.dump({'single_file': self.single_file, 'dedup_min_size': self._dedup_min_size}, cache_prop_file)
+
+    @staticmethod
+    def _touch(fd: int) -> None:
+        """
+        Set the access time of a file to now - used by the lru eviction policy, regardless of the file system atime mount option
+        """
+        try:
+            os.utime(fd, ns=(time.time_ns(), os.fstat(fd).st_mtime_ns))
+        except OSError:
+            # e.g. read only file system
+            pass
+
+    def _get_value_file_name(self) -> str:
+        """
+        Unique file name without locking: writer id (unique per process) and a running index
+        :return: file name, relative to cache dir
+        """
+        writer = self._writer
+        if writer is None or writer[0] != os.getpid():
+            writer = (os.getpid(), uuid.uuid4().hex[:8], itertools.count())
+            self._writer = writer
+        extension = 'fsc' if self._use_serializer else 'pkl.gz'
+        return f'{writer[1]}_{str(next(writer[2])).zfill(10)}.{extension}'
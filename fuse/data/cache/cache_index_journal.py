@@ -0,0 +1,234 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Cache index persisted as a compacted index file and append-only journal fragments
+"""
+import fcntl
+import gzip
+import logging
+import os
+import pickle
+import struct
+import uuid
+from typing import Hashable, Any, Dict, List, Optional
+
+from fuse.utils.file_io.atomic_file import AtomicFileWriter
+
+
+class FuseCacheIndexJournal:
+    """
+    Persist a cache index (dictionary) as a compacted index file and append-only journal.
+    Each update appends a small record to the journal, instead of re-writing the entire index.
+    Each writing process appends to its own journal fragment ('<journal file name>.<writer id>'), so no locking or IPC is required.
+    load() reads the compacted index and replays all the journal fragments (crash recovery and merging the writers' updates),
+    compact() merges the journal into the index file.
+    Journal record format: 8 bytes length (little endian) followed by pickled (key, value),
+    or pickled (key, value, True) for a delete record - removes the key only if still mapped to value,
+    so a delete is never applied on a newer value written by another process, regardless of the order the fragments are replayed.
+    """
+    _RECORD_HEADER = struct.Struct('<Q')
+
+    def __init__(self, index_file_name: str, journal_file_name: Optional[str] = None):
+        """
+        :param index_file_name: path to compacted index file
+        :param journal_file_name: path to journal file. If None, will be set to '<index_file_name>.journal'
+        """
+        self._index_file_name = index_file_name
+        self._journal_file_name = journal_file_name if journal_file_name is not None else index_file_name + '.journal'
+
+        # journal fragment file descriptor - process specific, opened on demand
+        self._fd = None
+        self._fd_pid = None
+        # journal file name -> number of bytes already replayed, see update()
+        self._replayed: Dict[str, int] = {}
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_fd'] = None
+        state['_fd_pid'] = None
+        return state
+
+    def exist(self) -> bool:
+        """
+        :return: True if either the compacted index or the journal exist
+        """
+        return os.path.exists(self._index_file_name) or len(self.get_journal_files()) > 0
+
+    def get_journal_files(self) -> List[str]:
+        """
+        :return: list of journal files - the journal fragments and a single journal file created by previous versions
+        """
+        journal_dir, journal_base_name = os.path.split(self._journal_file_name)
+        if not os.path.isdir(journal_dir or '.'):
+            return []
+        return sorted([os.path.join(journal_dir, file_name) for file_name in os.listdir(journal_dir or '.')
+                       if file_name == journal_base_name or (file_name.startswith(journal_base_name + '.') and not file_name.endswith('.tmp'))])
+
+    def load(self) -> Dict[Hashable, Any]:
+        """
+        Load the compacted index and replay the journal
+        :return: the index
+        """
+        index = {}
+        if os.path.exists(self._index_file_name):
+            try:
+                with open(self._index_file_name, 'rb') as index_file:
+                    index = pickle.load(index_file)
+            except:
+                # backward compatibility - used to be saved in gz format
+                with gzip.open(self._index_file_name, 'rb') as index_file:
+                    index = pickle.load(index_file)
+
+        self._replayed = {}
+        for journal_file_name in self.get_journal_files():
+            self._replay(journal_file_name, index)
+
+        return index
+
+    def update(self, index: Dict[Hashable, Any]) -> None:
+        """
+        Apply on index the records appended to the journal since the last load() or update() - typically by other processes
+        :param index: the index to update
+        :return: None
+        """
+        for journal_file_name in self.get_journal_files():
+            self._replay(journal_file_name, index, truncate=False)
+
+    def append(self, key: Hashable, value: Any) -> None:
+        """
+        Append a record to the journal fragment of this process
+        :param key: index key
+        :param value: index value
+        :return: None
+        """
+        self._append_record((key, value))
+
+    def remove(self, key: Hashable, value: Any) -> None:
+        """
+        Append a delete record to the journal fragment of this process
+        :param key: index key
+        :param value: the value deleted - the key is removed only if still mapped to this value
+        :return: None
+        """
+        self._append_record((key, value, True))
+
+    def _append_record(self, record: tuple) -> None:
+        record = pickle.dumps(record, protocol=pickle.HIGHEST_PROTOCOL)
+        data = self._RECORD_HEADER.pack(len(record)) + record
+
+        if self._fd is None or self._fd_pid != os.getpid():
+            fragment_file_name = f'{self._journal_file_name}.{os.getpid()}_{uuid.uuid4().hex[:8]}'
+            self._fd = os.open(fragment_file_name, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            # shared lock - marks the fragment as in use, see compact()
+            fcntl.flock(self._fd, fcntl.LOCK_SH)
+            self._fd_pid = os.getpid()
+
+        # single write() call per record - records appended by several threads are not interleaved
+        view = memoryview(data)
+        while view:
+            num_bytes = os.write(self._fd, view)
+            view = view[num_bytes:]
+
+    def compact(self, index: Dict[Hashable, Any]) -> None:
+        """
+        Write the entire index to the compacted index file and delete the journal fragments.
+        Fragments still opened by other processes are kept - replaying them again is harmless.
+        :param index: the up to date index - typically the output of load() with the updates done since
+        :return: None
+        """
+        self.close()
+        with AtomicFileWriter(filename=self._index_file_name) as index_file:
+            pickle.dump(index, index_file)
+
+        # replaying the journal over the new index is harmless, so a crash before this point is fine
+        for journal_file_name in self.get_journal_files():
+            with open(journal_file_name, 'rb') as journal_file:
+                if self._try_lock(journal_file.fileno()):
+                    os.unlink(journal_file_name)
+
+    def close(self) -> None:
+        """
+        Close the journal fragment if opened by this process
+        """
+        if self._fd is not None and self._fd_pid == os.getpid():
+            os.close(self._fd)
+        self._fd = None
+        self._fd_pid = None
+
+    @staticmethod
+    def _try_lock(fd: int) -> bool:
+        """
+        :return: True if no other process is writing to the file
+        """
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except OSError:
+            return False
+
+    def _replay(self, journal_file_name: str, index: Dict[Hashable, Any], truncate: bool = True) -> None:
+        """
+        Apply journal records on index, starting from the records not replayed yet.
+        Truncates partially written record at the end of the journal (crash while writing)
+        :param journal_file_name: the journal fragment to replay
+        :param index: the index to update
+        :param truncate: if False, a partially written record is left as is - it might still being written
+        :return: None
+        """
+        start = self._replayed.get(journal_file_name, 0)
+        try:
+            with open(journal_file_name, 'rb') as journal_file:
+                journal_file.seek(start)
+                data = journal_file.read()
+        except FileNotFoundError:
+            # compacted by another process
+            return
+
+        position = 0
+        header_size = self._RECORD_HEADER.size
+        num_records = 0
+        while position + header_size <= len(data):
+            (record_size,) = self._RECORD_HEADER.unpack_from(data, position)
+            record_end = position + header_size + record_size
+            if record_end > len(data):
+                break
+            try:
+                record = pickle.loads(data[position + header_size:record_end])
+            except:
+                break
+            if len(record) == 3:
+                # delete record
+                key, value, _ = record
+                if key in index and index[key] == value:
+                    del index[key]
+            else:
+                key, value = record
+                index[key] = value
+            position = record_end
+            num_records += 1
+        self._replayed[journal_file_name] = start + position
+
+        if position != len(data) and truncate:
+            with open(journal_file_name, 'r+b') as journal_file:
+                # the tail might still being written by another process
+                if self._try_lock(journal_file.fileno()):
+                    logging.getLogger('Fuse').warning(f'cache index journal {journal_file_name}: '
+                                                      f'dropping partially written tail ({len(data) - position} bytes) after {num_records} records')
+                    journal_file.truncate(start + position)
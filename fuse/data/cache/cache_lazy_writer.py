@@ -0,0 +1,133 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Background cache writer used to cache samples on first read
+"""
+import copy
+import fcntl
+import hashlib
+import logging
+import os
+import pickle
+import queue
+import threading
+from multiprocessing.util import Finalize
+from typing import Hashable, Any
+
+from fuse.data.cache.cache_base import FuseCacheBase
+
+
+class FuseCacheLazyWriter:
+    """
+    Write samples to the cache in a background thread, so the reading process (e.g. DataLoader worker) is not blocked.
+    Concurrent computations of the same sample by several processes are avoided by a per-sample lock:
+    a byte range lock, in a single lock file, at an offset derived from the sample descriptor.
+    The lock is held from lock() until the sample is written (or unlock()) and released automatically if the process dies.
+    The writing thread and the lock file are process specific and created on demand.
+    """
+    # lock offsets are in [0, _LOCK_RANGE)
+    _LOCK_RANGE = 2 ** 62
+
+    def __init__(self, cache: FuseCacheBase, lock_file_name: str):
+        """
+        :param cache: the cache to write to - must support multiprocess writing
+        :param lock_file_name: path to the lock file, shared by all the processes
+        """
+        if not cache.support_multiprocess_writing():
+            msg = f'FuseCacheLazyWriter: cache {type(cache).__name__} does not support multiprocess writing'
+            logging.getLogger('Fuse').error(msg)
+            raise Exception(msg)
+        self._cache = cache
+        self._lock_file_name = lock_file_name
+        self._state_pid = None
+
+    def __getstate__(self) -> dict:
+        # the queue, thread and lock file are process specific
+        state = self.__dict__.copy()
+        state['_state_pid'] = None
+        for key in ['_queue', '_thread', '_lock_fd']:
+            state.pop(key, None)
+        return state
+
+    def lock(self, desc: Hashable) -> bool:
+        """
+        Lock the sample, wait if it's being computed by another process
+        :param desc: sample descriptor
+        :return: True if the lock was acquired immediately, False if waited for another process
+        """
+        self._init_process_state()
+        offset = self._get_lock_offset(desc)
+        try:
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB, 1, offset)
+            return True
+        except OSError:
+            # another process computes this sample - wait for it
+            fcntl.lockf(self._lock_fd, fcntl.LOCK_EX, 1, offset)
+            return False
+
+    def unlock(self, desc: Hashable) -> None:
+        """
+        Release the lock of a sample without writing it
+        :param desc: sample descriptor
+        """
+        fcntl.lockf(self._lock_fd, fcntl.LOCK_UN, 1, self._get_lock_offset(desc))
+
+    def write(self, desc: Hashable, sample: Any) -> None:
+        """
+        Queue a sample to be written by the background thread. The lock of the sample is released once written.
+        :param desc: sample descriptor
+        :param sample: the sample, copied - the caller may modify it (e.g. augmentation)
+        """
+        self._init_process_state()
+        self._queue.put((desc, copy.deepcopy(sample)))
+
+    def flush(self) -> None:
+        """
+        Wait until all the queued samples are written
+        """
+        if self._state_pid == os.getpid():
+            self._queue.join()
+
+    def _init_process_state(self) -> None:
+        if self._state_pid == os.getpid():
+            return
+        self._state_pid = os.getpid()
+        self._lock_fd = os.open(self._lock_file_name, os.O_RDWR | os.O_CREAT, 0o644)
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self._thread.start()
+        # write the queued samples before the process exits, including DataLoader worker processes
+        Finalize(None, self.flush, exitpriority=10)
+
+    def _writer_loop(self) -> None:
+        while True:
+            desc, sample = self._queue.get()
+            try:
+                self._cache[desc] = sample
+            except:
+                logging.getLogger('Fuse').exception(f'FuseCacheLazyWriter: failed to cache sample {desc}')
+            finally:
+                self.unlock(desc)
+                self._queue.task_done()
+
+    @classmethod
+    def _get_lock_offset(cls, desc: Hashable) -> int:
+        digest = hashlib.blake2b(pickle.dumps(desc, protocol=4), digest_size=8).digest()
+        return int.from_bytes(digest, 'little') % cls._LOCK_RANGE
@@ -21,7 +21,7 @@ Created on June 30, 2021
 Cache to Memory
 """
 from multiprocessing import Manager
-from typing import Hashable, Any, List
+from typing import Hashable, Any, List, Optional
 
 from fuse.data.cache.cache_base import FuseCacheBase
 
@@ -46,7 +46,9 @@ class FuseCacheMemory(FuseCacheBase):
         """
         See base class
         """
-        return self._cache_dict.get(key, None)
+        value = self._cache_dict.get(key, None)
+        self._cache_stats.record(counters={'hits' if key in self._cache_dict else 'misses': 1})
+        return value
 
     def __delitem__(self, key: Hashable) -> None:
         """
@@ -65,6 +67,7 @@ class FuseCacheMemory(FuseCacheBase):
             raise Exception('First start caching using function start_caching()')
 
         self._cache_dict[key] = value
+        self._cache_stats.record(counters={'writes': 1})
 
     def save(self) -> None:
         """
@@ -94,7 +97,7 @@ class FuseCacheMemory(FuseCacheBase):
         else:
             return [key for key, value in self._cache_dict.items() if value is not None]
 
-    def start_caching(self, manager: Manager) -> None:
+    def start_caching(self, manager: Optional[Manager] = None) -> None:
         """
         Moving to multiprocessing data structures
         """
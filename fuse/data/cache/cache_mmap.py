@@ -0,0 +1,170 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Memory mapped, zero copy, cache of tensors and numpy arrays
+"""
+import mmap
+import time
+from typing import Hashable, Any, Tuple, Optional, Dict, Union
+
+import numpy as np
+import torch
+
+from fuse.data.cache.cache_codecs import FuseDtypePolicy
+from fuse.data.cache.cache_shards import FuseCacheShards
+
+
+class FuseMmapArrayRef:
+    """
+    Placeholder stored in the pickled record instead of an array leaf
+    """
+    __slots__ = ('shard_name', 'offset', 'dtype', 'shape', 'is_tensor', 'storage')
+
+    def __init__(self, shard_name: str, offset: int, dtype: str, shape: Tuple[int, ...], is_tensor: bool,
+                 storage: Optional[Tuple[str, float, float]] = None):
+        self.shard_name = shard_name
+        self.offset = offset
+        self.dtype = dtype
+        self.shape = shape
+        self.is_tensor = is_tensor
+        # reduced precision storage parameters, see FuseDtypePolicy
+        self.storage = storage
+
+
+class FuseCacheMmap(FuseCacheShards):
+    """
+    Memory mapped cache.
+    Tensor and numpy array leaves of a sample are stored as raw, aligned arrays in the shard files.
+    The rest of the sample is stored as a small pickled record.
+    A cache hit returns views over the memory mapped shard files (torch.from_numpy() for tensors) - no copy and no unpickling of the arrays.
+    The OS page cache is shared between all the DataLoader workers and all the processes reading the same cache.
+    Each hit gets its own copy-on-write mapping: in-place modifications are private and never written back to the cache.
+    Arrays stored in reduced precision (dtype_policy) are up converted on read - a copy rather than a view.
+    """
+    CACHE_FORMAT = 'mmap'
+    ALIGNMENT = 64
+
+    def __init__(self, cache_file_dir: str, reset_cache: bool, max_shard_size: int = 2 ** 30, min_array_size: int = 1024,
+                 codec: Optional[str] = None, codec_policy: Optional[Dict[str, str]] = None,
+                 dtype_policy: Optional[Dict[str, str]] = None):
+        """
+        :param cache_file_dir: path to cache dir
+        :param reset_cache: reset previous cache if exist or continue
+        :param max_shard_size: a new shard file will be opened once a shard file reaches this size (in bytes)
+        :param min_array_size: arrays smaller than min_array_size bytes will be stored in the pickled record
+        :param codec: Optional. compression codec of the pickled record (memory mapped arrays are never compressed). See FuseCacheShards
+        :param codec_policy: Optional. See FuseCacheShards
+        :param dtype_policy: Optional. reduced precision storage of both memory mapped arrays and arrays kept in the record.
+                             See FuseCacheShards
+        """
+        self._min_array_size = min_array_size
+        self._dtype_policy = FuseDtypePolicy(dtype_policy) if dtype_policy else None
+        super().__init__(cache_file_dir, reset_cache, max_shard_size=max_shard_size, codec=codec, codec_policy=codec_policy,
+                         dtype_policy=dtype_policy)
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        """
+        See base class
+        """
+        if value is not None and self._cache_enable:
+            value = self._store_arrays(value)
+        super().__setitem__(key, value)
+
+    def _decode_value(self, data: Union[bytes, memoryview], timers: Dict[str, float]) -> Any:
+        """
+        See base class
+        """
+        record = self._loads(data, timers)
+        # mapping the arrays - the actual reading is deferred to the first access
+        start = time.perf_counter()
+        value = self._restore_arrays(record)
+        timers['read'] = timers.get('read', 0.0) + time.perf_counter() - start
+        return value
+
+    def _store_arrays(self, value: Any, key: str = '') -> Any:
+        """
+        Recursively write the array leaves to the shard file and replace them with FuseMmapArrayRef
+        :param key: hierarchical key of value in the sample (e.g. 'data.input.image'), used to select the storage dtype.
+                    List items share the key of the list, as in FuseSampleSerializer
+        """
+        if isinstance(value, dict):
+            return {k: self._store_arrays(v, f'{key}.{k}' if key else str(k)) for k, v in value.items()}
+        if type(value) in (list, tuple):
+            return type(value)([self._store_arrays(v, key) for v in value])
+
+        is_tensor = isinstance(value, torch.Tensor)
+        if is_tensor:
+            if value.dtype == torch.bfloat16 or value.is_sparse:
+                # not supported by numpy - keep it in the record
+                return value
+            array = value.detach().cpu().numpy()
+        elif isinstance(value, np.ndarray):
+            array = value
+        else:
+            return value
+
+        if array.dtype.hasobject or array.nbytes < self._min_array_size:
+            return value
+
+        array = np.ascontiguousarray(array)
+        stored, storage = self._dtype_policy.encode(key, array) if self._dtype_policy is not None else (array, None)
+        shard_name, offset, _ = self._write(stored.reshape(-1).view(np.uint8), alignment=self.ALIGNMENT)
+        return FuseMmapArrayRef(shard_name, offset, array.dtype.str, array.shape, is_tensor, storage)
+
+    def _restore_arrays(self, value: Any) -> Any:
+        """
+        Recursively replace FuseMmapArrayRef with views over the memory mapped shard files
+        """
+        if isinstance(value, dict):
+            return {k: self._restore_arrays(v) for k, v in value.items()}
+        if type(value) in (list, tuple):
+            return type(value)([self._restore_arrays(v) for v in value])
+        if not isinstance(value, FuseMmapArrayRef):
+            return value
+
+        dtype = np.dtype(value.dtype)
+        # written by previous versions - no storage attribute
+        storage = getattr(value, 'storage', None)
+        stored_dtype = np.dtype(storage[0]) if storage is not None else dtype
+        count = int(np.prod(value.shape))
+        if count == 0:
+            array = np.empty(value.shape, dtype=dtype)
+        else:
+            buffer = self._map_array(value.shard_name, value.offset, count * stored_dtype.itemsize)
+            array = np.frombuffer(buffer, dtype=stored_dtype, count=count).reshape(value.shape)
+            if storage is not None:
+                array = FuseDtypePolicy.decode(array, dtype, storage)
+        if value.is_tensor:
+            return torch.from_numpy(array)
+        return array
+
+    def _map_array(self, shard_name: str, offset: int, size: int) -> memoryview:
+        """
+        Map a region of a shard file.
+        Each read gets its own private copy-on-write mapping, so in-place modifications never affect other reads.
+        :param shard_name: shard file name
+        :param offset: offset of the region in the shard file
+        :param size: size of the region in bytes
+        :return: writable buffer over the region
+        """
+        fd = self._get_reader(shard_name)
+        map_offset = offset - offset % mmap.ALLOCATIONGRANULARITY
+        buffer = mmap.mmap(fd, size + offset - map_offset, access=mmap.ACCESS_COPY, offset=map_offset)
+        return memoryview(buffer)[offset - map_offset:]
@@ -21,7 +21,7 @@ Created on June 30, 2021
 Dummy cache implementation, doing nothing
 """
 from multiprocessing import Manager
-from typing import Hashable, Any, List
+from typing import Hashable, Any, List, Optional
 
 from fuse.data.cache.cache_base import FuseCacheBase
 
@@ -78,8 +78,14 @@ class FuseCacheNull(FuseCacheBase):
         """
         return []
 
-    def start_caching(self, manager: Manager):
+    def start_caching(self, manager: Optional[Manager] = None):
         """
         See base class
         """
         pass
+
+    def support_multiprocess_writing(self) -> bool:
+        """
+        See base class
+        """
+        return True
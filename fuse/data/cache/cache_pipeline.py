@@ -0,0 +1,229 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Staged caching pipeline - I/O bound loading, CPU bound transforms and cache writing run concurrently
+"""
+import logging
+import queue
+import threading
+import time
+from multiprocessing.pool import Pool
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+from tqdm import tqdm
+
+# marks the end of the tasks, or a failure of another stage
+_STOP = object()
+
+
+def _timed_call(func: Callable, arg: Any) -> Tuple[Any, float]:
+    """
+    Call func(arg) and measure its running time - executed by the process pool workers
+    """
+    start = time.perf_counter()
+    result = func(arg)
+    return result, time.perf_counter() - start
+
+
+class FuseCachePipeline:
+    """
+    Caching pipeline of three stages connected by bounded queues:
+    'load'      - I/O bound (e.g. reading files), run by a thread pool of this process
+    'transform' - CPU bound (e.g. decoding and resampling), run by a process pool
+    'write'     - writes the results to the cache, run by this process
+    So the disk and the cores are busy at the same time. The bounded queues limit the memory used by the loaded data waiting to be transformed.
+    The order of the results is not preserved.
+    """
+    STAGES = ('load', 'transform', 'write')
+
+    def __init__(self, load_func: Callable[[Any], Any], transform_func: Callable[[Any], Any], write_func: Callable[[Any], None],
+                 io_threads: int = 4, cpu_workers: int = 4, queue_size: int = 16,
+                 worker_init_func: Optional[Callable] = None, worker_init_args: Tuple = ()):
+        """
+        :param load_func: the 'load' stage - get a task, return the loaded data
+        :param transform_func: the 'transform' stage - get the loaded data, return the result to write.
+                               Must be picklable (e.g. a module level function or a static method) if cpu_workers > 0.
+        :param write_func: the 'write' stage - get a result and write it
+        :param io_threads: number of threads of the 'load' stage
+        :param cpu_workers: number of processes of the 'transform' stage, 0 to transform in a thread of this process
+        :param queue_size: max number of items waiting in each queue (and being transformed)
+        :param worker_init_func: initializer of the 'transform' stage processes. Called in this process if cpu_workers == 0
+        :param worker_init_args: arguments of worker_init_func
+        """
+        if io_threads < 1 or queue_size < 1:
+            msg = f'FuseCachePipeline: io_threads and queue_size must be positive, got {io_threads} and {queue_size}'
+            logging.getLogger('Fuse').error(msg)
+            raise Exception(msg)
+        self._load_func = load_func
+        self._transform_func = transform_func
+        self._write_func = write_func
+        self._io_threads = io_threads
+        self._cpu_workers = cpu_workers
+        self._queue_size = queue_size
+        self._worker_init_func = worker_init_func
+        self._worker_init_args = worker_init_args
+
+    def run(self, tasks: Sequence[Any], progress: bool = True) -> Dict[str, Dict[str, float]]:
+        """
+        Run the pipeline, raise the first exception of any stage
+        :param tasks: the tasks, each task is loaded, transformed and written
+        :param progress: if True, display progress bar
+        :return: statistics per stage: 'count' - number of items processed, 'busy_time' - total time spent by the stage workers (seconds),
+                 'throughput' - items per second of the entire run, 'utilization' - busy time divided by the run time and the stage concurrency.
+                 The stage with the highest utilization is the bottleneck.
+        """
+        tasks = list(tasks)
+        self._errors: List[BaseException] = []
+        self._stats_lock = threading.Lock()
+        self._stats = {stage: {'count': 0, 'busy_time': 0.0} for stage in self.STAGES}
+        load_queue = queue.Queue(maxsize=self._queue_size)
+        write_queue = queue.Queue(maxsize=self._queue_size)
+        tasks_iter = iter(tasks)
+        tasks_lock = threading.Lock()
+        start = time.perf_counter()
+
+        def load() -> None:
+            while not self._errors:
+                with tasks_lock:
+                    task = next(tasks_iter, _STOP)
+                if task is _STOP:
+                    return
+                try:
+                    loaded, busy_time = _timed_call(self._load_func, task)
+                except BaseException as e:
+                    self._errors.append(e)
+                    return
+                self._record('load', busy_time)
+                self._put(load_queue, loaded)
+
+        load_threads = [threading.Thread(target=load, daemon=True) for _ in range(self._io_threads)]
+        transform_thread = threading.Thread(target=self._transform, args=(len(tasks), load_queue, write_queue), daemon=True)
+        for thread in load_threads + [transform_thread]:
+            thread.start()
+
+        # write stage
+        for _ in tqdm(range(len(tasks)), disable=not progress, smoothing=0.1):
+            result = self._get(write_queue)
+            if result is _STOP:
+                break
+            try:
+                _, busy_time = _timed_call(self._write_func, result)
+            except BaseException as e:
+                self._errors.append(e)
+                break
+            self._record('write', busy_time)
+
+        transform_thread.join()
+        for thread in load_threads:
+            thread.join()
+        if self._errors:
+            raise self._errors[0]
+
+        run_time = max(time.perf_counter() - start, 1e-9)
+        concurrency = {'load': self._io_threads, 'transform': max(self._cpu_workers, 1), 'write': 1}
+        stats = {}
+        for stage in self.STAGES:
+            stage_stats = dict(self._stats[stage])
+            stage_stats['throughput'] = stage_stats['count'] / run_time
+            stage_stats['utilization'] = stage_stats['busy_time'] / (run_time * concurrency[stage])
+            stats[stage] = stage_stats
+        return stats
+
+    @staticmethod
+    def format_stats(stats: Dict[str, Dict[str, float]]) -> str:
+        """
+        :param stats: statistics returned by run()
+        :return: printable summary, a line per stage
+        """
+        return '\n'.join(f'{stage}: {stage_stats["count"]} items, {stage_stats["throughput"]:.1f} items/sec, '
+                         f'utilization {stage_stats["utilization"] * 100:.0f}%' for stage, stage_stats in stats.items())
+
+    def _transform(self, num_tasks: int, load_queue: queue.Queue, write_queue: queue.Queue) -> None:
+        """
+        Transform stage - dispatch the loaded data to the process pool, at most queue_size items in flight
+        """
+        try:
+            if self._cpu_workers == 0:
+                if self._worker_init_func is not None:
+                    self._worker_init_func(*self._worker_init_args)
+                for _ in range(num_tasks):
+                    loaded = self._get(load_queue)
+                    if loaded is _STOP:
+                        return
+                    result, busy_time = _timed_call(self._transform_func, loaded)
+                    self._record('transform', busy_time)
+                    self._put(write_queue, result)
+                return
+
+            slots = threading.BoundedSemaphore(self._queue_size)
+
+            def on_result(result_busy_time: Tuple[Any, float]) -> None:
+                result, busy_time = result_busy_time
+                self._record('transform', busy_time)
+                slots.release()
+                self._put(write_queue, result)
+
+            def on_error(e: BaseException) -> None:
+                self._errors.append(e)
+                slots.release()
+
+            pool = Pool(processes=self._cpu_workers, initializer=self._worker_init_func, initargs=self._worker_init_args)
+            try:
+                for _ in range(num_tasks):
+                    loaded = self._get(load_queue)
+                    if loaded is _STOP:
+                        break
+                    while not slots.acquire(timeout=0.1):
+                        if self._errors:
+                            return
+                    pool.apply_async(_timed_call, (self._transform_func, loaded), callback=on_result, error_callback=on_error)
+                pool.close()
+                pool.join()
+            finally:
+                pool.terminate()
+        except BaseException as e:
+            self._errors.append(e)
+
+    def _record(self, stage: str, busy_time: float) -> None:
+        with self._stats_lock:
+            self._stats[stage]['count'] += 1
+            self._stats[stage]['busy_time'] += busy_time
+
+    def _put(self, items: queue.Queue, item: Any) -> None:
+        """
+        Blocking put, gives up if another stage failed
+        """
+        while not self._errors:
+            try:
+                items.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def _get(self, items: queue.Queue) -> Any:
+        """
+        Blocking get, returns _STOP if another stage failed
+        """
+        while not self._errors:
+            try:
+                return items.get(timeout=0.1)
+            except queue.Empty:
+                pass
+        return _STOP
@@ -0,0 +1,120 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Asynchronous cache reads of the samples expected to be read next
+"""
+import logging
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, Future
+from multiprocessing.util import Finalize
+from typing import Hashable, Any, Dict, Iterable, Tuple
+
+from fuse.data.cache.cache_base import FuseCacheBase
+
+
+class FuseCachePrefetcher:
+    """
+    Read cache entries in a thread pool ahead of time, hand them back when requested.
+    The thread pool is process specific (e.g. per DataLoader worker) and created on demand.
+    Prefetched entries not requested are dropped once more than max_pending entries are prefetched.
+    """
+
+    def __init__(self, cache: FuseCacheBase, num_threads: int = 4, max_pending: int = 256):
+        """
+        :param cache: the cache to read from
+        :param num_threads: number of reading threads per process
+        :param max_pending: max number of prefetched entries kept per process
+        """
+        self._cache = cache
+        self._num_threads = num_threads
+        self._max_pending = max_pending
+        self._state_pid = None
+
+    def __getstate__(self) -> dict:
+        # the thread pool and the prefetched entries are process specific
+        state = self.__dict__.copy()
+        state['_state_pid'] = None
+        for key in ['_executor', '_pending', '_lock', '_stats']:
+            state.pop(key, None)
+        return state
+
+    def prefetch(self, keys: Iterable[Hashable]) -> None:
+        """
+        Start reading the keys in the background
+        :param keys: cache keys expected to be read soon
+        """
+        self._init_process_state()
+        with self._lock:
+            for key in keys:
+                if key in self._pending or key not in self._cache:
+                    continue
+                self._pending[key] = self._executor.submit(self._cache.__getitem__, key)
+                self._stats['prefetched'] += 1
+                # drop the oldest entries
+                while len(self._pending) > self._max_pending:
+                    _, future = self._pending.popitem(last=False)
+                    future.cancel()
+                    self._stats['dropped'] += 1
+
+    def get(self, key: Hashable) -> Tuple[bool, Any]:
+        """
+        Get a cache entry, prefetched if possible
+        :param key: cache key
+        :return: tuple of a boolean, True if the entry was prefetched, and the entry
+        """
+        self._init_process_state()
+        with self._lock:
+            future: Future = self._pending.pop(key, None)
+            self._stats['hits' if future is not None else 'misses'] += 1
+        if future is not None:
+            return True, future.result()
+        return False, self._cache[key]
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Statistics of this process
+        :return: dictionary with the number of hits (requests of prefetched entries), misses, prefetched and dropped entries and hit rate
+        """
+        self._init_process_state()
+        with self._lock:
+            stats = dict(self._stats)
+        num_requests = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / num_requests if num_requests > 0 else 0.0
+        return stats
+
+    def _init_process_state(self) -> None:
+        if self._state_pid == os.getpid():
+            return
+        self._state_pid = os.getpid()
+        self._executor = ThreadPoolExecutor(max_workers=self._num_threads)
+        self._pending: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {'hits': 0, 'misses': 0, 'prefetched': 0, 'dropped': 0}
+        # report the achieved hit rate when a worker process (e.g. DataLoader worker) exits, the main process can use get_stats()
+        if multiprocessing.parent_process() is not None:
+            Finalize(None, self._report, exitpriority=10)
+
+    def _report(self) -> None:
+        stats = self.get_stats()
+        if stats['hits'] + stats['misses'] > 0:
+            logging.getLogger('Fuse').info(f'FuseCachePrefetcher (pid {os.getpid()}): hit rate {stats["hit_rate"]:.2f} - {stats}')
@@ -0,0 +1,398 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Cache to a few large shard files
+"""
+import logging
+import os
+import pickle
+import threading
+import time
+import uuid
+from multiprocessing import Manager
+from typing import Hashable, Any, List, Dict, Optional, Sequence, Tuple, Union
+
+from fuse.data.cache.cache_base import FuseCacheBase
+from fuse.data.cache.cache_codecs import FuseSampleSerializer
+from fuse.data.cache.cache_index_journal import FuseCacheIndexJournal
+from fuse.utils.file_io.atomic_file import AtomicFileWriter
+from fuse.utils.file_io.file_io import create_dir, remove_dir_content
+
+
+class FuseCacheShards(FuseCacheBase):
+    """
+    Cache to shard files.
+    Each writer (process or thread) appends the pickled samples to its own shard file.
+    The index maps each key to (shard file name, offset, length), so reading a sample is a single positional read.
+    """
+    CACHE_FORMAT = 'shards'
+    # max size of a single read of adjacent items, see get_many()
+    MAX_READ_SIZE = 2 ** 26
+
+    def __init__(self, cache_file_dir: str, reset_cache: bool, max_shard_size: int = 2 ** 30,
+                 codec: Optional[str] = None, codec_policy: Optional[Dict[str, str]] = None,
+                 dtype_policy: Optional[Dict[str, str]] = None):
+        """
+        :param cache_file_dir: path to cache dir
+        :param reset_cache: reset previous cache if exist or continue
+        :param max_shard_size: a new shard file will be opened once a shard file reaches this size (in bytes)
+        :param codec: Optional. compression codec of the samples written, e.g. 'lz4', 'zstd:3', 'shuffle+zstd'.
+                      See fuse.data.cache.cache_codecs.create_codec(). If None and no codec_policy, samples are just pickled.
+        :param codec_policy: Optional. map key pattern to codec, See fuse.data.cache.cache_codecs.FuseSampleSerializer
+        :param dtype_policy: Optional. map key pattern to reduced precision storage dtype of floating point arrays,
+                             e.g. {'data.input.image': 'uint8:0.01'}. See fuse.data.cache.cache_codecs.FuseDtypePolicy
+        """
+        super().__init__()
+
+        self._cache_file_dir = cache_file_dir
+        self._max_shard_size = max_shard_size
+        # samples are written using the serializer, reading supports both formats
+        self._serializer = FuseSampleSerializer(codec or 'none', codec_policy, dtype_policy)
+        self._use_serializer = codec is not None or bool(codec_policy) or bool(dtype_policy)
+
+        # open file descriptors - process specific, created on demand
+        self._writers: Dict[Tuple[int, int], List] = {}
+        self._readers: Dict[str, int] = {}
+        self._readers_pid = os.getpid()
+
+        # create dir if not already exist
+        create_dir(cache_file_dir)
+
+        # pointer to cache index
+        self._cache_file_name = os.path.join(self._cache_file_dir, 'cache_index.pkl')
+        self._cache_prop_file_name = os.path.join(self._cache_file_dir, 'cache_properties.pkl')
+        # the index is persisted as compacted index file and append-only journal
+        self._cache_index_journal = FuseCacheIndexJournal(self._cache_file_name)
+
+        # reset or load from disk
+        if reset_cache or not self._cache_index_journal.exist():
+            self.reset()
+            # save initial properties
+            with AtomicFileWriter(filename=self._cache_prop_file_name) as cache_prop_file:
+                pickle.dump({'format': self.CACHE_FORMAT}, cache_prop_file)
+        else:
+            # make sure it's a shards cache
+            cache_format = None
+            if os.path.exists(self._cache_prop_file_name):
+                with open(self._cache_prop_file_name, 'rb') as cache_prop_file:
+                    cache_format = pickle.load(cache_prop_file).get('format', None)
+            if cache_format != self.CACHE_FORMAT:
+                msg = f'cache dir {cache_file_dir} is not a {self.CACHE_FORMAT} cache (found {cache_format}). ' \
+                      f'Use reset_cache=True or convert it using fuse.data.cache.cache_tools migrate'
+                logging.getLogger('Fuse').error(msg)
+                raise Exception(msg)
+
+            # load current cache - compacted index and the journal tail
+            self._cache_index = self._cache_index_journal.load()
+            self._cache_enable = False
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_writers'] = {}
+        state['_readers'] = {}
+        return state
+
+    def __contains__(self, key: Hashable) -> bool:
+        """
+        See base class
+        """
+        return key in self._cache_index
+
+    def __getitem__(self, key: Hashable) -> Any:
+        """
+        See base class
+        """
+        location = self._cache_index.get(key, None)
+        if location is None:
+            self._cache_stats.record(counters={'misses': 1})
+            return None
+
+        start = time.perf_counter()
+        data = self._read(location)
+        timers = {'read': time.perf_counter() - start}
+        value = self._decode_value(data, timers)
+        self._cache_stats.record(counters={'hits': 1, 'bytes_read': len(data)}, timers=timers)
+        return value
+
+    def get_many(self, keys: Sequence[Hashable]) -> Dict[Hashable, Any]:
+        """
+        See base class.
+        The items are read in storage order, adjacent items of the same shard file are read by a single read (up to MAX_READ_SIZE bytes).
+        """
+        locations = {}
+        for key in keys:
+            location = self._cache_index.get(key, None)
+            if location is not None:
+                locations[key] = location
+        num_misses = sum(1 for key in keys if key not in locations)
+        if num_misses > 0:
+            self._cache_stats.record(counters={'misses': num_misses})
+
+        # group adjacent items: runs of (key, location)
+        runs = []
+        for key, location in sorted(locations.items(), key=lambda item: (item[1][0], item[1][1])):
+            if runs:
+                _, last_location = runs[-1][-1]
+                run_start = runs[-1][0][1][1]
+                if last_location[0] == location[0] and last_location[1] + last_location[2] == location[1] and \
+                        location[1] + location[2] - run_start <= self.MAX_READ_SIZE:
+                    runs[-1].append((key, location))
+                    continue
+            runs.append([(key, location)])
+
+        values = {}
+        for run in runs:
+            shard_name, run_start, _ = run[0][1]
+            run_length = run[-1][1][1] + run[-1][1][2] - run_start
+            start = time.perf_counter()
+            data = memoryview(self._read((shard_name, run_start, run_length)))
+            # the read time is shared by the items of the run
+            read_time = (time.perf_counter() - start) / len(run)
+            for key, (_, offset, length) in run:
+                timers = {'read': read_time}
+                values[key] = self._decode_value(data[offset - run_start: offset - run_start + length], timers)
+                self._cache_stats.record(counters={'hits': 1, 'bytes_read': length}, timers=timers)
+        return values
+
+    def __delitem__(self, key: Hashable) -> None:
+        """
+        Not supported
+        """
+        raise NotImplementedError
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        """
+        See base class
+        """
+        if not self._cache_enable:
+            raise Exception('First start caching using function start_caching()')
+
+        # if value is none, just update cache index
+        if value is not None:
+            start = time.perf_counter()
+            data = self._dumps(value)
+            self._cache_stats.record(timers={'encode': time.perf_counter() - start})
+            value = self._write(data)
+        self._cache_stats.record(counters={'writes': 1})
+
+        # update the index and append it to the journal - just for a case of crashing
+        self._cache_index[key] = value
+        self._cache_index_journal.append(key, value)
+
+    def save(self) -> None:
+        """
+        Save cache index file
+        """
+        # disable caching
+        self._cache_enable = False
+        self._close_writers()
+
+        # merge the updates of all the writers (processes) and compact the journal into the index file
+        self._cache_index = self._cache_index_journal.load()
+        self._cache_index_journal.compact(self._cache_index)
+
+    def exist(self) -> bool:
+        """
+        See base class
+        """
+        return bool(self._cache_index)
+
+    def reset(self) -> None:
+        """
+        See base class
+        """
+        self._close_writers()
+        self._close_readers()
+        self._cache_index_journal.close()
+
+        # make sure the dir content is empty
+        remove_dir_content(self._cache_file_dir)
+
+        # create empty data structures
+        self._cache_enable = False
+        self._cache_index = {}
+
+    def get_all_keys(self, include_none: bool = False) -> List[Hashable]:
+        """
+        See base class
+        """
+        if include_none:
+            return list(self._cache_index.keys())
+        else:
+            return [key for key, value in self._cache_index.items() if value is not None]
+
+    def start_caching(self, manager: Optional[Manager] = None):
+        """
+        See base class
+        Lock-free: each process writes its own shard files and journal fragment, merged by save().
+        Therefore multiprocessing manager is not required and ignored.
+        """
+        self._cache_enable = True
+
+    def refresh(self) -> None:
+        """
+        See base class
+        """
+        self._cache_index_journal.update(self._cache_index)
+
+    def support_multiprocess_writing(self) -> bool:
+        """
+        See base class
+        """
+        return True
+
+    def is_compacted(self) -> bool:
+        """
+        See base class
+        """
+        return len(self._cache_index_journal.get_journal_files()) == 0
+
+    def get_shard_files(self) -> List[str]:
+        """
+        :return: list of shard files (absolute paths) currently in cache dir
+        """
+        return sorted([os.path.join(self._cache_file_dir, file_name) for file_name in os.listdir(self._cache_file_dir)
+                       if file_name.startswith('shard_') and file_name.endswith('.bin')])
+
+    def _dumps(self, value: Any) -> bytes:
+        """
+        Serialize a sample - compressed if a codec is configured, pickled otherwise
+        """
+        if self._use_serializer:
+            return self._serializer.serialize(value)
+        return pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def _loads(self, data: Union[bytes, memoryview], timers: Dict[str, float]) -> Any:
+        """
+        Deserialize a sample, the time spent decompressing and unpickling is added to timers
+        """
+        start = time.perf_counter()
+        value = self._serializer.deserialize(data, timers)
+        timers['unpickle'] = time.perf_counter() - start - timers.get('decompress', 0.0)
+        return value
+
+    def _write(self, data: Union[bytes, memoryview], alignment: int = 1) -> Tuple[str, int, int]:
+        """
+        Append data to the shard file of the current writer (process and thread)
+        :param data: bytes to store
+        :param alignment: the data will be stored in an offset that is a multiple of alignment
+        :return: location of the data: (shard file name, offset, length)
+        """
+        writer_key = (os.getpid(), threading.get_ident())
+        writer = self._writers.get(writer_key, None)
+        data = memoryview(data).cast('B')
+
+        # open a new shard if required
+        if writer is None or (writer[2] > 0 and writer[2] + len(data) + alignment > self._max_shard_size):
+            if writer is not None:
+                os.close(writer[0])
+            shard_name = f'shard_{uuid.uuid4().hex}.bin'
+            fd = os.open(os.path.join(self._cache_file_dir, shard_name), os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+            writer = [fd, shard_name, 0]
+            self._writers[writer_key] = writer
+
+        start = time.perf_counter()
+        fd, shard_name, offset = writer
+        padding = (-offset) % alignment
+        if padding:
+            self._write_all(fd, bytes(padding))
+            offset += padding
+        self._write_all(fd, data)
+        writer[2] = offset + len(data)
+        self._cache_stats.record(counters={'bytes_written': len(data)}, timers={'write': time.perf_counter() - start})
+
+        return shard_name, offset, len(data)
+
+    @staticmethod
+    def _write_all(fd: int, data: Union[bytes, memoryview]) -> None:
+        view = memoryview(data)
+        while view:
+            num_bytes = os.write(fd, view)
+            view = view[num_bytes:]
+
+    def _decode_value(self, data: Union[bytes, memoryview], timers: Dict[str, float]) -> Any:
+        """
+        Decode an item read from a shard file
+        :param data: the data read
+        :param timers: the time spent will be added to timers, see FuseCacheStats.TIMERS
+        :return: the item
+        """
+        return self._loads(data, timers)
+
+    def _read(self, location: Tuple[str, int, int]) -> bytes:
+        """
+        Read data from shard file
+        :param location: (shard file name, offset, length) as returned by self._write()
+        :return: the data
+        """
+        shard_name, offset, length = location
+
+        fd = self._get_reader(shard_name)
+        chunks = []
+        while length > 0:
+            chunk = os.pread(fd, length, offset)
+            if not chunk:
+                raise Exception(f'cache shard file {shard_name} is truncated')
+            chunks.append(chunk)
+            offset += len(chunk)
+            length -= len(chunk)
+
+        return chunks[0] if len(chunks) == 1 else b''.join(chunks)
+
+    def _get_reader(self, shard_name: str) -> int:
+        """
+        Get file descriptor of shard file opened for reading
+        :param shard_name: shard file name
+        :return: file descriptor
+        """
+        # file descriptors are not shared between processes
+        if self._readers_pid != os.getpid():
+            self._readers = {}
+            self._readers_pid = os.getpid()
+
+        fd = self._readers.get(shard_name, None)
+        if fd is None:
+            shard_file_name = os.path.join(self._cache_file_dir, shard_name)
+            if not os.path.exists(shard_file_name):
+                raise Exception(f'cache shard file {shard_file_name} not found')
+            fd = os.open(shard_file_name, os.O_RDONLY)
+            self._readers[shard_name] = fd
+
+        return fd
+
+    def _close_writers(self) -> None:
+        """
+        Close the shard files opened for writing by this process
+        """
+        pid = os.getpid()
+        for writer_key in list(self._writers.keys()):
+            if writer_key[0] == pid:
+                os.close(self._writers.pop(writer_key)[0])
+        self._writers = {}
+
+    def _close_readers(self) -> None:
+        """
+        Close the shard files opened for reading by this process
+        """
+        if self._readers_pid == os.getpid():
+            for fd in self._readers.values():
+                os.close(fd)
+        self._readers = {}
+        self._readers_pid = os.getpid()
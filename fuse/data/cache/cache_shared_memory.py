@@ -0,0 +1,261 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+In-memory cache stored in shared memory (/dev/shm) - shared by all the DataLoader workers without copy-on-write
+"""
+import atexit
+import hashlib
+import os
+import pickle
+import shutil
+import tempfile
+import uuid
+from multiprocessing import Manager
+from typing import Hashable, Any, Dict, List, Optional, Tuple, Iterator
+
+import numpy as np
+
+from fuse.data.cache.cache_mmap import FuseCacheMmap
+from fuse.utils.file_io.atomic_file import AtomicFileWriter
+
+
+class FuseCacheCompactIndex:
+    """
+    Read only cache index stored as a memory mapped numpy array sorted by key hash.
+    Unlike a python dictionary, reading it does not modify reference counts, so its pages are never copied by forked processes.
+    The keys themselves are stored in a separate file, loaded only when required (e.g. get_all_keys()).
+    """
+    _DTYPE = np.dtype([('hash', '<u8'), ('shard_id', '<i4'), ('offset', '<i8'), ('length', '<i8')])
+
+    def __init__(self, index_dir: str):
+        """
+        :param index_dir: dir containing the files created by build()
+        """
+        self._index_dir = index_dir
+        self._entries = None
+        self._shard_names = None
+
+    def __getstate__(self) -> dict:
+        # the memory mapped arrays are re-mapped on demand
+        state = self.__dict__.copy()
+        state['_entries'] = None
+        return state
+
+    @classmethod
+    def build(cls, index: Dict[Hashable, Optional[Tuple[str, int, int]]], index_dir: str) -> 'FuseCacheCompactIndex':
+        """
+        Create the compact index files
+        :param index: map key to location (shard name, offset, length) or None
+        :param index_dir: dir to store the files
+        :return: the compact index object
+        """
+        keys = list(index.keys())
+        shard_names = sorted(set(value[0] for value in index.values() if value is not None))
+        shard_ids = {shard_name: shard_id for shard_id, shard_name in enumerate(shard_names)}
+
+        entries = np.empty(len(keys), dtype=cls._DTYPE)
+        for i, key in enumerate(keys):
+            value = index[key]
+            entries[i]['hash'] = cls.hash_key(key)
+            if value is None:
+                entries[i]['shard_id'], entries[i]['offset'], entries[i]['length'] = -1, 0, 0
+            else:
+                entries[i]['shard_id'], entries[i]['offset'], entries[i]['length'] = shard_ids[value[0]], value[1], value[2]
+        order = np.argsort(entries['hash'], kind='stable')
+        entries = entries[order]
+        if len(entries) > 1 and np.any(entries['hash'][1:] == entries['hash'][:-1]):
+            raise Exception('FuseCacheCompactIndex: key hash collision')
+
+        # replaced atomically - other processes might have the previous version memory mapped
+        with AtomicFileWriter(filename=os.path.join(index_dir, 'cache_index_compact.npy')) as entries_file:
+            np.save(entries_file, entries)
+        with AtomicFileWriter(filename=os.path.join(index_dir, 'cache_index_compact_keys.pkl')) as keys_file:
+            pickle.dump({'shard_names': shard_names, 'keys': [keys[i] for i in order]}, keys_file)
+
+        return cls(index_dir)
+
+    @staticmethod
+    def hash_key(key: Hashable) -> int:
+        """
+        :return: 64 bit hash of the key, stable across processes (unlike hash())
+        """
+        key = FuseCacheCompactIndex.normalize_key(key)
+        return int.from_bytes(hashlib.blake2b(pickle.dumps(key, protocol=4), digest_size=8).digest(), 'little')
+
+    @staticmethod
+    def normalize_key(key: Hashable) -> Hashable:
+        """
+        Map keys that are equal in a python dictionary (e.g. np.int64(3), 3 and 3.0) to the same key, so they get the same hash
+        """
+        if isinstance(key, np.generic):
+            key = key.item()
+        if isinstance(key, tuple):
+            return tuple(FuseCacheCompactIndex.normalize_key(k) for k in key)
+        if isinstance(key, bool) or (isinstance(key, float) and key.is_integer()):
+            return int(key)
+        return key
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self._find(key) is not None
+
+    def __len__(self) -> int:
+        return len(self._get_entries())
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """
+        :return: location of the key (shard name, offset, length), None for 'none samples', default if the key does not exist
+        """
+        position = self._find(key)
+        if position is None:
+            return default
+        entry = self._get_entries()[position]
+        if entry['shard_id'] < 0:
+            return None
+        return self._get_shard_names()[entry['shard_id']], int(entry['offset']), int(entry['length'])
+
+    def keys(self) -> List[Hashable]:
+        return self._load_keys()['keys']
+
+    def items(self) -> Iterator[Tuple[Hashable, Any]]:
+        entries = self._get_entries()
+        shard_names = self._get_shard_names()
+        for key, entry in zip(self.keys(), entries):
+            if entry['shard_id'] < 0:
+                yield key, None
+            else:
+                yield key, (shard_names[entry['shard_id']], int(entry['offset']), int(entry['length']))
+
+    def nbytes(self) -> int:
+        """
+        :return: size of the memory mapped index array
+        """
+        return self._get_entries().nbytes
+
+    def _find(self, key: Hashable) -> Optional[int]:
+        entries = self._get_entries()
+        key_hash = self.hash_key(key)
+        position = int(np.searchsorted(entries['hash'], np.uint64(key_hash)))
+        if position < len(entries) and int(entries[position]['hash']) == key_hash:
+            return position
+        return None
+
+    def _get_entries(self) -> np.ndarray:
+        if self._entries is None:
+            self._entries = np.load(os.path.join(self._index_dir, 'cache_index_compact.npy'), mmap_mode='r')
+        return self._entries
+
+    def _get_shard_names(self) -> List[str]:
+        if self._shard_names is None:
+            self._shard_names = self._load_keys()['shard_names']
+        return self._shard_names
+
+    def _load_keys(self) -> dict:
+        with open(os.path.join(self._index_dir, 'cache_index_compact_keys.pkl'), 'rb') as keys_file:
+            return pickle.load(keys_file)
+
+
+class FuseCacheSharedMemory(FuseCacheMmap):
+    """
+    In-memory cache stored in shared memory.
+    Payloads are stored in shard files under /dev/shm (tmpfs) and read zero copy as FuseCacheMmap does.
+    Once cached, the index is compacted to a memory mapped numpy array (FuseCacheCompactIndex).
+    Therefore DataLoader workers share a single copy of the cache, instead of gradually duplicating a dictionary of tensors.
+    Use get_memory_usage() to get the actual shared and private memory used.
+    """
+    CACHE_FORMAT = 'shared_memory'
+    DEFAULT_SHM_DIR = '/dev/shm'
+
+    def __init__(self, cache_file_dir: Optional[str] = None, reset_cache: bool = True, max_shard_size: int = 2 ** 30,
+                 min_array_size: int = 1024, codec: Optional[str] = None, codec_policy: Optional[Dict[str, str]] = None,
+                 dtype_policy: Optional[Dict[str, str]] = None, read_only: bool = False):
+        """
+        :param cache_file_dir: Optional. path to cache dir, expected to be on tmpfs (e.g. '/dev/shm/my_cache').
+                               If None, a unique dir is created under /dev/shm and deleted when the creating process exits.
+        :param reset_cache: reset previous cache if exist or continue
+        :param max_shard_size: See FuseCacheMmap
+        :param min_array_size: See FuseCacheMmap
+        :param codec: See FuseCacheMmap
+        :param codec_policy: See FuseCacheMmap
+        :param dtype_policy: See FuseCacheMmap
+        :param read_only: if True, an existing cache is loaded without building the compact index files (the cache dir is not modified)
+        """
+        self._owner_pid = None
+        if cache_file_dir is None:
+            shm_dir = self.DEFAULT_SHM_DIR if os.path.isdir(self.DEFAULT_SHM_DIR) else tempfile.gettempdir()
+            cache_file_dir = os.path.join(shm_dir, f'fuse_cache_{uuid.uuid4().hex}')
+            self._owner_pid = os.getpid()
+            atexit.register(self._remove_cache_dir, cache_file_dir, self._owner_pid)
+
+        super().__init__(cache_file_dir, reset_cache, max_shard_size=max_shard_size, min_array_size=min_array_size,
+                         codec=codec, codec_policy=codec_policy, dtype_policy=dtype_policy)
+
+        # loaded from disk - switch to compact index
+        if self._cache_index and not read_only:
+            self._cache_index = FuseCacheCompactIndex.build(self._cache_index, self._cache_file_dir)
+
+    def save(self) -> None:
+        """
+        See base class
+        """
+        super().save()
+        self._cache_index = FuseCacheCompactIndex.build(self._cache_index, self._cache_file_dir)
+
+    def start_caching(self, manager: Optional[Manager] = None):
+        """
+        See base class
+        """
+        # back to a dictionary that can be modified
+        self._cache_index = dict(self._cache_index.items())
+        super().start_caching(manager)
+
+    def get_memory_usage(self) -> Dict[str, int]:
+        """
+        Report the memory used by the cache and by this process
+        :return: dictionary including:
+                 'shared_bytes'        - size of the cache files in shared memory, stored once regardless of the number of workers
+                 'index_bytes'         - size of the compact index (also shared)
+                 'process_rss_bytes'   - resident memory of this process (Linux only, otherwise 0)
+                 'process_anon_bytes'  - private resident memory of this process, grows with copy-on-write (Linux only, otherwise 0)
+                 'process_shmem_bytes' - resident shared memory mapped by this process (Linux only, otherwise 0)
+        """
+        usage = {
+            'shared_bytes': sum(os.path.getsize(os.path.join(self._cache_file_dir, file_name)) for file_name in os.listdir(self._cache_file_dir)),
+            'index_bytes': self._cache_index.nbytes() if isinstance(self._cache_index, FuseCacheCompactIndex) else 0,
+            'process_rss_bytes': 0,
+            'process_anon_bytes': 0,
+            'process_shmem_bytes': 0,
+        }
+        fields = {'VmRSS:': 'process_rss_bytes', 'RssAnon:': 'process_anon_bytes', 'RssShmem:': 'process_shmem_bytes'}
+        try:
+            with open('/proc/self/status', 'r') as status_file:
+                for line in status_file:
+                    items = line.split()
+                    if items and items[0] in fields:
+                        usage[fields[items[0]]] = int(items[1]) * 1024
+        except OSError:
+            # not linux
+            pass
+        return usage
+
+    @staticmethod
+    def _remove_cache_dir(cache_file_dir: str, owner_pid: int) -> None:
+        # forked processes inherit the atexit handlers - only the creating process removes the cache
+        if os.getpid() == owner_pid:
+            shutil.rmtree(cache_file_dir, ignore_errors=True)
@@ -0,0 +1,234 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Cache statistics - counters and latency histograms aggregated across processes
+"""
+import multiprocessing
+import os
+import threading
+from multiprocessing.context import get_spawning_popen
+from multiprocessing.util import Finalize
+from typing import Dict, Optional, Any
+
+import numpy as np
+
+
+class FuseCacheStats:
+    """
+    Counters (hits, misses, bytes read and written, ...) and latency histograms (read, decompress, unpickle, encode, write) of a cache.
+    The values are kept in shared memory, a row (slot) per process, so the statistics of all the DataLoader workers are aggregated
+    without any communication. A slot is claimed by a process on its first update and merged into the totals row when the process exits.
+    Must be created by the main process, before the worker processes are started.
+    When pickled outside of process spawning, the copy gets its own, empty, statistics.
+    """
+    COUNTERS = ('hits', 'misses', 'writes', 'evictions', 'bytes_read', 'bytes_written')
+    TIMERS = ('read', 'decompress', 'unpickle', 'encode', 'write')
+    # latency histogram: bucket 0 - less than 1us, bucket i - [2^(i-1), 2^i) us, the last bucket - more than ~8 seconds
+    NUM_BUCKETS = 25
+    # per timer: count, total time (seconds), histogram
+    _TIMER_SIZE = 2 + NUM_BUCKETS
+    _ROW_SIZE = len(COUNTERS) + len(TIMERS) * _TIMER_SIZE
+    # offsets in a row
+    _COUNTER_INDEX = dict(zip(COUNTERS, range(len(COUNTERS))))
+    _TIMER_INDEX = dict(zip(TIMERS, range(len(COUNTERS), _ROW_SIZE, _TIMER_SIZE)))
+
+    def __init__(self, num_slots: int = 64):
+        """
+        :param num_slots: max number of processes updating the statistics concurrently.
+                          Processes beyond it update a shared row, synchronized by a lock.
+        """
+        self._num_slots = num_slots
+        self._allocate()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        # process specific
+        state['_slot_pid'] = None
+        state.pop('_thread_lock', None)
+        state.pop('_slot', None)
+        # shared memory can be passed to a process only when spawned
+        if get_spawning_popen() is None:
+            state['_values'] = None
+            state['_owners'] = None
+            state['_lock'] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        if self._values is None:
+            self._allocate()
+
+    def record(self, counters: Optional[Dict[str, float]] = None, timers: Optional[Dict[str, float]] = None) -> None:
+        """
+        Update the statistics of this process
+        :param counters: map counter name (see COUNTERS) to the value to add
+        :param timers: map timer name (see TIMERS) to a measured duration in seconds
+        """
+        row, locked = self._get_row()
+        if locked:
+            self._lock.acquire()
+        else:
+            self._thread_lock.acquire()
+        try:
+            if counters:
+                for name, value in counters.items():
+                    row[self._COUNTER_INDEX[name]] += value
+            if timers:
+                for name, seconds in timers.items():
+                    base = self._TIMER_INDEX[name]
+                    row[base] += 1
+                    row[base + 1] += seconds
+                    row[base + 2 + min(int(seconds * 1e6).bit_length(), self.NUM_BUCKETS - 1)] += 1
+        finally:
+            if locked:
+                self._lock.release()
+            else:
+                self._thread_lock.release()
+
+    def snapshot(self) -> np.ndarray:
+        """
+        :return: the raw statistics aggregated across all the processes, can be passed to get_stats(since=...)
+        """
+        with self._lock:
+            return self._get_table().sum(axis=0)
+
+    def get_stats(self, since: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """
+        Statistics aggregated across all the processes
+        :param since: Optional. a snapshot() - report just the updates made since
+        :return: dictionary with the counters, hit rate and per timer: count, total, mean and percentiles (p50, p90, p99) in seconds,
+                 and the latency histogram (see NUM_BUCKETS)
+        """
+        values = self.snapshot()
+        if since is not None:
+            values = values - since
+
+        stats: Dict[str, Any] = {name: int(values[index]) for name, index in self._COUNTER_INDEX.items()}
+        num_requests = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / num_requests if num_requests > 0 else 0.0
+        stats['timers'] = {}
+        for name, base in self._TIMER_INDEX.items():
+            count, total = int(values[base]), float(values[base + 1])
+            histogram = values[base + 2: base + 2 + self.NUM_BUCKETS].astype(np.int64)
+            timer = {'count': count, 'total': total, 'mean': total / count if count > 0 else 0.0, 'histogram': histogram.tolist()}
+            for percentile in (50, 90, 99):
+                timer[f'p{percentile}'] = self._get_percentile(histogram, percentile)
+            stats['timers'][name] = timer
+        return stats
+
+    def reset(self) -> None:
+        """
+        Reset the statistics of all the processes
+        """
+        with self._lock:
+            self._get_table()[:] = 0
+
+    @staticmethod
+    def format_stats(stats: Dict[str, Any]) -> str:
+        """
+        :param stats: statistics returned by get_stats()
+        :return: one line summary
+        """
+        text = f'hits {stats["hits"]}, misses {stats["misses"]} (hit rate {stats["hit_rate"]:.2f}), ' \
+               f'read {stats["bytes_read"] / 2 ** 20:.1f}MB, written {stats["bytes_written"] / 2 ** 20:.1f}MB'
+        for name, timer in stats['timers'].items():
+            if timer['count'] > 0:
+                text += f', {name} {timer["total"]:.2f}s (mean {timer["mean"] * 1e3:.2f}ms, p99 {timer["p99"] * 1e3:.2f}ms)'
+        return text
+
+    def _allocate(self) -> None:
+        # row 0 - totals of the processes exited, rows 1...num_slots - a row per process
+        self._values = multiprocessing.RawArray('d', (self._num_slots + 1) * self._ROW_SIZE)
+        self._owners = multiprocessing.RawArray('q', self._num_slots + 1)
+        self._lock = multiprocessing.Lock()
+        self._slot_pid = None
+
+    def _get_table(self) -> np.ndarray:
+        return np.frombuffer(self._values, dtype=np.float64).reshape(self._num_slots + 1, self._ROW_SIZE)
+
+    def _get_row(self):
+        """
+        :return: the row of this process and a boolean - True if the row is shared and must be updated under the lock
+        """
+        if self._slot_pid != os.getpid():
+            self._slot_pid = os.getpid()
+            self._thread_lock = threading.Lock()
+            self._slot = self._claim_slot()
+            if self._slot != 0:
+                Finalize(None, FuseCacheStats._release_slot, args=(self._values, self._owners, self._lock, self._slot, self._ROW_SIZE),
+                         exitpriority=0)
+        return self._get_table()[self._slot], self._slot == 0
+
+    def _claim_slot(self) -> int:
+        """
+        Claim a free row, or a row of a process that no longer exists
+        :return: the row index, 0 if no row is available
+        """
+        table = self._get_table()
+        with self._lock:
+            for slot in range(1, self._num_slots + 1):
+                owner = self._owners[slot]
+                if owner != 0 and owner != self._slot_pid and self._is_alive(owner):
+                    continue
+                if owner != 0:
+                    # left by a process that was terminated
+                    table[0] += table[slot]
+                    table[slot] = 0
+                self._owners[slot] = self._slot_pid
+                return slot
+        return 0
+
+    @staticmethod
+    def _release_slot(values: Any, owners: Any, lock: Any, slot: int, row_size: int) -> None:
+        """
+        Merge the row of an exiting process into the totals row
+        """
+        table = np.frombuffer(values, dtype=np.float64).reshape(-1, row_size)
+        with lock:
+            if owners[slot] != os.getpid():
+                return
+            table[0] += table[slot]
+            table[slot] = 0
+            owners[slot] = 0
+
+    @staticmethod
+    def _is_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    @classmethod
+    def _get_percentile(cls, histogram: np.ndarray, percentile: float) -> float:
+        """
+        Estimate a percentile from the latency histogram - the upper bound of the bucket
+        """
+        total = histogram.sum()
+        if total == 0:
+            return 0.0
+        bucket = int(np.searchsorted(np.cumsum(histogram), total * percentile / 100.0))
+        bucket = min(bucket, cls.NUM_BUCKETS - 1)
+        # the last bucket is not bounded - report its lower bound
+        upper_bound_us = 2 ** bucket if bucket < cls.NUM_BUCKETS - 1 else 2 ** (bucket - 1)
+        return upper_bound_us * 1e-6
+
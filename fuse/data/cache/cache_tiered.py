@@ -0,0 +1,266 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Bounded in-memory LRU tier in front of a disk cache
+"""
+import sys
+import threading
+from collections import OrderedDict
+from multiprocessing import Manager
+from typing import Hashable, Any, List, Optional, Dict, Sequence
+
+import numpy as np
+import torch
+
+from fuse.data.cache.cache_base import FuseCacheBase
+
+
+class FuseCacheTiered(FuseCacheBase):
+    """
+    Two tiers cache: the most recently used samples are kept decoded in memory, up to a byte budget, on top of a disk cache.
+    Writes go directly to the disk cache, the memory tier is populated on read.
+    The memory tier is private to each process (e.g. each DataLoader worker) and is not pickled.
+    Each read returns a copy of the sample kept in memory: the sample can be modified in-place (e.g. by augmentation).
+    """
+
+    def __init__(self, backend: FuseCacheBase, memory_budget: int):
+        """
+        :param backend: the disk cache object
+        :param memory_budget: max size (in bytes) of the samples kept in memory, per process
+        """
+        super().__init__()
+        self._backend = backend
+        self._memory_budget = memory_budget
+
+        self._lock = threading.Lock()
+        self._reset_memory()
+
+    def __getstate__(self) -> dict:
+        state = self.__dict__.copy()
+        state['_memory'] = OrderedDict()
+        state['_memory_size'] = 0
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    @property
+    def backend(self) -> FuseCacheBase:
+        """
+        :return: the disk cache object
+        """
+        return self._backend
+
+    def __contains__(self, key: Hashable) -> bool:
+        """
+        See base class
+        """
+        return key in self._memory or key in self._backend
+
+    def __getitem__(self, key: Hashable) -> Any:
+        """
+        See base class
+        """
+        with self._lock:
+            entry = self._memory.get(key, None)
+            if entry is not None:
+                self._memory.move_to_end(key)
+        if entry is not None:
+            self._cache_stats.record(counters={'hits': 1})
+            return self._copy(entry[0])
+        self._cache_stats.record(counters={'misses': 1})
+
+        value = self._backend[key]
+        if value is not None and self._put_memory(key, value):
+            return self._copy(value)
+        return value
+
+    def get_many(self, keys: Sequence[Hashable]) -> Dict[Hashable, Any]:
+        """
+        See base class. The samples not kept in memory are read from the backend in bulk.
+        """
+        values = {}
+        with self._lock:
+            for key in keys:
+                entry = self._memory.get(key, None)
+                if entry is not None:
+                    self._memory.move_to_end(key)
+                    values[key] = entry[0]
+        values = {key: self._copy(value) for key, value in values.items()}
+        missing = [key for key in keys if key not in values]
+        self._cache_stats.record(counters={'hits': len(values), 'misses': len(missing)})
+
+        if missing:
+            for key, value in self._backend.get_many(missing).items():
+                if value is not None and self._put_memory(key, value):
+                    value = self._copy(value)
+                values[key] = value
+        return values
+
+    def __delitem__(self, key: Hashable) -> None:
+        """
+        See base class
+        """
+        self._pop_memory(key)
+        del self._backend[key]
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        """
+        See base class
+        """
+        # make sure the memory tier is not stale
+        self._pop_memory(key)
+        self._backend[key] = value
+
+    def save(self) -> None:
+        """
+        See base class
+        """
+        self._backend.save()
+
+    def exist(self) -> bool:
+        """
+        See base class
+        """
+        return self._backend.exist()
+
+    def reset(self) -> None:
+        """
+        See base class
+        """
+        self._reset_memory()
+        self._backend.reset()
+
+    def get_all_keys(self, include_none: bool = False) -> List[Hashable]:
+        """
+        See base class
+        """
+        return self._backend.get_all_keys(include_none=include_none)
+
+    def start_caching(self, manager: Optional[Manager] = None) -> None:
+        """
+        See base class
+        """
+        self._backend.start_caching(manager)
+
+    def refresh(self) -> None:
+        """
+        See base class
+        """
+        self._backend.refresh()
+
+    def support_multiprocess_writing(self) -> bool:
+        """
+        See base class
+        """
+        return self._backend.support_multiprocess_writing()
+
+    def is_compacted(self) -> bool:
+        """
+        See base class
+        """
+        return self._backend.is_compacted()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Memory tier statistics, see base class.
+        In addition, the number of samples kept in memory and their size in bytes (of this process) and the statistics of the backend.
+        :return: dictionary with the statistics, the backend statistics in key 'backend'
+        """
+        stats = super().get_stats()
+        with self._lock:
+            stats['num_samples'] = len(self._memory)
+            stats['memory_size'] = self._memory_size
+        stats['backend'] = self._backend.get_stats()
+        return stats
+
+    def reset_stats(self) -> None:
+        """
+        Reset the statistics of the memory tier and of the backend
+        """
+        super().reset_stats()
+        self._backend.reset_stats()
+
+    @staticmethod
+    def get_size(value: Any) -> int:
+        """
+        Estimate the memory size of a sample
+        :param value: the sample
+        :return: size in bytes
+        """
+        if isinstance(value, torch.Tensor):
+            return value.element_size() * value.nelement()
+        if isinstance(value, np.ndarray):
+            return value.nbytes
+        if isinstance(value, dict):
+            return sys.getsizeof(value) + sum(FuseCacheTiered.get_size(k) + FuseCacheTiered.get_size(v) for k, v in value.items())
+        if isinstance(value, (list, tuple)):
+            return sys.getsizeof(value) + sum(FuseCacheTiered.get_size(v) for v in value)
+        return sys.getsizeof(value)
+
+    @staticmethod
+    def _copy(value: Any) -> Any:
+        """
+        Copy a sample kept in memory: tensors are cloned, numpy arrays are copied, dicts, lists and tuples are copied recursively
+        """
+        if isinstance(value, dict):
+            return {k: FuseCacheTiered._copy(v) for k, v in value.items()}
+        if type(value) in (list, tuple):
+            return type(value)([FuseCacheTiered._copy(v) for v in value])
+        if isinstance(value, torch.Tensor):
+            return value.clone()
+        if isinstance(value, np.ndarray):
+            return value.copy()
+        return value
+
+    def _put_memory(self, key: Hashable, value: Any) -> bool:
+        """
+        Keep a sample read from the backend, evict the least recently used samples if required
+        :return: True if the sample is kept in memory
+        """
+        size = self.get_size(value)
+        if size > self._memory_budget:
+            return False
+        num_evictions = 0
+        with self._lock:
+            if key not in self._memory:
+                self._memory[key] = (value, size)
+                self._memory_size += size
+                # evict least recently used samples
+                while self._memory_size > self._memory_budget:
+                    _, (_, evicted_size) = self._memory.popitem(last=False)
+                    self._memory_size -= evicted_size
+                    num_evictions += 1
+        if num_evictions > 0:
+            self._cache_stats.record(counters={'evictions': num_evictions})
+        return True
+
+    def _pop_memory(self, key: Hashable) -> None:
+        with self._lock:
+            entry = self._memory.pop(key, None)
+            if entry is not None:
+                self._memory_size -= entry[1]
+
+    def _reset_memory(self) -> None:
+        with self._lock:
+            self._memory: OrderedDict = OrderedDict()
+            self._memory_size = 0
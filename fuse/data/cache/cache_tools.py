@@ -0,0 +1,340 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Command line tools to maintain cache directories
+Usage example:
+    python -m fuse.data.cache.cache_tools migrate --src <files cache dir> --dst <shards cache dir>
+    python -m fuse.data.cache.cache_tools benchmark --cache_dir <cache dir> --codecs none gzip lz4 zstd:3 shuffle+zstd:3
+    python -m fuse.data.cache.cache_tools inspect --paths <cache dirs or dirs containing cache dirs>
+    python -m fuse.data.cache.cache_tools trim --paths <cache dirs or dirs containing cache dirs> --max_bytes 100G --policy lru
+"""
+import argparse
+import logging
+import os
+import pickle
+import random
+import time
+from typing import Dict, List, Optional
+
+from pandas import DataFrame
+from tqdm import tqdm
+
+from fuse.data.cache.cache_base import FuseCacheBase
+from fuse.data.cache.cache_codecs import FuseSampleSerializer
+from fuse.data.cache.cache_files import FuseCacheFiles
+from fuse.data.cache.cache_index_journal import FuseCacheIndexJournal
+from fuse.data.cache.cache_mmap import FuseCacheMmap
+from fuse.data.cache.cache_shards import FuseCacheShards
+from fuse.data.cache.cache_shared_memory import FuseCacheSharedMemory
+from fuse.utils.misc.misc import get_pretty_dataframe
+from fuse.utils.utils_logger import fuse_logger_start
+
+
+def cache_index_exists(cache_dir: str) -> bool:
+    """
+    :param cache_dir: cache dir
+    :return: True if the cache index (compacted index file or journal) exists - otherwise opening the cache would reset it
+    """
+    return FuseCacheIndexJournal(os.path.join(cache_dir, 'cache_index.pkl')).exist()
+
+
+def open_cache(cache_dir: str) -> FuseCacheBase:
+    """
+    Open existing cache dir for reading, the cache type is detected from the cache properties.
+    The cache dir is not modified: raise an exception if the cache index doesn't exist, instead of resetting the cache.
+    :param cache_dir: cache dir created by FuseCacheFiles, FuseCacheShards, FuseCacheMmap or FuseCacheSharedMemory
+    :return: the cache object
+    """
+    if not cache_index_exists(cache_dir):
+        msg = f'open_cache: cache index not found in {cache_dir}'
+        logging.getLogger('Fuse').error(msg)
+        raise Exception(msg)
+
+    cache_format = None
+    cache_prop_file_name = os.path.join(cache_dir, 'cache_properties.pkl')
+    if os.path.exists(cache_prop_file_name):
+        with open(cache_prop_file_name, 'rb') as cache_prop_file:
+            cache_format = pickle.load(cache_prop_file).get('format', None)
+
+    if cache_format == FuseCacheSharedMemory.CACHE_FORMAT:
+        return FuseCacheSharedMemory(cache_dir, reset_cache=False, read_only=True)
+    if cache_format == FuseCacheMmap.CACHE_FORMAT:
+        return FuseCacheMmap(cache_dir, reset_cache=False)
+    if cache_format == FuseCacheShards.CACHE_FORMAT:
+        return FuseCacheShards(cache_dir, reset_cache=False)
+    return FuseCacheFiles(cache_dir, reset_cache=False)
+
+
+def migrate_cache_files_to_shards(src_cache_dir: str, dst_cache_dir: str, max_shard_size: int = 2 ** 30, codec: Optional[str] = None) -> None:
+    """
+    Convert cache directory created by FuseCacheFiles (file per sample) to FuseCacheShards format.
+    Shared tensors of a deduplicated cache are restored into each sample, samples referring to an evicted blob are skipped.
+    :param src_cache_dir: existing FuseCacheFiles cache dir, will not be modified
+    :param dst_cache_dir: destination dir, previous content will be deleted
+    :param max_shard_size: see FuseCacheShards
+    :param codec: Optional. compression codec of the destination cache, see FuseCacheShards
+    :return: None
+    """
+    lgr = logging.getLogger('Fuse')
+    if os.path.abspath(src_cache_dir) == os.path.abspath(dst_cache_dir):
+        raise Exception('migrate: source and destination cache dirs must be different')
+    if not cache_index_exists(src_cache_dir):
+        raise Exception(f'migrate: cache index not found in {src_cache_dir}')
+
+    src_cache = FuseCacheFiles(src_cache_dir, reset_cache=False)
+    dst_cache = FuseCacheShards(dst_cache_dir, reset_cache=True, max_shard_size=max_shard_size, codec=codec)
+
+    keys = src_cache.get_all_keys(include_none=True)
+    lgr.info(f'migrate: copying {len(keys)} samples from {src_cache_dir} to {dst_cache_dir}')
+    dst_cache.start_caching(None)
+    num_skipped = 0
+    for key in tqdm(keys):
+        try:
+            value = src_cache[key]
+        except KeyError:
+            # evicted - will be recomputed by the dataset
+            num_skipped += 1
+            continue
+        dst_cache[key] = value
+    dst_cache.save()
+    if num_skipped > 0:
+        lgr.warning(f'migrate: skipped {num_skipped} samples evicted from {src_cache_dir}')
+    lgr.info('migrate: done')
+
+
+def benchmark_codecs(cache_dir: str, codecs: List[str], num_samples: int = 100, codec_policy: Optional[Dict[str, str]] = None,
+                     seed: int = 0, dtype_policy: Optional[Dict[str, str]] = None) -> DataFrame:
+    """
+    Measure the size, encoding and decoding throughput of each codec on samples read from an existing cache
+    :param cache_dir: existing cache dir
+    :param codecs: list of codec specifications, see fuse.data.cache.cache_codecs.create_codec()
+    :param num_samples: number of samples to randomly select from the cache
+    :param codec_policy: Optional. per key codecs applied on top of each codec in codecs, see FuseSampleSerializer
+    :param seed: random seed used to select the samples
+    :param dtype_policy: Optional. per key reduced precision storage dtype applied with each codec, see FuseDtypePolicy
+    :return: dataframe with a row per codec: compression ratio relative to plain pickle, size and throughput in MB/sec
+    """
+    lgr = logging.getLogger('Fuse')
+    cache = open_cache(cache_dir)
+    keys = cache.get_all_keys()
+    keys = random.Random(seed).sample(keys, min(num_samples, len(keys)))
+    samples = [cache[key] for key in keys]
+    raw_size = sum(len(pickle.dumps(sample, protocol=pickle.HIGHEST_PROTOCOL)) for sample in samples)
+    lgr.info(f'benchmark: {len(samples)} samples from {cache_dir}, {raw_size / 2 ** 20:.1f} MB pickled')
+
+    rows = []
+    for codec in codecs:
+        try:
+            serializer = FuseSampleSerializer(codec, codec_policy, dtype_policy)
+        except Exception as e:
+            # e.g. optional package not installed
+            lgr.warning(f'benchmark: skipping codec {codec}: {e}')
+            continue
+
+        start_time = time.perf_counter()
+        encoded = [serializer.serialize(sample) for sample in samples]
+        encode_time = time.perf_counter() - start_time
+
+        start_time = time.perf_counter()
+        for data in encoded:
+            serializer.deserialize(data)
+        decode_time = time.perf_counter() - start_time
+
+        encoded_size = sum(len(data) for data in encoded)
+        rows.append({'codec': codec,
+                     'size (MB)': f'{encoded_size / 2 ** 20:.2f}',
+                     'ratio': f'{raw_size / max(encoded_size, 1):.2f}',
+                     'encode (MB/sec)': f'{raw_size / 2 ** 20 / max(encode_time, 1e-9):.1f}',
+                     'decode (MB/sec)': f'{raw_size / 2 ** 20 / max(decode_time, 1e-9):.1f}'})
+
+    results = DataFrame(rows)
+    lgr.info(get_pretty_dataframe(results, col_width=16))
+    return results
+
+
+def find_cache_dirs(paths: List[str]) -> List[str]:
+    """
+    Find the cache dirs in the given paths, recursively
+    :param paths: cache dirs or dirs containing cache dirs (e.g. a shared scratch dir)
+    :return: list of cache dirs
+    """
+    cache_dirs = []
+    for path in paths:
+        for dir_path, dir_names, file_names in os.walk(path):
+            if 'cache_properties.pkl' in file_names or 'cache_index.pkl' in file_names:
+                cache_dirs.append(dir_path)
+                # do not look for caches inside a cache
+                dir_names.clear()
+    return sorted(set(cache_dirs))
+
+
+def get_dir_size(dir_path: str) -> int:
+    """
+    :return: the total size of the files in dir_path, in bytes
+    """
+    total_size = 0
+    for dir_path, _, file_names in os.walk(dir_path):
+        for file_name in file_names:
+            try:
+                total_size += os.stat(os.path.join(dir_path, file_name)).st_size
+            except FileNotFoundError:
+                pass
+    return total_size
+
+
+def inspect_caches(paths: List[str]) -> DataFrame:
+    """
+    Summarize the cache dirs found in paths: format, number of samples and shared blobs, disk usage and last access time
+    :param paths: cache dirs or dirs containing cache dirs
+    :return: dataframe with a row per cache dir
+    """
+    rows = []
+    for cache_dir in find_cache_dirs(paths):
+        if not cache_index_exists(cache_dir):
+            logging.getLogger('Fuse').warning(f'inspect: skipping {cache_dir} - cache index not found')
+            continue
+        cache = open_cache(cache_dir)
+        row = {'cache dir': cache_dir,
+               'format': getattr(cache, 'CACHE_FORMAT', 'files'),
+               'samples': len(cache.get_all_keys()),
+               'invalid samples': len(cache.get_all_keys(include_none=True)) - len(cache.get_all_keys()),
+               'shared blobs': 0,
+               'size (MB)': f'{get_dir_size(cache_dir) / 2 ** 20:.1f}',
+               'last access': ''}
+        if isinstance(cache, FuseCacheFiles):
+            # including the blob files of a deduplicated cache (key None)
+            entries = cache.get_entries()
+            row['shared blobs'] = sum(entry[0] is None for entry in entries)
+            if entries:
+                row['last access'] = time.strftime('%Y-%m-%d %H:%M', time.localtime(max(entry[3] for entry in entries)))
+        rows.append(row)
+
+    results = DataFrame(rows)
+    logging.getLogger('Fuse').info(get_pretty_dataframe(results, col_width=24))
+    return results
+
+
+def trim_caches(paths: List[str], max_bytes: int, eviction_policy: str = 'lru') -> int:
+    """
+    Evict samples from the file per sample caches (FuseCacheFiles) found in paths until their total size fits max_bytes - a global quota.
+    Samples are evicted across all the caches by the eviction policy, the evicted samples will be recomputed on access.
+    The shared blob files of deduplicated caches are evicted by the same policy, the samples referring to them are evicted once read.
+    Safe to run while the caches are used: the deletions are recorded in the index journal of each cache.
+    Other cache formats can't evict single samples and are skipped.
+    :param paths: cache dirs or dirs containing cache dirs
+    :param max_bytes: the quota in bytes
+    :param eviction_policy: 'lru' - least recently used samples first, 'lrc' - least recently created samples first
+    :return: number of bytes freed
+    """
+    lgr = logging.getLogger('Fuse')
+    if eviction_policy not in FuseCacheFiles.EVICTION_POLICIES:
+        raise Exception(f'trim: unknown eviction policy {eviction_policy}, expected one of {FuseCacheFiles.EVICTION_POLICIES}')
+
+    entries = []
+    for cache_dir in find_cache_dirs(paths):
+        if not cache_index_exists(cache_dir):
+            lgr.warning(f'trim: skipping {cache_dir} - cache index not found')
+            continue
+        cache = open_cache(cache_dir)
+        if not isinstance(cache, FuseCacheFiles) or cache.single_file:
+            lgr.warning(f'trim: skipping {cache_dir} - only file per sample caches can be trimmed')
+            continue
+        entries.extend((cache,) + entry for entry in cache.get_entries())
+
+    total_size = sum(entry[3] for entry in entries)
+    # order by last access time (lru) or creation time (lrc)
+    time_index = 4 if eviction_policy == 'lru' else 5
+    entries.sort(key=lambda entry: entry[time_index])
+    num_bytes_freed = 0
+    num_evicted = 0
+    for cache, key, file_name, size, _, _ in entries:
+        if total_size - num_bytes_freed <= max_bytes:
+            break
+        if not cache.remove_entry(key, file_name):
+            continue
+        num_bytes_freed += size
+        num_evicted += 1
+
+    lgr.info(f'trim: evicted {num_evicted} files, freed {num_bytes_freed / 2 ** 20:.1f} MB, '
+             f'{(total_size - num_bytes_freed) / 2 ** 20:.1f} MB left')
+    return num_bytes_freed
+
+
+def parse_size(size: str) -> int:
+    """
+    :param size: size in bytes, optionally with a suffix: K, M, G or T (powers of 1024), e.g. '100G'
+    :return: size in bytes
+    """
+    units = {'K': 2 ** 10, 'M': 2 ** 20, 'G': 2 ** 30, 'T': 2 ** 40}
+    size = size.strip().upper().rstrip('B')
+    if size and size[-1] in units:
+        return int(float(size[:-1]) * units[size[-1]])
+    return int(size)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Fuse cache tools')
+    sub_parsers = parser.add_subparsers(dest='command')
+    sub_parsers.required = True
+
+    migrate_parser = sub_parsers.add_parser('migrate', help='convert file per sample cache dir to shards cache dir')
+    migrate_parser.add_argument('--src', required=True, help='existing FuseCacheFiles cache dir')
+    migrate_parser.add_argument('--dst', required=True, help='destination FuseCacheShards cache dir')
+    migrate_parser.add_argument('--max_shard_size', type=int, default=2 ** 30, help='maximum size of shard file in bytes')
+    migrate_parser.add_argument('--codec', default=None, help='compression codec of the destination cache, e.g. lz4, zstd:3')
+
+    benchmark_parser = sub_parsers.add_parser('benchmark', help='measure size and throughput of compression codecs on cached samples')
+    benchmark_parser.add_argument('--cache_dir', required=True, help='existing cache dir')
+    benchmark_parser.add_argument('--codecs', nargs='+', default=['none', 'gzip', 'lz4', 'zstd:3', 'shuffle+zstd:3'],
+                                  help='codecs to benchmark, e.g. gzip:6 lz4 zstd:19 shuffle+lz4 rle+zstd:3')
+    benchmark_parser.add_argument('--num_samples', type=int, default=100, help='number of samples to benchmark')
+    benchmark_parser.add_argument('--policy', nargs='*', default=[],
+                                  help='per key codecs applied on top of each codec, e.g. data.gt.mask=rle+zstd:3')
+    benchmark_parser.add_argument('--dtype_policy', nargs='*', default=[],
+                                  help='per key reduced precision storage dtype, e.g. data.input.image=uint8:0.01')
+
+    inspect_parser = sub_parsers.add_parser('inspect', help='summarize cache dirs: format, number of samples, disk usage')
+    inspect_parser.add_argument('--paths', nargs='+', required=True, help='cache dirs or dirs containing cache dirs')
+
+    trim_parser = sub_parsers.add_parser('trim', help='evict samples from file per sample caches until their total size fits a quota')
+    trim_parser.add_argument('--paths', nargs='+', required=True, help='cache dirs or dirs containing cache dirs')
+    trim_parser.add_argument('--max_bytes', required=True, help='the quota, e.g. 500M, 100G')
+    trim_parser.add_argument('--policy', default='lru', choices=FuseCacheFiles.EVICTION_POLICIES,
+                             help='lru - least recently used first, lrc - least recently created first')
+
+    args = parser.parse_args()
+
+    fuse_logger_start(console_verbose_level=logging.INFO)
+
+    if args.command == 'migrate':
+        migrate_cache_files_to_shards(args.src, args.dst, max_shard_size=args.max_shard_size, codec=args.codec)
+    elif args.command == 'benchmark':
+        codec_policy = dict(item.split('=', 1) for item in args.policy)
+        dtype_policy = dict(item.split('=', 1) for item in args.dtype_policy)
+        benchmark_codecs(args.cache_dir, args.codecs, num_samples=args.num_samples, codec_policy=codec_policy,
+                         dtype_policy=dtype_policy)
+    elif args.command == 'inspect':
+        inspect_caches(args.paths)
+    elif args.command == 'trim':
+        trim_caches(args.paths, parse_size(args.max_bytes), eviction_policy=args.policy)
+
+
+if __name__ == '__main__':
+    main()
@@ -23,10 +23,43 @@ Fuse Dataset Base
 import pickle
 from abc import abstractmethod
 from enum import Enum
-from typing import Any, List, Optional
+from typing import Any, Dict, Hashable, List, Optional, Sequence
 
 from torch.utils.data.dataset import Dataset
 
+from fuse.data.dataset.dataset_descriptor_store import FuseDescriptorStore
+
+
+class _FuseTrackedList(list):
+    """
+    List of sample descriptors counting its in-place modifications, so the descriptor to index map is rebuilt after any change
+    """
+
+    def __init__(self, *args):
+        super().__init__(*args)
+        self.version = 0
+
+    def _modified(method):
+        def modify(self, *args, **kwargs):
+            self.version = getattr(self, 'version', 0) + 1
+            return method(self, *args, **kwargs)
+        modify.__name__ = method.__name__
+        return modify
+
+    __setitem__ = _modified(list.__setitem__)
+    __delitem__ = _modified(list.__delitem__)
+    __iadd__ = _modified(list.__iadd__)
+    __imul__ = _modified(list.__imul__)
+    append = _modified(list.append)
+    extend = _modified(list.extend)
+    insert = _modified(list.insert)
+    pop = _modified(list.pop)
+    remove = _modified(list.remove)
+    clear = _modified(list.clear)
+    sort = _modified(list.sort)
+    reverse = _modified(list.reverse)
+    del _modified
+
 
 class FuseDatasetBase(Dataset):
     """
@@ -46,6 +79,82 @@ class FuseDatasetBase(Dataset):
     def __init__(self):
         super().__init__()
 
+    def __getstate__(self) -> dict:
+        # the descriptor to index map is rebuilt on demand
+        state = self.__dict__.copy()
+        state['_sample_descriptor_to_index'] = None
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        # instances saved by previous versions - plain attributes
+        if 'samples_description' in state:
+            state['_samples_description'] = state.pop('samples_description')
+        state.pop('sample_descriptor_to_index', None)
+        state['_sample_descriptor_to_index'] = None
+        if type(state.get('_samples_description', None)) is list:
+            state['_samples_description'] = _FuseTrackedList(state['_samples_description'])
+        self.__dict__.update(state)
+
+    @property
+    def samples_description(self) -> Sequence[Hashable]:
+        """
+        :return: the sample descriptors, the index of a sample is its position
+        """
+        return self.__dict__.get('_samples_description', [])
+
+    @samples_description.setter
+    def samples_description(self, samples_description: Sequence[Hashable]) -> None:
+        """
+        Set the sample descriptors (e.g. create(), filter()), the descriptor to index map is rebuilt on demand.
+        A list is copied, so its in-place modifications (e.g. dataset.samples_description.append(desc)) rebuild the map as well.
+        """
+        if type(samples_description) is list:
+            samples_description = _FuseTrackedList(samples_description)
+        self._samples_description = samples_description
+        self._sample_descriptor_to_index = None
+
+    @property
+    def sample_descriptor_to_index(self) -> Dict[Hashable, int]:
+        """
+        :return: map sample descriptor to sample index, consistent with samples_description
+        """
+        index = self.__dict__.get('_sample_descriptor_to_index', None)
+        if index is None or index[1] != self._get_samples_description_version():
+            descriptor_to_index = {}
+            # first occurrence, as list.index()
+            for sample_index, desc in enumerate(self.samples_description):
+                descriptor_to_index.setdefault(desc, sample_index)
+            index = self._sample_descriptor_to_index = (descriptor_to_index, self._get_samples_description_version())
+        return index[0]
+
+    @sample_descriptor_to_index.setter
+    def sample_descriptor_to_index(self, descriptor_to_index: Dict[Hashable, int]) -> None:
+        """
+        Set the descriptor to index map, used until samples_description is modified
+        """
+        self._sample_descriptor_to_index = (descriptor_to_index, self._get_samples_description_version())
+
+    def _get_samples_description_version(self) -> tuple:
+        """
+        :return: changes whenever samples_description is assigned or modified in-place
+        """
+        samples_description = self.samples_description
+        return id(samples_description), getattr(samples_description, 'version', None), len(samples_description)
+
+    def get_sample_index(self, descriptor: Hashable) -> int:
+        """
+        Constant time descriptor lookup, logarithmic time if the descriptors are stored in FuseDescriptorStore
+        :param descriptor: sample descriptor
+        :return: the index of the sample
+        """
+        try:
+            if isinstance(self.samples_description, FuseDescriptorStore):
+                # avoid a map of all the descriptors
+                return self.samples_description.index(descriptor)
+            return self.sample_descriptor_to_index[descriptor]
+        except (KeyError, ValueError):
+            raise ValueError(f'sample descriptor {descriptor} not found in dataset') from None
+
     @abstractmethod
     def create(self, **kwargs) -> None:
         """
@@ -19,30 +19,41 @@ Created on June 30, 2021
 
 import logging
 import os
-from multiprocessing import Manager
+from functools import partial
 from multiprocessing.pool import Pool, ThreadPool
-from typing import Any, Dict, Optional, Hashable, List, Union, Tuple, Callable
+from typing import Any, Dict, Optional, Hashable, List, Union, Tuple, Callable, Set, Sequence
 
 import numpy as np
 import torch
 from pandas import DataFrame
-from torch import Tensor
 from tqdm import tqdm, trange
 
 from fuse.data.augmentor.augmentor_base import FuseAugmentorBase
 from fuse.data.cache.cache_base import FuseCacheBase
-from fuse.data.cache.cache_files import FuseCacheFiles
-from fuse.data.cache.cache_memory import FuseCacheMemory
+from fuse.data.cache.cache_columns import FuseCacheColumns
+from fuse.data.cache.cache_factory import create_cache
+from fuse.data.cache.cache_lazy_writer import FuseCacheLazyWriter
 from fuse.data.cache.cache_null import FuseCacheNull
+from fuse.data.cache.cache_pipeline import FuseCachePipeline
+from fuse.data.cache.cache_prefetcher import FuseCachePrefetcher
 from fuse.data.data_source.data_source_base import FuseDataSourceBase
 from fuse.data.dataset.dataset_base import FuseDatasetBase
+from fuse.data.dataset.dataset_descriptor_store import FuseDescriptorStore
+from fuse.data.dataset.dataset_filter import FuseFilterBase, FuseFilterIsIn, to_column
+from fuse.data.dataset.dataset_manifest import FuseDatasetManifest
+from fuse.data.dataset.dataset_view import FuseDatasetView
 from fuse.data.processor.processor_base import FuseProcessorBase
+from fuse.data.sampler.sampler_prefetch import FusePrefetchIndex
 from fuse.data.visualizer.visualizer_base import FuseVisualizerBase
+from fuse.utils.data.collate import CollateCompiled
 from fuse.utils.utils_debug import FuseUtilsDebug
 from fuse.utils.utils_hierarchical_dict import FuseUtilsHierarchicalDict
 from fuse.utils.utils_logger import log_object_input_state
 from fuse.utils.misc.misc import get_pretty_dataframe, Misc
 
+# objects used by the caching workers - set once per worker, see FuseDatasetDefault._cache_worker_init()
+_cache_worker_state = {}
+
 
 class FuseDatasetDefault(FuseDatasetBase):
     """
@@ -57,7 +68,13 @@ class FuseDatasetDefault(FuseDatasetBase):
                  visualizer: Optional[FuseVisualizerBase] = None, post_processing_func=None,
                  statistic_keys: Optional[List[str]] = None,
                  filter_keys: Optional[List[str]] = None,
-                 data_key_prefix: Optional[str] = 'data'):
+                 data_key_prefix: Optional[str] = 'data',
+                 cache_type: str = 'files',
+                 cache_kwargs: Optional[Dict[str, Any]] = None,
+                 cache_by_processor: bool = False,
+                 cache_prefetch_threads: int = 0,
+                 processor_batch_size: int = 1,
+                 compact_descriptors: bool = False):
         """
         :param data_source:     objects provides the list of object description
         :param input_processors:dictionary of all the input data processors
@@ -74,6 +91,26 @@ class FuseDatasetDefault(FuseDatasetBase):
         :param statistic_keys: Optional. list of statistic keys to output in default self.summary() implementation
         :param filter_keys: Optional. list of keys to remove from the sample dictionary when getting an item
         :param data_key_prefix: every key added to sample_dict by the dataset will be prepended with this prefix to get unique name.
+        :param cache_type: the type of disk cache used when cache_dest is a dir:
+                           'files' - file per sample, 'shards' - samples appended to a few large shard files,
+                           'mmap' - zero copy memory mapped tensors,
+                           'shared_memory' - in-memory cache shared by the DataLoader workers, use with cache_dest='memory'.
+                           See fuse.data.cache.cache_factory.create_cache()
+        :param cache_kwargs: Optional. additional arguments for the cache object constructor.
+                             e.g. {'memory_budget': 2 ** 30} keeps the most recently used samples in memory (per process),
+                             {'max_bytes': 50 * 2 ** 30} limits the disk space of a 'files' cache, evicted samples are recomputed on access
+                             {'dtype_policy': {'data.input.*': 'float16'}} stores the matching float arrays in reduced precision
+                             {'dedup_min_size': 2 ** 20} stores identical large tensors shared by several samples once
+        :param cache_by_processor: if True, the output of each processor is cached separately,
+                                   keyed by (sample descriptor, processor key, processor fingerprint).
+                                   When a processor changes (see FuseProcessorBase.fingerprint()), only its outputs will be recomputed.
+        :param cache_prefetch_threads: if > 0, the cache entries of the samples expected to be read next are read in the background,
+                                       by cache_prefetch_threads threads per process.
+                                       Requires wrapping the batch sampler with fuse.data.sampler.sampler_prefetch.FuseSamplerPrefetch
+        :param processor_batch_size: number of samples processed together while caching (a task of a caching worker),
+                                     see FuseProcessorBase.process_batch()
+        :param compact_descriptors: if True, samples_description is stored in a FuseDescriptorStore instead of a list - a few bytes per sample,
+                                    cheap to pickle to the DataLoader workers. Requires descriptors that are strings, integers or tuples of them.
         """
         # log object input state
         log_object_input_state(self, locals())
@@ -82,6 +119,12 @@ class FuseDatasetDefault(FuseDatasetBase):
 
         # store input params
         self.cache_dest = cache_dest
+        self.cache_type = cache_type
+        self.cache_kwargs = cache_kwargs or {}
+        self.cache_by_processor = cache_by_processor
+        self.cache_prefetch_threads = cache_prefetch_threads
+        self.processor_batch_size = processor_batch_size
+        self.compact_descriptors = compact_descriptors
         self.data_source = data_source
         if processors is None:
             self.processors = {'input': input_processors, 'gt': gt_processors}
@@ -108,6 +151,10 @@ class FuseDatasetDefault(FuseDatasetBase):
 
         # create dummy cache for now - the cache will be created and loaded in create()
         self.cache: FuseCacheBase = FuseCacheNull()
+        # used to cache samples on first read, see create(lazy_cache=True)
+        self._lazy_cache_writer = None
+        # used to read ahead the cache entries, created in create() if cache_prefetch_threads > 0
+        self._cache_prefetcher = None
         # create dummy cache self.cache_fields used to store specific fields of the sample - used to optimize the running time of dataset.get(
         # key=<key name>, use_cache=True)
         self.cache_fields: FuseCacheBase = FuseCacheNull()
@@ -119,7 +166,7 @@ class FuseDatasetDefault(FuseDatasetBase):
     def create(self, cache_all: bool = True, reset_cache: bool = False,
                num_workers: int = 16, worker_init_func: Callable = None, worker_init_args: Any = None,
                override_datasource: Optional[FuseDataSourceBase] = None,
-               pool_type: str = 'process') -> None:
+               pool_type: str = 'process', lazy_cache: bool = False, use_manifest: bool = False, io_threads: int = 0) -> None:
         """
         Create the data set, including loading sample descriptions and caching
         :param cache_all: if True will try to cache all
@@ -129,6 +176,16 @@ class FuseDatasetDefault(FuseDatasetBase):
         :param worker_init_args: worker init function arguments
         :param override_datasource: might be used to change the data source
         :param pool_type: multiprocess pooling type, can be either 'thread' (for ThreadPool) or 'process' (for 'Pool', default).
+        :param lazy_cache: if True, samples are not cached upfront (cache_all is ignored), instead each sample is cached on first read.
+                           The first epoch doubles as the caching pass. Requires a disk cache (cache_dest is a dir).
+                           Samples that failed to load are replaced by the next valid sample, until dropped by the next create().
+        :param use_manifest: if True, open the dataset using the manifest written to the cache dir by a previous create(),
+                             without scanning the data source and the cache index (see FuseDatasetManifest).
+                             The data source is assumed not to be changed since. Falls back to a regular create() if the manifest is
+                             missing or doesn't match the dataset configuration.
+        :param io_threads: if > 0, cache using a staged pipeline: the I/O bound part of the processors (FuseProcessorBase.load())
+                           runs on io_threads threads, the CPU bound part on num_workers processes and the cache is written by this process.
+                           See cache_all_samples().
         :return: None
         """
         # debug - override num workers
@@ -144,31 +201,132 @@ class FuseDatasetDefault(FuseDatasetBase):
         if override_datasource is not None:
             self.data_source = override_datasource
 
+        # cache object
+        if isinstance(self.cache_dest, str):
+            self.cache: FuseCacheBase = create_cache(self.cache_dest, reset_cache, self.cache_type, **self.cache_kwargs)
+
+        # fingerprint of each processor - used to identify the cached outputs of each processor
+        if self.cache_by_processor:
+            self._processors_fingerprints = self._get_processors_fingerprints()
+
+        # the manifest is not used in debug mode - override number of samples
+        dataset_override_num_samples = FuseUtilsDebug().get_setting('dataset_override_num_samples')
+        manifest_file_name = self._get_manifest_file_name() if dataset_override_num_samples == 'default' else None
+
+        # open using the manifest - skip scanning the data source and the cache index
+        self._lazy_cache_writer = None
+        manifest = None
+        if use_manifest and not reset_cache and not lazy_cache and manifest_file_name is not None:
+            manifest = FuseDatasetManifest.load(manifest_file_name, self._get_manifest_signature())
+        if manifest is not None:
+            self.samples_description = manifest.get_samples_description()
+            logging.getLogger('Fuse').info(f'FuseDatasetDefault: opened {len(self.samples_description)} samples using the dataset manifest')
+            self._compact_samples_description()
+            if self.cache_prefetch_threads > 0:
+                self._cache_prefetcher = FuseCachePrefetcher(self.cache, num_threads=self.cache_prefetch_threads)
+            return
+
         # extract list of sample description
         self.samples_description = self.data_source.get_samples_description()
 
         # debug - override number of samples
-        dataset_override_num_samples = FuseUtilsDebug().get_setting('dataset_override_num_samples')
         if dataset_override_num_samples != 'default':
             self.samples_description = self.samples_description[:dataset_override_num_samples]
             logging.getLogger('Fuse').info(f'Dataset - debug mode - override num samples to {dataset_override_num_samples}', {'color': 'red'})
 
-        # cache object
-        if isinstance(self.cache_dest, str) and self.cache_dest == 'memory':
-            self.cache: FuseCacheBase = FuseCacheMemory()
-        elif isinstance(self.cache_dest, str):
-            self.cache: FuseCacheBase = FuseCacheFiles(self.cache_dest, reset_cache)
+        # cache on first read
+        if lazy_cache:
+            if not isinstance(self.cache_dest, str) or not self.cache.support_multiprocess_writing() or self.cache_by_processor:
+                msg = 'lazy_cache requires a disk cache (cache_dest is a dir) and cache_by_processor=False'
+                logging.getLogger('Fuse').error(msg)
+                raise Exception(msg)
+            self._lazy_cache_writer = FuseCacheLazyWriter(self.cache, os.path.join(self.cache_dest, 'lazy_cache.lock'))
+            # merge the samples cached by previous runs, so the journal fragments don't accumulate
+            if not self.cache.is_compacted():
+                self.cache.save()
+            self.cache.start_caching()
+
+            # the samples cached from now on are not listed in the manifest
+            if manifest_file_name is not None and os.path.exists(manifest_file_name):
+                os.remove(manifest_file_name)
+
+            # drop samples that are known to be invalid
+            invalid_descriptors = set(self.cache.get_all_keys(include_none=True)) - set(self.cache.get_all_keys())
+            self.samples_description = [desc for desc in self.samples_description if desc not in invalid_descriptors]
 
         # cache samples if required
-        if not isinstance(self.cache, FuseCacheNull) and cache_all:
-            self.cache_all_samples(num_workers=num_workers, worker_init_func=worker_init_func, worker_init_args=worker_init_args)
+        elif not isinstance(self.cache, FuseCacheNull) and cache_all:
+            self.cache_all_samples(num_workers=num_workers, worker_init_func=worker_init_func, worker_init_args=worker_init_args,
+                                   io_threads=io_threads)
 
             # update descriptors
             all_descriptors = set(self.samples_description)
-            cached_descriptors = set(self.cache.get_all_keys())
+            cached_keys = set(self.cache.get_all_keys())
+            if self.cache_by_processor:
+                # valid sample - all the processors outputs are cached
+                cached_descriptors = set([desc for desc in all_descriptors
+                                          if all((desc, processor_key, fingerprint) in cached_keys
+                                                 for processor_key, fingerprint in self._processors_fingerprints.items())])
+            else:
+                cached_descriptors = cached_keys
             self.samples_description = sorted(list(all_descriptors & cached_descriptors))
 
-        self.sample_descriptor_to_index = {v: k for k, v in enumerate(self.samples_description)}
+            if manifest_file_name is not None:
+                self._save_manifest(manifest_file_name, sorted(list(all_descriptors - cached_descriptors)))
+
+        self._compact_samples_description()
+
+        # cache read ahead
+        if self.cache_prefetch_threads > 0 and not isinstance(self.cache, FuseCacheNull):
+            self._cache_prefetcher = FuseCachePrefetcher(self.cache, num_threads=self.cache_prefetch_threads)
+
+    def _compact_samples_description(self) -> None:
+        """
+        Store samples_description in FuseDescriptorStore if compact_descriptors is set and the descriptors are supported
+        """
+        if not self.__dict__.get('compact_descriptors', False) or isinstance(self.samples_description, FuseDescriptorStore):
+            return
+        try:
+            self.samples_description = FuseDescriptorStore(self.samples_description)
+        except (ValueError, OverflowError) as e:
+            logging.getLogger('Fuse').warning(f'FuseDatasetDefault: keeping samples_description as a list - {e}')
+
+    def _get_manifest_file_name(self) -> Optional[str]:
+        """
+        :return: path to the manifest file, None if the dataset is not cached to disk
+        """
+        if not isinstance(self.cache_dest, str) or self.cache_dest == 'memory':
+            return None
+        return os.path.join(self.cache_dest, FuseDatasetManifest.FILE_NAME)
+
+    def _get_manifest_signature(self) -> Dict[str, Any]:
+        """
+        :return: the configuration a manifest is valid for
+        """
+        return {'data_key_prefix': self.data_key_prefix,
+                'cache_type': self.cache_type,
+                'cache_by_processor': self.cache_by_processor,
+                'processors_fingerprints': self._processors_fingerprints if self.cache_by_processor else None}
+
+    def _save_manifest(self, manifest_file_name: str, invalid_descriptors: List[Hashable]) -> None:
+        """
+        Save the manifest of the cached samples, unless an identical manifest already exists
+        :param manifest_file_name: path to the manifest file
+        :param invalid_descriptors: the descriptors of the samples that failed to load
+        """
+        signature = self._get_manifest_signature()
+        manifest = FuseDatasetManifest.load(manifest_file_name, signature)
+        if manifest is not None and manifest.descriptors == self.samples_description + invalid_descriptors:
+            return
+
+        # the sample field of each processor
+        if isinstance(self.processors, FuseProcessorBase):
+            fields = [self.data_key_prefix or '']
+        else:
+            fields = [f'{self.data_key_prefix}.{key}' if self.data_key_prefix else key for key in FuseUtilsHierarchicalDict.get_all_keys(self.processors)]
+        valid = np.zeros(len(self.samples_description) + len(invalid_descriptors), dtype=bool)
+        valid[:len(self.samples_description)] = True
+        FuseDatasetManifest(self.samples_description + invalid_descriptors, valid, fields, signature).save(manifest_file_name)
 
     #### ITERATE AND GET DATA
     def __len__(self):
@@ -212,52 +370,82 @@ class FuseDatasetDefault(FuseDatasetBase):
                     'data.gt,gt_global': tensor of global gt
                     }
 
+        """
+        return FuseDatasetDefault.getitems_without_augmentation_static(processors, [descr], data_key_prefix)[0]
+
+    def getitems_without_augmentation(self, indices: List[int]) -> List[Any]:
+        """
+        Get the original items of a batch of samples - same as getitem_without_augmentation() per index,
+        each processor processes the entire batch at once (see FuseProcessorBase.process_batch())
+        :param indices: list of sample indices
+        :return: list of the original samples
+        """
+        samples_desc = [self.samples_description[index] for index in indices]
+        samples = self.getitems_without_augmentation_static(self.processors, samples_desc, data_key_prefix=self.data_key_prefix)
+        for sample_description, sample in zip(samples_desc, samples):
+            # make sure sample was loaded correctly
+            if sample is None:
+                msg = f'Failed to load data sample_desc={sample_description}, skipping is only possible when caching is enabled'
+                logging.getLogger('Fuse').error(msg)
+                raise Exception(msg)
+        return samples
+
+    @staticmethod
+    def getitems_without_augmentation_static(processors: Union[Dict[str, FuseProcessorBase], FuseProcessorBase], descrs: Sequence[Hashable],
+                                             data_key_prefix: Optional[str], loaded: Optional[Dict[Optional[str], List[Any]]] = None) -> List[Any]:
+        """
+        Get the original items of a batch of samples, see getitem_without_augmentation_static().
+        Each processor processes the entire batch at once (see FuseProcessorBase.process_batch()).
+        :param processors:  the processors required to generate the samples
+        :param descrs:      list of sample descriptors
+        :param loaded:      Optional, map processor key (None for a single processor) to the data loaded per sample by FuseProcessorBase.load().
+                            If set, the samples are generated by FuseProcessorBase.process_loaded()
+        :return: list of the original samples, None for the samples that failed to load
         """
         lgr = logging.getLogger('Fuse')
-        sample_data = {}
-        if data_key_prefix is not None:
-            sample = {data_key_prefix : sample_data}
-        else:
-            sample = sample_data
-        
-        # extract the sample description to be used by the processors
-        sample_data['descriptor'] = descr
-        # process data
+        samples_data = [{'descriptor': descr} for descr in descrs]
         if isinstance(processors, FuseProcessorBase):  # handle a case of single processor
+            processors_list = [(None, processors)]
+        else:  # otherwise, dictionary that includes multiple processors
+            for sample_data in samples_data:
+                sample_data['input'] = {}
+            processors_list = [(key, FuseUtilsHierarchicalDict.get(processors, key)) for key in FuseUtilsHierarchicalDict.get_all_keys(processors)]
+
+        # indices of the samples loaded so far - a sample that failed to load is not processed by the next processors
+        valid = list(range(len(descrs)))
+        for key, processor in processors_list:
+            processor_name = 'processor' if key is None else f'processor {key}'
+            batch_descrs = [descrs[index] for index in valid]
+            if len(batch_descrs) == 0:
+                break
             try:
-                processor = processors
-                value = processor(descr)
+                if loaded is None:
+                    values = processor.process_batch(batch_descrs)
+                else:
+                    values = [processor.process_loaded(descrs[index], loaded[key][index]) for index in valid]
+            except:
+                lgr.error(f'{processor_name} failed to load data sample_desc={batch_descrs[0] if len(batch_descrs) == 1 else batch_descrs}')
+                raise
 
+            processed = []
+            for index, value in zip(valid, values):
                 if value is None:
-                    lgr.error(f'processor failed to load data sample_desc={descr}, got None, skipping sample')
-                    return None
+                    lgr.error(f'{processor_name} failed to load data sample_desc={descrs[index]}, got None, skipping sample')
+                    continue
                 elif isinstance(value, dict):
                     value = value.copy()
 
-                sample_data.update(value)
-            except:
-                lgr.error(f'processor failed to load data sample_desc={descr}')
-                raise
-        else:  # otherwise, dictionary that includes multiple processors
-            sample_data['input'] = {}
-            all_keys = FuseUtilsHierarchicalDict.get_all_keys(processors)
-            for key in all_keys:
-                try:
-                    processor = FuseUtilsHierarchicalDict.get(processors, key)
-                    value = processor(descr)
-
-                    if value is None:
-                        lgr.error(f'processor {key} failed to load data sample_desc={descr}, got None, skipping sample')
-                        return None
-                    elif isinstance(value, dict):
-                        value = value.copy()
-
-                    FuseUtilsHierarchicalDict.set(sample_data, key, value)
-                except:
-                    lgr.error(f'processor {key} failed to load data sample_desc={descr}')
-                    raise
+                if key is None:
+                    samples_data[index].update(value)
+                else:
+                    FuseUtilsHierarchicalDict.set(samples_data[index], key, value)
+                processed.append(index)
+            valid = processed
 
-        return sample
+        samples = [None] * len(descrs)
+        for index in valid:
+            samples[index] = {data_key_prefix: samples_data[index]} if data_key_prefix is not None else samples_data[index]
+        return samples
 
     def get_from_cache(self, index: Optional[int], key: str):
         """
@@ -266,11 +454,16 @@ class FuseDatasetDefault(FuseDatasetBase):
 
         :param index: the index of the item, if None will return all items
         :param key: string representing the exact information required
-        :return: the required info
+        :return: the required info. If index is None: a numpy array (or a tensor if the values are tensors) when the field is cached
+                 by cache_sample_fields() and numeric, a list otherwise
         """
 
         if index is None:
-            # return all samples
+            # return all samples - single vectorized read if the field is cached as a column
+            if isinstance(self.cache_fields, FuseCacheColumns):
+                values = self.cache_fields.get_column(key, self.samples_description)
+                if values is not None:
+                    return values
             values = []
             for index in trange(len(self)):
                 # first look for the specific file inside the cache
@@ -291,6 +484,22 @@ class FuseDatasetDefault(FuseDatasetBase):
                 # if not found get the all sample and then extract the specified field
                 return FuseUtilsHierarchicalDict.get(self.getitem(index, apply_augmentation=False), key)
 
+    def get_column(self, key: str, indices: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        Get the values of a field as a column (see fuse.data.dataset.dataset_filter.to_column()).
+        A single vectorized read if the field is cached as a column (see cache_sample_fields()), otherwise read per sample as in get_from_cache().
+        :param key: the field (key in sample_dict)
+        :param indices: sample indices, None for all the samples
+        :return: numpy array, a value per sample
+        """
+        if indices is None:
+            return to_column(self.get_from_cache(None, key))
+        if isinstance(self.cache_fields, FuseCacheColumns):
+            values = self.cache_fields.get_column(key, [self.samples_description[index] for index in indices])
+            if values is not None:
+                return to_column(values)
+        return to_column([self.get_from_cache(int(index), key) for index in tqdm(indices)])
+
     def get(self, index: Optional[Union[int, Hashable]], key: Optional[str] = None, use_cache: bool = False) -> Any:
         """
         Get input, ground truth or metadata of a sample.
@@ -300,12 +509,12 @@ class FuseDatasetDefault(FuseDatasetBase):
 
         :param key: string representing the exact information required. If None, will return all samples
         :param use_cache: if true, will try to reload the sample from caching mechanism
-        :return: the required info
+        :return: the required info. If index is None, key is specified and use_cache is True, see get_from_cache()
         """
         if index is not None and not isinstance(index, int):
             # get sample giving sample descriptor
             # assume index is sample description
-            index = self.samples_description.index(index)
+            index = self.get_sample_index(index)
 
         # if key not specified return the all sample
         if key is None:
@@ -341,7 +550,7 @@ class FuseDatasetDefault(FuseDatasetBase):
             try:
                 value = processor.get_all(self.samples_description)
             except:
-                value = [processor(sample_description) for sample_description in self.samples_description]
+                value = processor.process_batch(self.samples_description)
             if inner_key != '':
                 value = [FuseUtilsHierarchicalDict.get(v, inner_key) for v in value]
         else:
@@ -362,6 +571,17 @@ class FuseDatasetDefault(FuseDatasetBase):
         sample_stages_debug = self.sample_stages_debug
         return self.getitem(index, sample_stages_debug=sample_stages_debug)
 
+    def __getitems__(self, indices: List[int]) -> List[Any]:
+        """
+        Get a batch of samples, called by torch DataLoader instead of __getitem__ per index (when batching is enabled)
+        :param indices: list of sample indices
+        :return: list of samples after augmentation, to be collated
+        """
+        # subclasses customizing a single sample - keep their behavior
+        if type(self).__getitem__ is not FuseDatasetDefault.__getitem__ or type(self).getitem is not FuseDatasetDefault.getitem:
+            return [self[index] for index in indices]
+        return self.getitems(indices)
+
     def getitem(self, index: int, apply_augmentation: bool = True, apply_post_processing: bool = True, sample_stages_debug: bool = False) -> Any:
         """
         Get sample, read it from cache if possible
@@ -372,21 +592,14 @@ class FuseDatasetDefault(FuseDatasetBase):
         :return: the required sample after augmentation
         """
 
-        # either load from cache or generate and store in cache
-        sample_desc = self.samples_description[index]
+        # start reading the samples expected to be read next by this process, see FuseSamplerPrefetch
+        self._prefetch(index)
 
-        if sample_desc in self.cache:
-            sample = self.cache[sample_desc]
-        else:
-            sample = self.getitem_without_augmentation(index)
+        # either load from cache or generate and store in cache
+        sample = self._get_original_sample(index)
 
         # filter some of the keys if required
-        if self.filter_keys is not None:
-            for key in self.filter_keys:
-                try:
-                    FuseUtilsHierarchicalDict.pop(sample, key)
-                except KeyError:
-                    pass
+        self._filter_sample_keys(sample)
 
         # debug mode - print original sample before augmentation and before post processing
         if sample_stages_debug:
@@ -421,73 +634,282 @@ class FuseDatasetDefault(FuseDatasetBase):
 
         return sample
 
+    def getitems(self, indices: List[int], apply_augmentation: bool = True, apply_post_processing: bool = True) -> List[Any]:
+        """
+        Get a batch of samples - same as getitem() per index, with less per sample overhead:
+        the samples found in cache are read at once (see FuseCacheBase.get_many()) and the batch is augmented at once
+        (see FuseAugmentorBase.apply_batch()).
+        :param indices: list of sample indices
+        :param apply_augmentation: if true, will apply augmentation
+        :param apply_post_processing: If true, will apply post processing
+        :return: list of samples
+        """
+        # debug mode - log the stages of the first sample
+        if self.sample_stages_debug:
+            return [self.getitem(index, apply_augmentation=apply_augmentation, apply_post_processing=apply_post_processing,
+                                 sample_stages_debug=self.sample_stages_debug) for index in indices]
+
+        for index in indices:
+            self._prefetch(index)
+
+        samples_desc = [self.samples_description[index] for index in indices]
+        # read the cached samples at once, the prefetched samples are read one by one
+        if self.cache_by_processor or self._cache_prefetcher is not None:
+            cached = {}
+        else:
+            cached = self.cache.get_many(samples_desc)
+
+        is_cached = [sample_desc in cached for sample_desc in samples_desc]
+
+        # process the samples not found in cache at once, unless cached per processor or on first read
+        processed = None
+        missing = [index for index, found in zip(indices, is_cached) if not found]
+        if len(missing) > 0 and not self.cache_by_processor and self._lazy_cache_writer is None and self._cache_prefetcher is None and \
+                type(self).getitem_without_augmentation is FuseDatasetDefault.getitem_without_augmentation:
+            self.cache.stats.record(counters={'misses': len(missing)})
+            processed = iter(self.getitems_without_augmentation(missing))
+
+        samples = []
+        for index, sample_desc, found in zip(indices, samples_desc, is_cached):
+            if found:
+                # pop - an index repeated in the batch gets its own copy
+                sample = cached.pop(sample_desc) if sample_desc in cached else self._get_original_sample(index)
+            elif processed is not None:
+                sample = next(processed)
+            else:
+                sample = self._get_original_sample(index)
+            self._filter_sample_keys(sample)
+            samples.append(sample)
+
+        if self.augmentor is not None and apply_augmentation:
+            samples = self.augmentor.apply_batch(samples)
+
+        if self.post_processing_func is not None and apply_post_processing:
+            for sample in samples:
+                self.post_processing_func(sample)
+
+        return samples
+
+    def _prefetch(self, index: int) -> None:
+        """
+        Start reading the samples expected to be read next by this process, see FuseSamplerPrefetch
+        :param index: sample index, might carry the indices to prefetch (FusePrefetchIndex)
+        """
+        if self._cache_prefetcher is not None and isinstance(index, FusePrefetchIndex) and len(index.prefetch) > 0:
+            self._cache_prefetcher.prefetch([self.samples_description[prefetch_index] for prefetch_index in index.prefetch])
+
+    def _get_original_sample(self, index: int) -> Any:
+        """
+        Read a sample from cache, or generate it if not cached
+        :param index: sample index
+        :return: the sample before filtering keys and augmentation
+        """
+        sample_desc = self.samples_description[index]
+        if self.cache_by_processor:
+            sample = self._get_sample_from_processors_cache(sample_desc)
+            if sample is None:
+                sample = self.getitem_without_augmentation(index)
+            return sample
+
+        found, sample = self._read_cache(sample_desc)
+        if not found:
+            self.cache.stats.record(counters={'misses': 1})
+        if self._lazy_cache_writer is not None and sample is None:
+            # not cached yet, or failed to load (marked as None)
+            sample = self._getitem_lazy_cache(index)
+        elif not found:
+            sample = self.getitem_without_augmentation(index)
+        return sample
+
+    def _filter_sample_keys(self, sample: Any) -> None:
+        """
+        Remove the keys listed in filter_keys from the sample, in place
+        """
+        if self.filter_keys is not None:
+            for key in self.filter_keys:
+                try:
+                    FuseUtilsHierarchicalDict.pop(sample, key)
+                except KeyError:
+                    pass
+
+    def _read_cache(self, sample_desc: Hashable) -> Tuple[bool, Any]:
+        """
+        Read a sample from cache, using the cache prefetcher if enabled
+        :param sample_desc: sample descriptor
+        :return: tuple of a boolean, False if the sample is not in cache or was evicted from the cache, and the sample
+        """
+        if sample_desc not in self.cache:
+            return False, None
+        try:
+            if self._cache_prefetcher is not None:
+                return True, self._cache_prefetcher.get(sample_desc)[1]
+            return True, self.cache[sample_desc]
+        except KeyError:
+            # evicted from the cache (see FuseCacheFiles max_bytes) - will be recomputed
+            return False, None
+
+    def _getitem_lazy_cache(self, index: int) -> Any:
+        """
+        Get a sample missing in cache, see _compute_lazy_cache().
+        A sample that failed to load is replaced by the next valid sample - the eager caching drops such samples,
+        while here the samples of the epoch are already set. It is dropped by the next create().
+        :param index: sample index
+        :return: the original sample
+        """
+        lgr = logging.getLogger('Fuse')
+        num_samples = len(self.samples_description)
+        for offset in range(num_samples):
+            sample_desc = self.samples_description[(index + offset) % num_samples]
+            sample = self._compute_lazy_cache(sample_desc)
+            if sample is not None:
+                return sample
+            lgr.error(f'Failed to load data sample_desc={sample_desc}, replaced by the next sample. It will be skipped by the next create()')
+
+        msg = 'Failed to load all the samples'
+        lgr.error(msg)
+        raise Exception(msg)
+
+    def _compute_lazy_cache(self, sample_desc: Hashable) -> Any:
+        """
+        Compute a sample missing in cache and write it to the cache in the background.
+        If the sample was already computed by another process (or is being computed), read it from the cache instead.
+        :param sample_desc: sample descriptor
+        :return: the original sample, None if failed to load
+        """
+        writer = self._lazy_cache_writer
+        # wait if being computed by another process, then read the updates of the other processes
+        writer.lock(sample_desc)
+        self.cache.refresh()
+        found, sample = self._read_cache(sample_desc)
+        if found:
+            writer.unlock(sample_desc)
+        else:
+            try:
+                sample = self.getitem_without_augmentation_static(self.processors, sample_desc, data_key_prefix=self.data_key_prefix)
+            except:
+                writer.unlock(sample_desc)
+                raise
+            # the lock is released once written, also for invalid samples - marked as None
+            writer.write(sample_desc, sample)
+        return sample
+
+    def flush_cache(self) -> None:
+        """
+        Wait until the samples cached on first read (see create(lazy_cache=True)) by this process are written
+        """
+        if self._lazy_cache_writer is not None:
+            self._lazy_cache_writer.flush()
+
+    def get_cache_stats(self) -> Dict[str, Any]:
+        """
+        Cache statistics aggregated across all the processes (e.g. DataLoader workers), see FuseCacheBase.get_stats()
+        Misses include the samples computed because they were not found in cache.
+        :return: dictionary with the counters, hit rate and latency statistics
+        """
+        return self.cache.get_stats()
+
+    def get_cache_prefetch_stats(self) -> Optional[Dict[str, Any]]:
+        """
+        Cache read-ahead statistics of this process (see cache_prefetch_threads)
+        :return: dictionary with the number of hits, misses, prefetched and dropped entries and hit rate. None if read-ahead is disabled.
+        """
+        if self._cache_prefetcher is None:
+            return None
+        return self._cache_prefetcher.get_stats()
+
     #### BATCHING
     def collate_fn(self, samples: List[Dict], avoid_stack_keys: Tuple = tuple()) -> Dict:
         """
-        collate list of samples into batch_dict
+        collate list of samples into batch_dict, see fuse.utils.data.collate.CollateCompiled
         :param samples: list of samples
         :param avoid_stack_keys: list of keys to just collect to a list and avoid stack operation
         :return: batch_dict
         """
-        batch_dict = {}
-        keys = FuseUtilsHierarchicalDict.get_all_keys(samples[0])
-        for key in keys:
-            try:
-                collected_value = [FuseUtilsHierarchicalDict.get(sample, key) for sample in samples if sample is not None]
-                if key in avoid_stack_keys:
-                    FuseUtilsHierarchicalDict.set(batch_dict, key, collected_value)
-                elif isinstance(collected_value[0], Tensor):
-                    FuseUtilsHierarchicalDict.set(batch_dict, key, torch.stack(collected_value))
-                elif isinstance(collected_value[0], np.ndarray):
-                    FuseUtilsHierarchicalDict.set(batch_dict, key, np.stack(collected_value))
-                else:
-                    FuseUtilsHierarchicalDict.set(batch_dict, key, collected_value)
-            except:
-                logging.getLogger('Fuse').error(f'Failed to collect key {key}')
-                raise
-
-        return batch_dict
+        # the gather plan is compiled once per avoid_stack_keys
+        collate_fns = self.__dict__.setdefault('_collate_fns', {})
+        collate = collate_fns.get(tuple(avoid_stack_keys), None)
+        if collate is None:
+            collate = collate_fns[tuple(avoid_stack_keys)] = CollateCompiled(avoid_stack_keys)
+        return collate(samples)
 
     #### CACHING
-    def cache_all_samples(self, num_workers: int = 16, worker_init_func: Callable = None, worker_init_args: Any = None) -> None:
+    def cache_all_samples(self, num_workers: int = 16, worker_init_func: Callable = None, worker_init_args: Any = None,
+                          io_threads: int = 0, queue_size: Optional[int] = None) -> None:
         """
         Cache all data
         :param num_workers: num of workers used to cache the samples
         :param worker_init_func: process initialization function (multi processing mode)
         :param worker_init_args: worker init function arguments
+        :param io_threads: if > 0, cache using a staged pipeline (see fuse.data.cache.cache_pipeline.FuseCachePipeline):
+                           io_threads threads run the I/O bound part of the processors (FuseProcessorBase.load()),
+                           num_workers processes run the CPU bound part (FuseProcessorBase.process_loaded()) and this process writes the cache.
+                           The throughput of each stage is logged. Not supported when caching by processor, or with pool_type 'thread'.
+        :param queue_size: max number of tasks waiting between the pipeline stages, default 2 * (num_workers + io_threads)
         :return: None
         """
         lgr = logging.getLogger('Fuse')
 
         # check if cache is required
         all_descriptors = set(self.samples_description)
-        cached_descriptors = set(self.cache.get_all_keys(include_none=True))
-        descriptors_to_cache = all_descriptors - cached_descriptors
+        if self.cache_by_processor:
+            descriptors_to_cache = self._get_processors_outputs_to_cache(all_descriptors)
+        else:
+            cached_descriptors = set(self.cache.get_all_keys(include_none=True))
+            descriptors_to_cache = all_descriptors - cached_descriptors
 
         if len(descriptors_to_cache) != 0:
             # multi process cache
             lgr.info(f'FuseDatasetDefault: caching {len(descriptors_to_cache)} out of {len(all_descriptors)}')
-            with Manager() as manager:
-                # change cache mode - to caching (writing)
-                self.cache.start_caching(manager)
-
-                # multi process cache
-                if num_workers > 0:
-                    the_pool = ThreadPool if self.pool_type == 'thread' else Pool
-                    pool = the_pool(processes=num_workers, initializer=worker_init_func, initargs=worker_init_args)
-                    for _ in tqdm(pool.imap_unordered(func=self._cache_sample,
-                                                      iterable=[(self.processors, desc, self.cache, self.data_key_prefix) for desc in descriptors_to_cache]),
-                                  total=len(descriptors_to_cache), smoothing=0.1):
-                        pass
-                    pool.close()
-                    pool.join()
-                else:
-                    for desc in tqdm(descriptors_to_cache):
-                        self._cache_sample((self.processors, desc, self.cache, self.data_key_prefix))
 
-                # save and move back to read mode
-                self.cache.save()
-                lgr.info('FuseDatasetDefault: caching done')
+            # change cache mode - to caching (writing)
+            self.cache.start_caching()
+
+            # each task caches a batch of samples, see FuseProcessorBase.process_batch()
+            descriptors_to_cache = list(descriptors_to_cache)
+            tasks = [descriptors_to_cache[start:start + self.processor_batch_size]
+                     for start in range(0, len(descriptors_to_cache), self.processor_batch_size)]
+
+            # staged pipeline - load, transform and write concurrently
+            if io_threads > 0 and (self.cache_by_processor or self.pool_type != 'process'):
+                lgr.warning('FuseDatasetDefault: caching pipeline (io_threads > 0) is not supported when caching by processor or with pool_type thread')
+            if io_threads > 0 and not self.cache_by_processor and self.pool_type == 'process':
+                pipeline = FuseCachePipeline(load_func=partial(self._load_samples, self.processors),
+                                             transform_func=self._transform_samples_in_worker,
+                                             write_func=self._write_samples,
+                                             io_threads=io_threads, cpu_workers=num_workers,
+                                             queue_size=queue_size or 2 * (num_workers + io_threads),
+                                             worker_init_func=self._cache_worker_init,
+                                             worker_init_args=(self.processors, None, self.data_key_prefix, worker_init_func, worker_init_args))
+                stats = pipeline.run(tasks)
+                lgr.info(f'FuseDatasetDefault: caching pipeline throughput (tasks of {self.processor_batch_size} samples):\n'
+                         f'{FuseCachePipeline.format_stats(stats)}')
+
+            # multi process cache
+            elif num_workers > 0:
+                # lock-free - worker processes either write directly to the cache or send the samples to be written by this process
+                write_in_workers = self.pool_type == 'thread' or self.cache.support_multiprocess_writing()
+                worker_cache = self.cache if write_in_workers else None
+                the_pool = ThreadPool if self.pool_type == 'thread' else Pool
+                pool = the_pool(processes=num_workers, initializer=self._cache_worker_init,
+                                initargs=(self.processors, worker_cache, self.data_key_prefix, worker_init_func, worker_init_args,
+                                          self.cache_by_processor))
+                for result in tqdm(pool.imap_unordered(func=self._cache_samples_in_worker, iterable=tasks),
+                                   total=len(tasks), smoothing=0.1):
+                    if result is not None:
+                        for key, value in result:
+                            self.cache[key] = value
+                pool.close()
+                pool.join()
+            else:
+                for task in tqdm(tasks):
+                    if self.cache_by_processor:
+                        self._cache_processors_outputs(self.processors, task, self.cache)
+                    else:
+                        self._cache_samples((self.processors, task, self.cache, self.data_key_prefix))
+
+            # save and move back to read mode
+            self.cache.save()
+            lgr.info('FuseDatasetDefault: caching done')
         else:
             lgr.info(f'FuseDatasetDefault: all {len(all_descriptors)} samples are already cached')
 
@@ -514,11 +936,11 @@ class FuseDatasetDefault(FuseDatasetBase):
 
         # create cache field object upon request
         if isinstance(self.cache_fields, FuseCacheNull):
-            # cache object
+            # cache object - columnar format
             if isinstance(cache_dest, str) and cache_dest == 'memory':
-                self.cache_fields: FuseCacheBase = FuseCacheMemory()
+                self.cache_fields: FuseCacheBase = FuseCacheColumns(None, reset_cache)
             elif isinstance(cache_dest, str):
-                self.cache_fields: FuseCacheBase = FuseCacheFiles(cache_dest, reset_cache, single_file=True)
+                self.cache_fields: FuseCacheBase = FuseCacheColumns(cache_dest, reset_cache)
 
         # get list of desc to cache
         desc_list = self.samples_description
@@ -527,68 +949,277 @@ class FuseDatasetDefault(FuseDatasetBase):
         desc_field_to_cache = desc_field_list - cached_desc_field
         desc_to_cache = set([desc_field[0] for desc_field in desc_field_to_cache])
 
-        # multi thread caching
+        # multi process caching - the workers extract the fields, written to the cache by this process
         if len(desc_to_cache) != 0:
             lgr.info(f'FuseDatasetDefault: samples fields - caching {len(desc_to_cache)} out of {len(desc_list)}')
+            indices_to_cache = sorted([self.get_sample_index(desc) for desc in desc_to_cache])
+            # each task extracts the fields of a batch of samples
+            tasks = [indices_to_cache[start:start + self.processor_batch_size]
+                     for start in range(0, len(indices_to_cache), self.processor_batch_size)]
+            self.cache_fields.start_caching()
             if num_workers > 0:
-                with Manager() as manager:
-                    self.cache_fields.start_caching(manager)
-                    pool = Pool(processes=num_workers)
-                    for _ in tqdm(pool.imap_unordered(func=self._cache_sample_fields,
-                                                      iterable=[(desc, fields) for desc in desc_to_cache]),
-                                  total=len(desc_to_cache), smoothing=0.1):
-                        pass
-                    pool.close()
-                    pool.join()
-                    self.cache_fields.save()
+                pool = Pool(processes=num_workers, initializer=self._cache_fields_worker_init, initargs=(self, fields))
+                for results in tqdm(pool.imap_unordered(func=self._cache_sample_fields_in_worker, iterable=tasks),
+                                    total=len(tasks), smoothing=0.1):
+                    for desc, values in results:
+                        self._set_sample_fields(desc, values)
+                pool.close()
+                pool.join()
             else:
-                self.cache_fields.start_caching(None)
-                for desc in tqdm(desc_to_cache):
-                    self._cache_sample_fields((desc, fields))
-                self.cache_fields.save()
+                for task in tqdm(tasks):
+                    for desc, values in self._cache_sample_fields((task, fields)):
+                        self._set_sample_fields(desc, values)
+            self.cache_fields.save()
         else:
             lgr.info('FuseDatasetDefault: all samples fields are already cached')
 
-    def _cache_sample_fields(self, args):
-        # decode args
-        desc, fields = args
-        index = self.samples_description.index(desc)
-        sample = self.getitem(index, apply_augmentation=False)
-        for field in fields:
+    def _cache_sample_fields(self, args: Tuple[List[int], List[str]]) -> List[Tuple[Hashable, Dict[str, Any]]]:
+        """
+        Extract the fields of a batch of samples
+        :param args: tuple of sample indices and fields
+        :return: list of tuples of sample descriptor and map field to value
+        """
+        indices, fields = args
+        # subclasses customizing a single sample - keep their behavior
+        if type(self).getitem is FuseDatasetDefault.getitem:
+            samples = self.getitems(indices, apply_augmentation=False)
+        else:
+            samples = [self.getitem(index, apply_augmentation=False) for index in indices]
+        return [(self.samples_description[index], {field: FuseUtilsHierarchicalDict.get(sample, field) for field in fields})
+                for index, sample in zip(indices, samples)]
+
+    def _set_sample_fields(self, desc: Hashable, values: Dict[str, Any]) -> None:
+        for field, value in values.items():
             # create field desc and save it in cache
             desc_field = (desc, field)
             if desc_field not in self.cache_fields:
-                value = FuseUtilsHierarchicalDict.get(sample, field)
                 self.cache_fields[desc_field] = value
 
     @staticmethod
-    def _cache_sample(args: Tuple) -> None:
+    def _cache_fields_worker_init(dataset: 'FuseDatasetDefault', fields: List[str]) -> None:
         """
-        Store in cache single sample
-        :param args: tuple of processors, sample descriptor and cache object
-        :return: None
+        Fields caching pool initializer - store the dataset once per worker instead of once per task
+        """
+        _cache_worker_state['dataset'] = dataset
+        _cache_worker_state['fields'] = fields
+
+    @staticmethod
+    def _cache_sample_fields_in_worker(indices: List[int]) -> List[Tuple[Hashable, Dict[str, Any]]]:
+        """
+        Extract the fields of a batch of samples, using the objects stored by _cache_fields_worker_init()
+        """
+        return _cache_worker_state['dataset']._cache_sample_fields((indices, _cache_worker_state['fields']))
+
+    @staticmethod
+    def _cache_samples(args: Tuple) -> Optional[List[Tuple[Hashable, Any]]]:
+        """
+        Store in cache a batch of samples
+        :param args: tuple of processors, list of sample descriptors, cache object and data key prefix.
+                     If the cache object is None, the samples will be returned instead of stored.
+        :return: None or list of (sample descriptor, sample) if cache object is None
         """
-        processors, desc, cache, data_key_prefix = args
-        sample = FuseDatasetDefault.getitem_without_augmentation_static(processors, desc, data_key_prefix=data_key_prefix)
-        cache[desc] = sample
+        processors, descs, cache, data_key_prefix = args
+        samples = FuseDatasetDefault.getitems_without_augmentation_static(processors, descs, data_key_prefix=data_key_prefix)
+        if cache is None:
+            return list(zip(descs, samples))
+        for desc, sample in zip(descs, samples):
+            cache[desc] = sample
+        return None
+
+    @staticmethod
+    def _load_samples(processors: Union[Dict[str, FuseProcessorBase], FuseProcessorBase],
+                      descs: List[Hashable]) -> Tuple[List[Hashable], Dict[Optional[str], List[Any]]]:
+        """
+        The 'load' stage of the caching pipeline - run the I/O bound part of the processors (FuseProcessorBase.load())
+        :param processors: the processors of the dataset
+        :param descs: list of sample descriptors
+        :return: tuple of the sample descriptors and map processor key (None for a single processor) to the loaded data per sample
+        """
+        if isinstance(processors, FuseProcessorBase):
+            return descs, {None: [processors.load(desc) for desc in descs]}
+        return descs, {key: [FuseUtilsHierarchicalDict.get(processors, key).load(desc) for desc in descs]
+                       for key in FuseUtilsHierarchicalDict.get_all_keys(processors)}
+
+    @staticmethod
+    def _transform_samples_in_worker(args: Tuple[List[Hashable], Dict[Optional[str], List[Any]]]) -> List[Tuple[Hashable, Any]]:
+        """
+        The 'transform' stage of the caching pipeline - run the CPU bound part of the processors (FuseProcessorBase.process_loaded()),
+        using the objects stored by _cache_worker_init()
+        :param args: the output of _load_samples()
+        :return: list of (sample descriptor, sample)
+        """
+        descs, loaded = args
+        samples = FuseDatasetDefault.getitems_without_augmentation_static(_cache_worker_state['processors'], descs,
+                                                                          data_key_prefix=_cache_worker_state['data_key_prefix'], loaded=loaded)
+        return list(zip(descs, samples))
+
+    def _write_samples(self, samples: List[Tuple[Hashable, Any]]) -> None:
+        """
+        The 'write' stage of the caching pipeline
+        """
+        for desc, sample in samples:
+            self.cache[desc] = sample
+
+    @staticmethod
+    def _cache_processors_outputs(processors: Union[Dict[str, FuseProcessorBase], FuseProcessorBase],
+                                  tasks: List[Tuple[Hashable, Dict[Optional[str], str]]],
+                                  cache: Optional[FuseCacheBase]) -> Optional[List[Tuple[Hashable, Any]]]:
+        """
+        Store in cache the outputs of the specified processors for a batch of samples.
+        Each output is stored with the key (sample descriptor, processor key, processor fingerprint).
+        Each processor processes all the samples it is required for at once (see FuseProcessorBase.process_batch()).
+        :param processors: the processors of the dataset
+        :param tasks: list of (sample descriptor, map processor key (None for a single processor) to fingerprint, processors to run)
+        :param cache: cache object. If None, the outputs will be returned instead of stored.
+        :return: None or list of (key, processor output) if cache object is None
+        """
+        lgr = logging.getLogger('Fuse')
+        # group by processor
+        processors_tasks: Dict[Optional[str], List[Tuple[Hashable, str]]] = {}
+        for desc, processors_fingerprints in tasks:
+            for processor_key, fingerprint in processors_fingerprints.items():
+                processors_tasks.setdefault(processor_key, []).append((desc, fingerprint))
+
+        results = []
+        for processor_key, processor_tasks in processors_tasks.items():
+            processor = processors if processor_key is None else FuseUtilsHierarchicalDict.get(processors, processor_key)
+            descs = [desc for desc, _ in processor_tasks]
+            try:
+                values = processor.process_batch(descs)
+            except:
+                lgr.error(f'processor {processor_key} failed to load data sample_desc={descs[0] if len(descs) == 1 else descs}')
+                raise
+
+            for (desc, fingerprint), value in zip(processor_tasks, values):
+                if value is None:
+                    lgr.error(f'processor {processor_key} failed to load data sample_desc={desc}, got None, skipping sample')
+                elif isinstance(value, dict):
+                    value = value.copy()
+                results.append(((desc, processor_key, fingerprint), value))
+
+        if cache is None:
+            return results
+        for key, value in results:
+            cache[key] = value
+        return None
+
+    @staticmethod
+    def _cache_worker_init(processors: Union[Dict[str, FuseProcessorBase], FuseProcessorBase], cache: Optional[FuseCacheBase],
+                           data_key_prefix: Optional[str], worker_init_func: Optional[Callable], worker_init_args: Any,
+                           cache_by_processor: bool = False) -> None:
+        """
+        Caching pool initializer - store the objects required by _cache_samples_in_worker() once per worker instead of once per task
+        """
+        _cache_worker_state['processors'] = processors
+        _cache_worker_state['cache'] = cache
+        _cache_worker_state['data_key_prefix'] = data_key_prefix
+        _cache_worker_state['cache_by_processor'] = cache_by_processor
+        if worker_init_func is not None:
+            worker_init_func(*(worker_init_args or ()))
+
+    @staticmethod
+    def _cache_samples_in_worker(task: List[Any]) -> Optional[List[Tuple[Hashable, Any]]]:
+        """
+        Store in cache a batch of samples, using the objects stored by _cache_worker_init()
+        :param task: list of sample descriptors, or of tuples of sample descriptor and processors fingerprints when caching by processor
+        :return: See _cache_samples() and _cache_processors_outputs()
+        """
+        if _cache_worker_state['cache_by_processor']:
+            return FuseDatasetDefault._cache_processors_outputs(_cache_worker_state['processors'], task, _cache_worker_state['cache'])
+        return FuseDatasetDefault._cache_samples((_cache_worker_state['processors'], task, _cache_worker_state['cache'], _cache_worker_state['data_key_prefix']))
+
+    def _get_processors_fingerprints(self) -> Dict[Optional[str], str]:
+        """
+        :return: map processor key to processor fingerprint. The key of a single processor is None.
+        """
+        if isinstance(self.processors, FuseProcessorBase):
+            return {None: self.processors.fingerprint()}
+        return {key: FuseUtilsHierarchicalDict.get(self.processors, key).fingerprint()
+                for key in FuseUtilsHierarchicalDict.get_all_keys(self.processors)}
+
+    def _get_processors_outputs_to_cache(self, descriptors: Set[Hashable]) -> List[Tuple[Hashable, Dict[Optional[str], str]]]:
+        """
+        Find the processors outputs missing in cache - processors that are new or changed since cached
+        :param descriptors: samples descriptors
+        :return: list of (sample descriptor, map processor key to fingerprint of the processors to run)
+        """
+        cached_keys = set(self.cache.get_all_keys(include_none=True))
+        failed_keys = cached_keys - set(self.cache.get_all_keys())
+        tasks = []
+        for desc in descriptors:
+            keys = {processor_key: (desc, processor_key, fingerprint) for processor_key, fingerprint in self._processors_fingerprints.items()}
+            # skip samples that already failed to load
+            if any(key in failed_keys for key in keys.values()):
+                continue
+            missing = {processor_key: key[2] for processor_key, key in keys.items() if key not in cached_keys}
+            if len(missing) != 0:
+                tasks.append((desc, missing))
+        return tasks
+
+    def _get_sample_from_processors_cache(self, desc: Hashable) -> Any:
+        """
+        Assemble a sample from the cached outputs of the processors
+        :param desc: sample descriptor
+        :return: the sample (same format as getitem_without_augmentation_static()) or None if any of the outputs is not cached
+        """
+        if isinstance(self.cache, FuseCacheNull):
+            return None
+
+        outputs = {}
+        for processor_key, fingerprint in self._processors_fingerprints.items():
+            key = (desc, processor_key, fingerprint)
+            if key not in self.cache:
+                return None
+            outputs[processor_key] = self.cache[key]
+            if outputs[processor_key] is None:
+                return None
+
+        sample_data = {}
+        if self.data_key_prefix is not None:
+            sample = {self.data_key_prefix: sample_data}
+        else:
+            sample = sample_data
+        sample_data['descriptor'] = desc
+        if isinstance(self.processors, FuseProcessorBase):
+            sample_data.update(outputs[None])
+        else:
+            sample_data['input'] = {}
+            for processor_key, value in outputs.items():
+                if isinstance(value, dict):
+                    value = value.copy()
+                FuseUtilsHierarchicalDict.set(sample_data, processor_key, value)
+        return sample
 
     #### Filtering
-    def filter(self, key: str, values: List[Any]) -> None:
+    def filter(self, key: Union[str, FuseFilterBase], values: Optional[List[Any]] = None) -> Optional[FuseDatasetView]:
         """
-        Filter sample if batch_dict[key] in values
-        :param key: key in batch_dict
-        :param values: list of values to filter
-        :return: None
+        Filter samples.
+        Given a filter (see fuse.data.dataset.dataset_filter) - return a view of the samples selected by the filter, e.g.
+        dataset.filter(FuseFilterIsIn('data.gt.label', [1, 2]) & ~FuseFilterRange('data.age', max_value=18))
+        Given key and values - filter sample if batch_dict[key] in values, in place.
+        The filter is evaluated over a column of values per field, see get_column().
+        Cache the fields first (see cache_sample_fields()) to read each column at once.
+        :param key: either a filter or key in batch_dict
+        :param values: list of values to filter, used with key
+        :return: a view of the selected samples given a filter, otherwise None
         """
+        if isinstance(key, FuseFilterBase):
+            return FuseDatasetView(self, np.flatnonzero(self._evaluate_filter(key)))
+
         lgr = logging.getLogger('Fuse')
         lgr.info(f'DatasetDefault: filtering key {key}, values {values}')
-        new_samples_desc = []
-        for index, desc in tqdm(enumerate(self.samples_description), total=len(self.samples_description)):
-            value = self.get(index, key, use_cache=True)
-            if value not in values:
-                new_samples_desc.append(desc)
+        mask = self._evaluate_filter(~FuseFilterIsIn(key, values))
+        if isinstance(self.samples_description, FuseDescriptorStore):
+            self.samples_description = self.samples_description[np.flatnonzero(mask)]
+        else:
+            self.samples_description = [self.samples_description[index] for index in np.flatnonzero(mask)]
 
-        self.samples_description = new_samples_desc
+    def _evaluate_filter(self, sample_filter: FuseFilterBase) -> np.ndarray:
+        """
+        :return: boolean mask, True for the samples selected by the filter
+        """
+        columns = {key: self.get_column(key) for key in set(sample_filter.get_keys())}
+        return sample_filter(columns)
 
     #### VISUALIZE
     def visualize(self, index: Optional[int] = None, descriptor: Optional[Hashable] = None, block: bool = True, **kwargs):
@@ -602,7 +1233,7 @@ class FuseDatasetDefault(FuseDatasetBase):
         assert (index is not None) ^ (descriptor is not None), "visualize method must get one and one only of an index or a descriptor"
         lgr = logging.getLogger('Fuse')
         if descriptor is not None:
-            index = self.sample_descriptor_to_index[descriptor]
+            index = self.get_sample_index(descriptor)
 
         if self.visualizer is None:
             lgr.warning('Cannot visualize - visualizer was not provided')
@@ -625,7 +1256,7 @@ class FuseDatasetDefault(FuseDatasetBase):
 
         lgr = logging.getLogger('Fuse')
         if descriptor is not None:
-            index = self.sample_descriptor_to_index[descriptor]
+            index = self.get_sample_index(descriptor)
         if self.visualizer is None:
             lgr.warning('Cannot visualize - visualizer was not provided')
             return
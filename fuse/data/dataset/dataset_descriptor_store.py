@@ -0,0 +1,225 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Compact storage of sample descriptors
+"""
+from collections.abc import Sequence
+from typing import Any, Hashable, Iterator, List, Optional, Tuple, Union
+
+import numpy as np
+
+
+class FuseDescriptorStore(Sequence):
+    """
+    Compact, read only sequence of sample descriptors - an alternative to a list of descriptors for datasets of millions of samples.
+    Supports descriptors that are all strings, all integers or all tuples of the same length of strings and integers.
+    Each descriptor element (column) is stored in numpy arrays:
+    integers as is, strings interned - the unique strings utf-8 encoded into a single buffer and a code per descriptor.
+    So the descriptors take a few bytes per sample, and pickling the store (e.g. to each DataLoader worker) copies a few arrays.
+    The descriptors are decoded on access, equal (and hash equal) to the original descriptors.
+    index() finds a descriptor by binary search over sorted columns, built on first use, instead of a dictionary of all the descriptors.
+    """
+    _INT64_MIN, _INT64_MAX = int(np.iinfo(np.int64).min), int(np.iinfo(np.int64).max)
+
+    def __init__(self, descriptors: Sequence):
+        """
+        :param descriptors: the sample descriptors, raise ValueError if not supported (see is_supported())
+        """
+        self._is_tuple = len(descriptors) > 0 and isinstance(descriptors[0], tuple)
+        if self._is_tuple:
+            width = len(descriptors[0])
+            if any(not isinstance(desc, tuple) or len(desc) != width for desc in descriptors):
+                raise ValueError('FuseDescriptorStore: expecting tuples of the same length')
+            columns = list(zip(*descriptors)) if width > 0 else []
+        else:
+            columns = [descriptors]
+        # each column: tuple of codes (or integers), and the interned strings buffer and offsets - None for integer columns
+        self._columns = [self._encode_column(column) for column in columns]
+        self._length = len(descriptors)
+        self._lookup = None
+
+    @staticmethod
+    def is_supported(descriptors: Sequence) -> bool:
+        """
+        :return: True if the descriptors can be stored in FuseDescriptorStore
+        """
+        try:
+            FuseDescriptorStore._check_types(descriptors[:1000])
+            return True
+        except ValueError:
+            return False
+
+    def __getstate__(self) -> dict:
+        # the lookup is rebuilt on demand
+        state = self.__dict__.copy()
+        state['_lookup'] = None
+        return state
+
+    def __len__(self) -> int:
+        return self._length
+
+    def __getitem__(self, index: Union[int, slice, Sequence[int], np.ndarray]) -> Any:
+        """
+        :param index: index of a descriptor, or a slice / array of indices - returns a store of the selected descriptors
+        """
+        if isinstance(index, (int, np.integer)):
+            if index < 0:
+                index += self._length
+            if index < 0 or index >= self._length:
+                raise IndexError('FuseDescriptorStore: index out of range')
+            values = tuple(self._decode(column, index) for column in self._columns)
+            return values if self._is_tuple else values[0]
+
+        # subset - select the rows of each column
+        rows = np.arange(self._length)[index] if isinstance(index, slice) else np.asarray(index, dtype=np.int64)
+        subset = FuseDescriptorStore.__new__(FuseDescriptorStore)
+        subset._is_tuple = self._is_tuple
+        subset._columns = [(codes[rows], strings) for codes, strings in self._columns]
+        subset._length = len(rows)
+        subset._lookup = None
+        return subset
+
+    def __iter__(self) -> Iterator[Hashable]:
+        for index in range(self._length):
+            yield self[index]
+
+    def __contains__(self, descriptor: Any) -> bool:
+        try:
+            self.index(descriptor)
+            return True
+        except ValueError:
+            return False
+
+    def __eq__(self, other: Any) -> bool:
+        if not isinstance(other, (FuseDescriptorStore, list, tuple)):
+            return NotImplemented
+        return len(self) == len(other) and all(desc == other_desc for desc, other_desc in zip(self, other))
+
+    def index(self, descriptor: Any, start: int = 0, stop: Optional[int] = None) -> int:
+        """
+        Find the first occurrence of a descriptor, O(log n)
+        :param descriptor: sample descriptor
+        :return: the index of the descriptor, raise ValueError if not found
+        """
+        if start != 0 or stop is not None:
+            return super().index(descriptor, start, stop)
+        values = descriptor if self._is_tuple else (descriptor,)
+        if not isinstance(values, tuple) or len(values) != len(self._columns):
+            raise ValueError(f'{descriptor} is not in FuseDescriptorStore')
+
+        keys = [self._encode_value(column, value) for column, value in zip(self._columns, values)]
+        if any(key is None for key in keys):
+            raise ValueError(f'{descriptor} is not in FuseDescriptorStore')
+
+        order, sorted_columns = self._get_lookup()
+        # narrow the range column by column - the rows are sorted by the first column, then by the second, ...
+        low, high = 0, self._length
+        for sorted_column, key in zip(sorted_columns, keys):
+            low, high = low + np.searchsorted(sorted_column[low:high], key, side='left'), \
+                        low + np.searchsorted(sorted_column[low:high], key, side='right')
+            if low == high:
+                raise ValueError(f'{descriptor} is not in FuseDescriptorStore')
+        # stable sort - the first occurrence
+        return int(order[low])
+
+    def nbytes(self) -> int:
+        """
+        :return: the memory used by the descriptors, in bytes (excluding the lookup built by index())
+        """
+        return sum(codes.nbytes + (strings[0].nbytes + strings[1].nbytes if strings is not None else 0) for codes, strings in self._columns)
+
+    @staticmethod
+    def _check_types(descriptors: Sequence) -> None:
+        """
+        Raise ValueError if the descriptors are not supported
+        """
+        for desc in descriptors:
+            for value in (desc if isinstance(desc, tuple) else (desc,)):
+                if isinstance(value, bool) or not isinstance(value, (str, int, np.integer)):
+                    raise ValueError(f'FuseDescriptorStore: unsupported descriptor {desc}, expecting strings, integers or tuples of them')
+                if not isinstance(value, str) and not FuseDescriptorStore._INT64_MIN <= int(value) <= FuseDescriptorStore._INT64_MAX:
+                    raise ValueError(f'FuseDescriptorStore: unsupported descriptor {desc}, integers are stored as int64')
+
+    @staticmethod
+    def _encode_column(values: Sequence) -> Tuple[np.ndarray, Optional[Tuple[np.ndarray, np.ndarray]]]:
+        """
+        :return: tuple of integers or codes per row, and the interned strings (buffer, offsets) - None for integers
+        """
+        FuseDescriptorStore._check_types(values)
+        if len(values) == 0 or not isinstance(values[0], str):
+            if any(isinstance(value, str) for value in values):
+                raise ValueError('FuseDescriptorStore: mixed strings and integers in the same descriptor element')
+            return np.asarray(values, dtype=np.int64), None
+
+        if any(not isinstance(value, str) for value in values):
+            raise ValueError('FuseDescriptorStore: mixed strings and integers in the same descriptor element')
+        # sorted unique strings, so a string is found by binary search
+        unique_values, codes = np.unique(np.asarray(values, dtype=object), return_inverse=True)
+        encoded = [value.encode('utf-8') for value in unique_values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        buffer = np.frombuffer(b''.join(encoded), dtype=np.uint8).copy()
+        codes = codes.astype(np.int32 if len(unique_values) < 2 ** 31 else np.int64)
+        return codes, (buffer, offsets)
+
+    @staticmethod
+    def _decode(column: Tuple[np.ndarray, Optional[Tuple[np.ndarray, np.ndarray]]], row: int) -> Union[str, int]:
+        codes, strings = column
+        if strings is None:
+            return int(codes[row])
+        return FuseDescriptorStore._get_string(strings, int(codes[row]))
+
+    @staticmethod
+    def _get_string(strings: Tuple[np.ndarray, np.ndarray], code: int) -> str:
+        buffer, offsets = strings
+        return buffer[offsets[code]:offsets[code + 1]].tobytes().decode('utf-8')
+
+    @staticmethod
+    def _encode_value(column: Tuple[np.ndarray, Optional[Tuple[np.ndarray, np.ndarray]]], value: Any) -> Optional[int]:
+        """
+        :return: the integer or string code of a descriptor element, None if not found
+        """
+        _, strings = column
+        if strings is None:
+            return int(value) if isinstance(value, (int, np.integer)) and not isinstance(value, bool) else None
+        if not isinstance(value, str):
+            return None
+        # binary search over the sorted unique strings
+        low, high = 0, len(strings[1]) - 1
+        while low < high:
+            middle = (low + high) // 2
+            if FuseDescriptorStore._get_string(strings, middle) < value:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(strings[1]) - 1 and FuseDescriptorStore._get_string(strings, low) == value:
+            return low
+        return None
+
+    def _get_lookup(self) -> Tuple[np.ndarray, List[np.ndarray]]:
+        """
+        :return: the rows sorted by the columns (first column first) and the sorted columns
+        """
+        if self._lookup is None:
+            codes = [codes for codes, _ in self._columns]
+            # lexsort - the last key is the primary key
+            order = np.lexsort(codes[::-1]) if len(codes) > 0 else np.arange(self._length)
+            self._lookup = (order, [column[order] for column in codes])
+        return self._lookup
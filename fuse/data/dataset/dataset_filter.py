@@ -0,0 +1,248 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Composable sample filters, evaluated over a column of values per field - see FuseDatasetDefault.filter()
+"""
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+import torch
+
+
+def to_column(values: Any) -> np.ndarray:
+    """
+    Convert the values of a field, one per sample, to a column: a numeric numpy array if possible, otherwise a 1D object array
+    :param values: numpy array, tensor or list of values
+    :return: numpy array
+    """
+    if isinstance(values, torch.Tensor):
+        return values.detach().cpu().numpy()
+    if isinstance(values, np.ndarray) and not values.dtype.hasobject:
+        return values
+    try:
+        column = np.asarray([value.item() if isinstance(value, (torch.Tensor, np.ndarray)) and value.ndim == 0 else value
+                             for value in values])
+        if column.ndim == 1 and column.dtype.kind in 'biufcUS':
+            return column
+    except:
+        # different shapes
+        pass
+    column = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        column[i] = value
+    return column
+
+
+class FuseFilterBase(ABC):
+    """
+    Base class of a sample filter: a predicate evaluated over the columns of the fields it depends on, one operation per column.
+    Filters are composed using the operators & (and), | (or) and ~ (not).
+    """
+
+    def __and__(self, other: 'FuseFilterBase') -> 'FuseFilterBase':
+        return FuseFilterAnd([self, other])
+
+    def __or__(self, other: 'FuseFilterBase') -> 'FuseFilterBase':
+        return FuseFilterOr([self, other])
+
+    def __invert__(self) -> 'FuseFilterBase':
+        return FuseFilterNot(self)
+
+    @abstractmethod
+    def get_keys(self) -> List[str]:
+        """
+        :return: the fields (keys in sample_dict) the filter depends on
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def __call__(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        Evaluate the filter
+        :param columns: map each key returned by get_keys() to the column of values, one per sample (see to_column())
+        :return: boolean mask, True for the samples to keep
+        """
+        raise NotImplementedError
+
+
+class FuseFilterField(FuseFilterBase):
+    """
+    Base class of a filter of a single field
+    """
+
+    def __init__(self, key: str):
+        """
+        :param key: the field (key in sample_dict)
+        """
+        self.key = key
+
+    def get_keys(self) -> List[str]:
+        """
+        See base class
+        """
+        return [self.key]
+
+    def __call__(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        See base class
+        """
+        return np.asarray(self.evaluate(columns[self.key]), dtype=bool)
+
+    @abstractmethod
+    def evaluate(self, column: np.ndarray) -> np.ndarray:
+        """
+        :param column: the values of the field, one per sample
+        :return: boolean mask, True for the samples to keep
+        """
+        raise NotImplementedError
+
+
+class FuseFilterIsIn(FuseFilterField):
+    """
+    Keep the samples with sample_dict[key] in values
+    """
+
+    def __init__(self, key: str, values: Sequence[Any]):
+        """
+        :param key: the field (key in sample_dict)
+        :param values: the values to keep
+        """
+        super().__init__(key)
+        self.values = list(values)
+
+    def evaluate(self, column: np.ndarray) -> np.ndarray:
+        """
+        See base class
+        """
+        if not column.dtype.hasobject:
+            values = np.asarray(self.values)
+            if not values.dtype.hasobject:
+                return np.isin(column, values)
+        return np.fromiter((value in self.values for value in column), dtype=bool, count=len(column))
+
+
+class FuseFilterRange(FuseFilterField):
+    """
+    Keep the samples with min_value <= sample_dict[key] < max_value
+    """
+
+    def __init__(self, key: str, min_value: Optional[Any] = None, max_value: Optional[Any] = None, include_max: bool = False):
+        """
+        :param key: the field (key in sample_dict)
+        :param min_value: inclusive lower bound, None for no lower bound
+        :param max_value: upper bound, None for no upper bound
+        :param include_max: if True, the upper bound is inclusive
+        """
+        super().__init__(key)
+        self.min_value = min_value
+        self.max_value = max_value
+        self.include_max = include_max
+
+    def evaluate(self, column: np.ndarray) -> np.ndarray:
+        """
+        See base class
+        """
+        mask = np.ones(len(column), dtype=bool)
+        if self.min_value is not None:
+            mask &= column >= self.min_value
+        if self.max_value is not None:
+            mask &= (column <= self.max_value) if self.include_max else (column < self.max_value)
+        return mask
+
+
+class FuseFilterFunc(FuseFilterField):
+    """
+    Keep the samples selected by a vectorized function of the field, e.g. FuseFilterFunc('data.age', lambda age: age % 2 == 0)
+    """
+
+    def __init__(self, key: str, func: Callable[[np.ndarray], np.ndarray]):
+        """
+        :param key: the field (key in sample_dict)
+        :param func: get the column of values, return a boolean mask, True for the samples to keep
+        """
+        super().__init__(key)
+        self.func = func
+
+    def evaluate(self, column: np.ndarray) -> np.ndarray:
+        """
+        See base class
+        """
+        return self.func(column)
+
+
+class FuseFilterAnd(FuseFilterBase):
+    """
+    Keep the samples selected by all the filters
+    """
+
+    def __init__(self, filters: Sequence[FuseFilterBase]):
+        """
+        :param filters: the filters to compose
+        """
+        self.filters = list(filters)
+
+    def get_keys(self) -> List[str]:
+        """
+        See base class
+        """
+        return [key for sample_filter in self.filters for key in sample_filter.get_keys()]
+
+    def __call__(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        See base class
+        """
+        return np.logical_and.reduce([sample_filter(columns) for sample_filter in self.filters])
+
+
+class FuseFilterOr(FuseFilterAnd):
+    """
+    Keep the samples selected by any of the filters
+    """
+
+    def __call__(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        See base class
+        """
+        return np.logical_or.reduce([sample_filter(columns) for sample_filter in self.filters])
+
+
+class FuseFilterNot(FuseFilterBase):
+    """
+    Keep the samples not selected by a filter
+    """
+
+    def __init__(self, sample_filter: FuseFilterBase):
+        """
+        :param sample_filter: the filter to negate
+        """
+        self.sample_filter = sample_filter
+
+    def get_keys(self) -> List[str]:
+        """
+        See base class
+        """
+        return self.sample_filter.get_keys()
+
+    def __call__(self, columns: Dict[str, np.ndarray]) -> np.ndarray:
+        """
+        See base class
+        """
+        return ~self.sample_filter(columns)
@@ -19,35 +19,39 @@ Created on June 30, 2021
 
 import logging
 import os
-from multiprocessing import Manager
 from multiprocessing.pool import Pool, ThreadPool
 from typing import Any, Dict, Optional, Hashable, List, Union, Tuple, Callable
 
 import numpy as np
 import torch
 from pandas import DataFrame
-from torch import Tensor
 from tqdm import tqdm, trange
 
 from fuse.data.augmentor.augmentor_base import FuseAugmentorBase
 from fuse.data.cache.cache_base import FuseCacheBase
-from fuse.data.cache.cache_files import FuseCacheFiles
+from fuse.data.cache.cache_columns import FuseCacheColumns
+from fuse.data.cache.cache_factory import create_cache
 from fuse.data.cache.cache_memory import FuseCacheMemory
 from fuse.data.cache.cache_null import FuseCacheNull
 from fuse.data.data_source.data_source_base import FuseDataSourceBase
 from fuse.data.dataset.dataset_base import FuseDatasetBase
 from fuse.data.processor.processor_base import FuseProcessorBase
 from fuse.data.visualizer.visualizer_base import FuseVisualizerBase
+from fuse.utils.data.collate import CollateCompiled
 from fuse.utils.utils_debug import FuseUtilsDebug
 from fuse.utils.utils_hierarchical_dict import FuseUtilsHierarchicalDict
 from fuse.utils.utils_logger import log_object_input_state
 from fuse.utils.misc.misc import get_pretty_dataframe, Misc
 
+# objects used by the caching workers - set once per worker, see FuseDatasetGenerator._cache_worker_init()
+_cache_worker_state = {}
 
 class FuseDatasetGenerator(FuseDatasetBase):
     """
     Fuse Dataset Generator
     Used when it's more convient to generate sevral samples at once
+    The processor returns a list of samples per subset descriptor, or yields them (generator).
+    Samples yielded are written to the cache one by one, so with a disk cache the memory used does not depend on the number of samples per subset.
     """
 
     #### CONSTRUCTOR
@@ -55,17 +59,22 @@ class FuseDatasetGenerator(FuseDatasetBase):
                  cache_dest: Optional[Union[str, int]] = None, augmentor: Optional[FuseAugmentorBase] = None,
                  visualizer: Optional[FuseVisualizerBase] = None, post_processing_func=None,
                  statistic_keys: Optional[List[str]] = None,
-                 filter_keys: Optional[List[str]] = None):
+                 filter_keys: Optional[List[str]] = None,
+                 cache_type: str = 'files',
+                 cache_kwargs: Optional[Dict[str, Any]] = None):
         """
         :param data_source: objects provides the list of object description
-        :param processor: data generator
-        :param cache_dest: Optional, path to save caching
+        :param processor: data generator - returns a list of samples (dictionaries) or yields them
+        :param cache_dest: Optional, path to save caching, 'memory' or None to cache in memory
         :param augmentor: Optional, object that perform the augmentation
         :param visualizer: Optional, object that visualize the data
         :param post_processing_func: callback that allows to dynamically modify the data.
                Called as last step (after augmentation)
         :param statistic_keys: Optional. list of statistic keys to output in default self.summary() implementation
         :param filter_keys: Optional. list of keys to remove from the sample dictionary when getting an item
+        :param cache_type: the type of disk cache used when cache_dest is a dir: 'files', 'shards', 'mmap' or 'shared_memory'.
+                           See fuse.data.cache.cache_factory.create_cache()
+        :param cache_kwargs: Optional. additional arguments for the cache object constructor, See FuseDatasetDefault
         """
         # log object input state
         log_object_input_state(self, locals())
@@ -81,6 +90,8 @@ class FuseDatasetGenerator(FuseDatasetBase):
         self.post_processing_func = post_processing_func
         self.statistic_keys = statistic_keys or []
         self.filter_keys = filter_keys or []
+        self.cache_type = cache_type
+        self.cache_kwargs = cache_kwargs or {}
         # initial values
         # map sample running index to sample description (mush be hashable)
         self.subsets_description = []
@@ -137,21 +148,19 @@ class FuseDatasetGenerator(FuseDatasetBase):
             logging.getLogger('Fuse').info(f'Dataset - debug mode - override num samples to {dataset_override_num_samples}', {'color': 'red'})
 
         # cache object
-        if isinstance(self.cache_dest, str) and self.cache_dest == 'memory':
-            self.cache: FuseCacheBase = FuseCacheMemory()
-        elif isinstance(self.cache_dest, str):
-            self.cache: FuseCacheBase = FuseCacheFiles(self.cache_dest, reset_cache)
+        if isinstance(self.cache_dest, str):
+            self.cache: FuseCacheBase = create_cache(self.cache_dest, reset_cache, self.cache_type, **self.cache_kwargs)
 
         # cache samples if required
         if not isinstance(self.cache, FuseCacheNull):
             self.cache_all_samples(num_workers=num_workers, worker_init_func=worker_init_func, worker_init_args=worker_init_args)
 
-            # update descriptors
-            all_descriptors = self.subsets_description
+            # update descriptors - only the samples of completely cached subsets, marked by their first sample (see _cache_subset())
+            all_descriptors = set(self.subsets_description)
+            cached_subsets = set([desc[0] for desc in self.cache.get_all_keys(include_none=True) if desc[1] == 0])
             cached_descriptors = self.cache.get_all_keys()
-            self.samples_description = sorted([desc for desc in cached_descriptors if desc[0] in all_descriptors])
+            self.samples_description = sorted([desc for desc in cached_descriptors if desc[0] in all_descriptors and desc[0] in cached_subsets])
 
-        self.sample_descriptor_to_index = {v: k for k, v in enumerate(self.samples_description)}
     #### ITERATE AND GET DATA
     def __len__(self):
         return len(self.samples_description)
@@ -164,12 +173,13 @@ class FuseDatasetGenerator(FuseDatasetBase):
                       If not an int or None, will assume that imdex is sample descriptor
         :param key: string representing the exact information required. If None, will return all sample
         :param use_cache: if true, will try to reload the sample from caching mechanism
-        :return: the required info
+        :return: the required info. If index is None: a numpy array (or a tensor if the values are tensors) when the field is cached
+                 by cache_sample_fields() and numeric, a list otherwise
         """
         if index is not None and not isinstance(index, int):
             # get sample giving sample descriptor
             # assume index is sample description
-            index = self.samples_description.index(index)
+            index = self.get_sample_index(index)
 
         # if key not specified return the all sample
         if key is None:
@@ -179,7 +189,11 @@ class FuseDatasetGenerator(FuseDatasetBase):
         assert use_cache == True, f'{type(self)} support only use_cache=True'
 
         if index is None:
-            # return all samples
+            # return all samples - single vectorized read if the field is cached as a column
+            if isinstance(self.cache_fields, FuseCacheColumns):
+                values = self.cache_fields.get_column(key, self.samples_description)
+                if values is not None:
+                    return values
             values = []
             for index in trange(len(self)):
                 # first look for the specific file inside the cache
@@ -267,29 +281,17 @@ class FuseDatasetGenerator(FuseDatasetBase):
     #### BATCHING
     def collate_fn(self, samples: List[Dict], avoid_stack_keys: Tuple = tuple()) -> Dict:
         """
-        collate list of samples into batch_dict
+        collate list of samples into batch_dict, see fuse.utils.data.collate.CollateCompiled
         :param samples: list of samples
         :param avoid_stack_keys: list of keys to just collect to a list and avoid stack operation
         :return: batch_dict
         """
-        batch_dict = {}
-        keys = FuseUtilsHierarchicalDict.get_all_keys(samples[0])
-        for key in keys:
-            try:
-                collected_value = [FuseUtilsHierarchicalDict.get(sample, key) for sample in samples if sample is not None]
-                if key in avoid_stack_keys:
-                    FuseUtilsHierarchicalDict.set(batch_dict, key, collected_value)
-                elif isinstance(collected_value[0], Tensor):
-                    FuseUtilsHierarchicalDict.set(batch_dict, key, torch.stack(collected_value))
-                elif isinstance(collected_value[0], np.ndarray):
-                    FuseUtilsHierarchicalDict.set(batch_dict, key, np.stack(collected_value))
-                else:
-                    FuseUtilsHierarchicalDict.set(batch_dict, key, collected_value)
-            except:
-                logging.getLogger('Fuse').error(f'Failed to collect key {key}')
-                raise
-
-        return batch_dict
+        # the gather plan is compiled once per avoid_stack_keys
+        collate_fns = self.__dict__.setdefault('_collate_fns', {})
+        collate = collate_fns.get(tuple(avoid_stack_keys), None)
+        if collate is None:
+            collate = collate_fns[tuple(avoid_stack_keys)] = CollateCompiled(avoid_stack_keys)
+        return collate(samples)
 
     #### CACHING
     def cache_all_samples(self, num_workers: int = 16, worker_init_func: Callable = None, worker_init_args: Any = None) -> None:
@@ -302,61 +304,115 @@ class FuseDatasetGenerator(FuseDatasetBase):
         """
         lgr = logging.getLogger('Fuse')
 
-        # check if cache is required
-        all_descriptors = set([(subset_desc, 0) for subset_desc in self.subsets_description])
-        cached_descriptors = set(self.cache.get_all_keys(include_none=True))
-        descriptors_to_cache = all_descriptors - cached_descriptors
+        # check if cache is required - a subset is cached once its first sample is cached (see _cache_subset())
+        all_keys = self.cache.get_all_keys(include_none=True)
+        cached_subsets = set([desc[0] for desc in all_keys if desc[1] == 0])
+        subsets_to_cache = [subset_desc for subset_desc in self.subsets_description if subset_desc not in cached_subsets]
 
-        if len(descriptors_to_cache) != 0:
+        if len(subsets_to_cache) != 0:
             # multi process cache
-            lgr.info(f'FuseDatasetGenerator: caching {len(descriptors_to_cache)} out of {len(all_descriptors)}')
-            with  Manager() as manager:
-                # change cache mode - to caching (writing)
-                self.cache.start_caching(manager)
-
-                # multi process cache
-                if num_workers > 0:
-                    the_pool = ThreadPool if self.pool_type == 'thread' else Pool
-                    pool = the_pool(processes=num_workers, initializer=worker_init_func, initargs=worker_init_args)
-                    for _ in tqdm(pool.imap_unordered(func=self._cache_subset,
-                                                      iterable=[(self.processor, subset_desc[0], self.cache) for subset_desc in descriptors_to_cache]),
-                                  total=len(descriptors_to_cache), smoothing=0.1):
-                        pass
-                    pool.close()
-                    pool.join()
-                else:
-                    for subset_desc in tqdm(descriptors_to_cache):
-                        self._cache_subset((self.processor, subset_desc[0], self.cache))
-
-                # save and move back to read mode
+            lgr.info(f'FuseDatasetGenerator: caching {len(subsets_to_cache)} out of {len(self.subsets_description)}')
+
+            # change cache mode - to caching (writing)
+            self.cache.start_caching()
+
+            # drop the samples of partially cached subsets (e.g. crash while streaming) - might not be generated again
+            subsets_to_cache_set = set(subsets_to_cache)
+            partial_keys = [desc for desc in all_keys if desc[0] in subsets_to_cache_set]
+            if len(partial_keys) > 0:
+                lgr.info(f'FuseDatasetGenerator: removing {len(partial_keys)} samples of partially cached subsets')
+                for key in partial_keys:
+                    try:
+                        del self.cache[key]
+                    except NotImplementedError:
+                        # deletion not supported by the cache - mark as invalid
+                        self.cache[key] = None
+                # persist before the subsets are cached again, so the removal is never applied over the new samples
                 self.cache.save()
-                lgr.info('FuseDatasetGenerator: caching done')
+                self.cache.start_caching()
+
+            # multi process cache
+            if num_workers > 0:
+                # lock-free - worker processes either stream the samples directly to the cache
+                # or send them to be written by this process (caches that don't support multiprocess writing, e.g. memory)
+                write_in_workers = self.pool_type == 'thread' or self.cache.support_multiprocess_writing()
+                worker_cache = self.cache if write_in_workers else None
+                the_pool = ThreadPool if self.pool_type == 'thread' else Pool
+                pool = the_pool(processes=num_workers, initializer=self._cache_worker_init,
+                                initargs=(self.processor, worker_cache, worker_init_func, worker_init_args))
+                for result in tqdm(pool.imap_unordered(func=self._cache_subset_in_worker, iterable=subsets_to_cache),
+                                   total=len(subsets_to_cache), smoothing=0.1):
+                    if result is not None:
+                        for key, value in result:
+                            self.cache[key] = value
+                pool.close()
+                pool.join()
+            else:
+                for subset_desc in tqdm(subsets_to_cache):
+                    self._cache_subset((self.processor, subset_desc, self.cache))
+
+            # save and move back to read mode
+            self.cache.save()
+            lgr.info('FuseDatasetGenerator: caching done')
         else:
             lgr.info('FuseDatasetGenerator: all samples are already cached')
 
     @staticmethod
-    def _cache_subset(args: Tuple) -> None:
+    def _cache_subset(args: Tuple) -> Optional[List[Tuple[Hashable, Any]]]:
         """
-        Store in cache single sample
-        :param args: tuple of processor and subset descriptor
-        :return: None
+        Store in cache the samples of a single subset, one by one, as generated by the processor.
+        The first sample is written last: it marks the subset as cached, so a subset partially cached (e.g. crash) will be generated again.
+        :param args: tuple of processor, subset descriptor and cache object.
+                     If the cache object is None, the samples are returned instead - to be written by the main process.
+        :return: list of (key, value) to store in cache if the cache object is None, otherwise None
         """
         processor, subset_desc, cache = args
+        results = [] if cache is None else None
+
         samples = processor(subset_desc)
-        if not isinstance(samples, List):
+        if samples is None:
+            samples = []
+        elif isinstance(samples, dict):
             samples = [samples]
-        if samples:
-            for sample_index, sample_data in enumerate(samples):
 
-                assert isinstance(sample_data, dict), f'expecting sample_data to be dictionary, got {type(sample_data)}'
-                sample_data = sample_data.copy()
+        first_sample = None
+        for sample_index, sample_data in enumerate(samples):
+            assert isinstance(sample_data, dict), f'expecting sample_data to be dictionary, got {type(sample_data)}'
+            sample_data = sample_data.copy()
 
-                sample = {'data': sample_data}
-                sample_data['descriptor'] = (subset_desc, sample_index)
+            sample = {'data': sample_data}
+            sample_data['descriptor'] = (subset_desc, sample_index)
+            if sample_index == 0:
+                first_sample = sample
+            elif cache is not None:
                 cache[sample_data['descriptor']] = sample
+            else:
+                results.append((sample_data['descriptor'], sample))
+
+        # first sample - None if no samples extracted, marks an invalid descriptor
+        if cache is not None:
+            cache[(subset_desc, 0)] = first_sample
         else:
-            # no samples extracted mark it as an invalid descriptor
-            cache[(subset_desc, 0)] = None
+            results.append(((subset_desc, 0), first_sample))
+        return results
+
+    @staticmethod
+    def _cache_worker_init(processor: FuseProcessorBase, cache: Optional[FuseCacheBase],
+                           worker_init_func: Optional[Callable], worker_init_args: Any) -> None:
+        """
+        Caching pool initializer - store the objects required by _cache_subset_in_worker() once per worker instead of once per task
+        """
+        _cache_worker_state['processor'] = processor
+        _cache_worker_state['cache'] = cache
+        if worker_init_func is not None:
+            worker_init_func(*(worker_init_args or ()))
+
+    @staticmethod
+    def _cache_subset_in_worker(subset_desc: Hashable) -> Optional[List[Tuple[Hashable, Any]]]:
+        """
+        Store in cache the samples of a single subset, using the objects stored by _cache_worker_init()
+        """
+        return FuseDatasetGenerator._cache_subset((_cache_worker_state['processor'], subset_desc, _cache_worker_state['cache']))
 
     def cache_sample_fields(self, fields: List[str], reset_cache: bool = False, num_workers: int = 8, cache_dest: Optional[str] = None) -> None:
         """
@@ -381,11 +437,11 @@ class FuseDatasetGenerator(FuseDatasetBase):
 
         # create cache field object upon request
         if isinstance(self.cache_fields, FuseCacheNull):
-            # cache object
+            # cache object - columnar format
             if isinstance(cache_dest, str) and cache_dest == 'memory':
-                self.cache_fields: FuseCacheBase = FuseCacheMemory()
+                self.cache_fields: FuseCacheBase = FuseCacheColumns(None, reset_cache)
             elif isinstance(cache_dest, str):
-                self.cache_fields: FuseCacheBase = FuseCacheFiles(cache_dest, reset_cache, single_file=True)
+                self.cache_fields: FuseCacheBase = FuseCacheColumns(cache_dest, reset_cache)
 
         # get list of desc to cache
         desc_list = self.samples_description
@@ -394,40 +450,57 @@ class FuseDatasetGenerator(FuseDatasetBase):
         desc_field_to_cache = desc_field_list - cached_desc_field
         desc_to_cache = set([desc_field[0] for desc_field in desc_field_to_cache])
 
-        # multi thread caching
+        # multi process caching - the workers extract the fields, written to the cache by this process
         if len(desc_to_cache) != 0:
             lgr.info(f'FuseDatasetGenerator: samples fields - caching {len(desc_to_cache)} out of {len(desc_list)}')
+            indices_to_cache = sorted([self.get_sample_index(desc) for desc in desc_to_cache])
+            self.cache_fields.start_caching()
             if num_workers > 0:
-                with Manager() as manager:
-                    self.cache_fields.start_caching(manager)
-                    pool = Pool(processes=num_workers)
-                    for _ in tqdm(pool.imap_unordered(func=self._cache_sample_fields,
-                                                      iterable=[(desc, fields) for desc in desc_to_cache]),
-                                  total=len(desc_to_cache), smoothing=0.1):
-                        pass
-                    pool.close()
-                    pool.join()
-                    self.cache_fields.save()
+                pool = Pool(processes=num_workers, initializer=self._cache_fields_worker_init, initargs=(self, fields))
+                for desc, values in tqdm(pool.imap_unordered(func=self._cache_sample_fields_in_worker, iterable=indices_to_cache),
+                                         total=len(indices_to_cache), smoothing=0.1):
+                    self._set_sample_fields(desc, values)
+                pool.close()
+                pool.join()
             else:
-                self.cache_fields.start_caching(None)
-                for desc in tqdm(desc_to_cache):
-                    self._cache_sample_fields((desc, fields))
-                self.cache_fields.save()
+                for index in tqdm(indices_to_cache):
+                    self._set_sample_fields(*self._cache_sample_fields((index, fields)))
+            self.cache_fields.save()
         else:
             lgr.info('FuseDatasetGenerator: all samples fields are already cached')
 
-    def _cache_sample_fields(self, args):
-        # decode args
-        desc, fields = args
-        index = self.samples_description.index(desc)
+    def _cache_sample_fields(self, args: Tuple[int, List[str]]) -> Tuple[Hashable, Dict[str, Any]]:
+        """
+        Extract the fields of a single sample
+        :param args: tuple of sample index and fields
+        :return: tuple of sample descriptor and map field to value
+        """
+        index, fields = args
         sample = self.getitem(index, apply_augmentation=False)
-        for field in fields:
+        return self.samples_description[index], {field: FuseUtilsHierarchicalDict.get(sample, field) for field in fields}
+
+    def _set_sample_fields(self, desc: Hashable, values: Dict[str, Any]) -> None:
+        for field, value in values.items():
             # create field desc and save it in cache
             desc_field = (desc, field)
             if desc_field not in self.cache_fields:
-                value = FuseUtilsHierarchicalDict.get(sample, field)
                 self.cache_fields[desc_field] = value
 
+    @staticmethod
+    def _cache_fields_worker_init(dataset: 'FuseDatasetGenerator', fields: List[str]) -> None:
+        """
+        Fields caching pool initializer - store the dataset once per worker instead of once per task
+        """
+        _cache_worker_state['dataset'] = dataset
+        _cache_worker_state['fields'] = fields
+
+    @staticmethod
+    def _cache_sample_fields_in_worker(index: int) -> Tuple[Hashable, Dict[str, Any]]:
+        """
+        Extract the fields of a single sample, using the objects stored by _cache_fields_worker_init()
+        """
+        return _cache_worker_state['dataset']._cache_sample_fields((index, _cache_worker_state['fields']))
+
     #### Filtering
     def filter(self, key: str, values: List[Any]) -> None:
         """
@@ -460,7 +533,7 @@ class FuseDatasetGenerator(FuseDatasetBase):
         assert (index is not None) ^ (descriptor is not None), "visualize method must get one and one only of an index or a descriptor"
         lgr = logging.getLogger('Fuse')
         if descriptor is not None:
-            index = self.sample_descriptor_to_index[descriptor]
+            index = self.get_sample_index(descriptor)
 
         if self.visualizer is None:
             lgr.warning('Cannot visualize - visualizer was not provided')
@@ -483,7 +556,7 @@ class FuseDatasetGenerator(FuseDatasetBase):
 
         lgr = logging.getLogger('Fuse')
         if descriptor is not None:
-            index = self.sample_descriptor_to_index[descriptor]
+            index = self.get_sample_index(descriptor)
         if self.visualizer is None:
             lgr.warning('Cannot visualize - visualizer was not provided')
             return
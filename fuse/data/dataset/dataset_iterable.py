@@ -0,0 +1,254 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Iterable (streaming) dataset - samples are generated in the order of the data source, sharded across DataLoader workers and ranks
+"""
+import itertools
+import logging
+import math
+import random
+from typing import Any, Dict, Hashable, Iterable, Iterator, List, Optional, Tuple, Union
+
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+
+from fuse.data.augmentor.augmentor_base import FuseAugmentorBase
+from fuse.data.data_source.data_source_base import FuseDataSourceBase
+from fuse.data.dataset.dataset_base import FuseDatasetBase
+from fuse.data.dataset.dataset_default import FuseDatasetDefault
+from fuse.data.processor.processor_base import FuseProcessorBase
+from fuse.utils.data.collate import CollateCompiled
+from fuse.utils.utils_hierarchical_dict import FuseUtilsHierarchicalDict
+from fuse.utils.utils_logger import log_object_input_state
+
+
+class FuseDatasetIterable(FuseDatasetBase, IterableDataset):
+    """
+    Fuse Dataset Iterable
+    Streams the samples instead of random access: the sample descriptors are read from the data source in storage order,
+    and the processors, augmentation and post processing are applied in the stream.
+    The stream is sharded round robin across the distributed ranks and the DataLoader workers of each rank,
+    so each descriptor is processed by a single worker. An optional shuffle buffer randomizes the order within a window.
+    Use it for data that can't be enumerated or cached up front, otherwise prefer FuseDatasetDefault.
+    """
+
+    #### CONSTRUCTOR
+    def __init__(self, data_source: Union[FuseDataSourceBase, Iterable[Hashable]],
+                 input_processors: Optional[Dict[str, FuseProcessorBase]], gt_processors: Optional[Dict[str, FuseProcessorBase]],
+                 processors: Union[FuseProcessorBase, Dict[str, FuseProcessorBase]] = None,
+                 augmentor: Optional[FuseAugmentorBase] = None, post_processing_func=None,
+                 filter_keys: Optional[List[str]] = None,
+                 data_key_prefix: Optional[str] = 'data',
+                 shuffle_buffer_size: int = 0,
+                 seed: int = 0,
+                 num_samples: Optional[int] = None,
+                 rank: Optional[int] = None, world_size: Optional[int] = None):
+        """
+        :param data_source: either a data source object or an iterable of sample descriptors, iterated once per epoch
+                            (e.g. an object reading a manifest file line by line in its __iter__()).
+        :param input_processors: dictionary of all the input data processors
+        :param gt_processors: dictionary of all the ground truth data processors
+        :param processors: Use in case the ground truth and input are coupled. Could be either a single processor or dictionary of processors.
+                           If used, input_processors and gt_processors must be set to None.
+        :param augmentor: Optional, object that perform the augmentation
+        :param post_processing_func: callback that allows to dynamically modify the data. Called as last step (after augmentation)
+        :param filter_keys: Optional. list of keys to remove from the sample dictionary
+        :param data_key_prefix: every key added to sample_dict by the dataset will be prepended with this prefix to get unique name.
+        :param shuffle_buffer_size: if > 0, the samples of each worker are shuffled within a buffer of shuffle_buffer_size samples
+        :param seed: seed of the shuffle buffer, combined with the epoch (see set_epoch()) and the shard
+        :param num_samples: Optional. the (estimated) number of samples per epoch, across all the ranks.
+                            Used just by len() - the number of samples per rank. Required by managers that use len(data_loader).
+        :param rank: Optional. the rank of this process, if None, taken from torch.distributed if initialized, otherwise 0
+        :param world_size: Optional. the number of ranks, if None, taken from torch.distributed if initialized, otherwise 1
+        """
+        # log object input state
+        log_object_input_state(self, locals())
+
+        super().__init__()
+
+        self.data_source = data_source
+        if processors is None:
+            self.processors = {'input': input_processors, 'gt': gt_processors}
+        else:
+            if input_processors is not None or gt_processors is not None:
+                msg = f'Either processors or input_processors and gt_processors should be set to None'
+                logging.getLogger('Fuse').error(msg)
+                raise Exception(msg)
+            self.processors = processors
+
+        self.augmentor = augmentor
+        self.post_processing_func = post_processing_func
+        self.filter_keys = filter_keys or []
+        self.data_key_prefix = data_key_prefix
+        self.shuffle_buffer_size = shuffle_buffer_size
+        self.seed = seed
+        self.num_samples = num_samples
+        self.rank = rank
+        self.world_size = world_size
+        self.epoch = 0
+        self._collate = CollateCompiled()
+
+    def create(self, **kwargs) -> None:
+        """
+        See base class. Nothing to prepare - the samples are generated while iterating.
+        """
+        pass
+
+    def set_epoch(self, epoch: int) -> None:
+        """
+        Set the epoch, used to seed the shuffle buffer. Call it before creating the DataLoader iterator of each epoch
+        :param epoch: epoch number
+        """
+        self.epoch = epoch
+
+    #### ITERATE AND GET DATA
+    def __len__(self) -> int:
+        if self.num_samples is None:
+            raise TypeError('FuseDatasetIterable: length is unknown, set num_samples')
+        _, num_ranks = self._get_rank()
+        return int(math.ceil(self.num_samples / num_ranks))
+
+    def __iter__(self) -> Iterator[Any]:
+        shard, num_shards = self.get_shard()
+        descriptors = self._get_descriptors()
+        descriptors = itertools.islice(descriptors, shard, None, num_shards)
+        if self.shuffle_buffer_size > 0:
+            descriptors = self._shuffle(descriptors, random.Random(hash((self.seed, self.epoch, shard))))
+
+        for desc in descriptors:
+            sample = FuseDatasetDefault.getitem_without_augmentation_static(self.processors, desc, data_key_prefix=self.data_key_prefix)
+            if sample is None:
+                # invalid sample - already logged by getitem_without_augmentation_static
+                continue
+            yield self._process_sample(sample)
+
+    def get_shard(self) -> Tuple[int, int]:
+        """
+        The shard of the stream handled by this process: shards are assigned to the ranks, and within a rank to the DataLoader workers
+        :return: tuple of shard index and number of shards
+        """
+        rank, num_ranks = self._get_rank()
+        worker_info = get_worker_info()
+        worker_id, num_workers = (worker_info.id, worker_info.num_workers) if worker_info is not None else (0, 1)
+        return rank * num_workers + worker_id, num_ranks * num_workers
+
+    def get(self, index: Optional[int], key: Optional[str], use_cache: bool = False) -> Any:
+        """
+        Random access is not supported, see base class
+        """
+        msg = 'FuseDatasetIterable: random access (get) is not supported, iterate over the dataset instead'
+        logging.getLogger('Fuse').error(msg)
+        raise Exception(msg)
+
+    #### BATCHING
+    def collate_fn(self, samples: List[Dict]) -> Dict:
+        """
+        collate list of samples into batch_dict, see fuse.utils.data.collate.CollateCompiled
+        :param samples: list of samples
+        :return: batch_dict
+        """
+        return self._collate(samples)
+
+    # misc
+    def summary(self, statistic_keys: Optional[List[str]] = None) -> str:
+        """
+        See base class
+        """
+        sum = \
+            f'Class = {self.__class__}\n'
+        sum += \
+            f'Processors:\n' \
+                f'------------------------\n' \
+                f'{self.processors}\n'
+        sum += \
+            f'Augmentor:\n' \
+                f'----------\n' \
+                f'{self.augmentor.summary() if self.augmentor is not None else None}\n'
+        sum += \
+            f'Data source:\n' \
+                f'------------\n' \
+                f'{self.data_source.summary() if isinstance(self.data_source, FuseDataSourceBase) else self.data_source}\n'
+        sum += \
+            f'Shuffle buffer size: {self.shuffle_buffer_size}, samples per epoch: {self.num_samples}\n'
+        return sum
+
+    def get_instance_to_save(self, mode: FuseDatasetBase.SaveMode) -> FuseDatasetBase:
+        """
+        See base class
+        """
+        dataset = FuseDatasetIterable(data_source=None,
+                                      input_processors={},
+                                      gt_processors={},
+                                      augmentor=self.augmentor,
+                                      post_processing_func=self.post_processing_func,
+                                      data_key_prefix=self.data_key_prefix)
+        if mode == FuseDatasetBase.SaveMode.INFERENCE and isinstance(self.processors, dict) and 'input' in self.processors:
+            dataset.processors = {'input': self.processors['input']}  # for inference we can save only input processors if available
+        else:
+            dataset.processors = self.processors
+
+        return dataset
+
+    def _get_descriptors(self) -> Iterator[Hashable]:
+        if isinstance(self.data_source, FuseDataSourceBase):
+            return iter(self.data_source.get_samples_description())
+        return iter(self.data_source)
+
+    def _get_rank(self) -> Tuple[int, int]:
+        """
+        :return: tuple of the rank and the number of ranks
+        """
+        distributed = dist.is_available() and dist.is_initialized()
+        rank = self.rank if self.rank is not None else (dist.get_rank() if distributed else 0)
+        world_size = self.world_size if self.world_size is not None else (dist.get_world_size() if distributed else 1)
+        return rank, world_size
+
+    def _shuffle(self, descriptors: Iterator[Hashable], rng: random.Random) -> Iterator[Hashable]:
+        """
+        Shuffle the stream within a buffer: once the buffer is full, each new descriptor replaces a random descriptor of the buffer
+        """
+        buffer = []
+        for desc in descriptors:
+            if len(buffer) < self.shuffle_buffer_size:
+                buffer.append(desc)
+                continue
+            index = rng.randrange(self.shuffle_buffer_size)
+            yield buffer[index]
+            buffer[index] = desc
+        rng.shuffle(buffer)
+        yield from buffer
+
+    def _process_sample(self, sample: Any) -> Any:
+        """
+        Filter keys, augment and post process a sample
+        """
+        for key in self.filter_keys:
+            try:
+                FuseUtilsHierarchicalDict.pop(sample, key)
+            except KeyError:
+                pass
+
+        if self.augmentor is not None:
+            sample = self.augmentor(sample)
+
+        if self.post_processing_func is not None:
+            self.post_processing_func(sample)
+
+        return sample
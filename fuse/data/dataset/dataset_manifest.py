@@ -0,0 +1,108 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Dataset manifest - the outcome of dataset.create() persisted in the cache dir, used to open a cached dataset without rescanning
+"""
+import hashlib
+import logging
+import os
+import pickle
+from typing import Any, Dict, Hashable, List, Optional, Sequence
+
+import numpy as np
+
+from fuse.utils.file_io.atomic_file import AtomicFileWriter
+
+
+class FuseDatasetManifest:
+    """
+    Dataset manifest: the sample descriptors, a mask of the valid (cached) samples and the field index - the sample field of each processor.
+    Written by dataset.create() once the samples are cached, and read by dataset.create(use_manifest=True) instead of
+    scanning the data source and the cache index.
+    The manifest is versioned, protected by a checksum and tagged with a signature of the dataset configuration it was created with
+    (e.g. the cache type and the processors fingerprints) - a manifest that doesn't match is ignored.
+    """
+    VERSION = 1
+    FILE_NAME = 'dataset_manifest.pkl'
+
+    def __init__(self, descriptors: Sequence[Hashable], valid: np.ndarray, fields: Optional[List[str]] = None,
+                 signature: Optional[Dict[str, Any]] = None):
+        """
+        :param descriptors: the sample descriptors, the valid samples first, in dataset order
+        :param valid: boolean mask of the valid samples - the samples cached successfully
+        :param fields: the sample field (hierarchical key) of each processor
+        :param signature: the dataset configuration the manifest was created with
+        """
+        self.descriptors = list(descriptors)
+        self.valid = np.asarray(valid, dtype=bool)
+        self.fields = fields or []
+        self.signature = signature or {}
+
+    def get_samples_description(self) -> List[Hashable]:
+        """
+        :return: the descriptors of the valid samples, in dataset order
+        """
+        if self.valid.all():
+            return list(self.descriptors)
+        return [self.descriptors[index] for index in np.flatnonzero(self.valid)]
+
+    def save(self, file_name: str) -> None:
+        """
+        Save the manifest, atomically
+        :param file_name: path to the manifest file
+        """
+        payload = pickle.dumps({'descriptors': self.descriptors, 'valid': self.valid, 'fields': self.fields, 'signature': self.signature})
+        with AtomicFileWriter(filename=file_name) as manifest_file:
+            pickle.dump({'version': self.VERSION, 'checksum': self._checksum(payload), 'payload': payload}, manifest_file)
+
+    @staticmethod
+    def load(file_name: str, signature: Optional[Dict[str, Any]] = None) -> Optional['FuseDatasetManifest']:
+        """
+        Load and validate a manifest
+        :param file_name: path to the manifest file
+        :param signature: the expected signature, None to skip the check
+        :return: the manifest, or None if it's missing, of another version, corrupted or created with another configuration
+        """
+        lgr = logging.getLogger('Fuse')
+        if not os.path.exists(file_name):
+            return None
+        try:
+            with open(file_name, 'rb') as manifest_file:
+                header = pickle.load(manifest_file)
+        except Exception as e:
+            lgr.warning(f'FuseDatasetManifest: failed to read {file_name}: {e}')
+            return None
+
+        if header.get('version', None) != FuseDatasetManifest.VERSION:
+            lgr.info(f'FuseDatasetManifest: ignoring {file_name} - version {header.get("version", None)}, expecting {FuseDatasetManifest.VERSION}')
+            return None
+        if header['checksum'] != FuseDatasetManifest._checksum(header['payload']):
+            lgr.warning(f'FuseDatasetManifest: ignoring {file_name} - checksum mismatch')
+            return None
+
+        content = pickle.loads(header['payload'])
+        if signature is not None and content['signature'] != signature:
+            lgr.info(f'FuseDatasetManifest: ignoring {file_name} - created with another dataset configuration')
+            return None
+        return FuseDatasetManifest(content['descriptors'], content['valid'], content['fields'], content['signature'])
+
+    @staticmethod
+    def _checksum(payload: bytes) -> str:
+        return hashlib.blake2b(payload, digest_size=16).hexdigest()
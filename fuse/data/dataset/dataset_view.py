@@ -0,0 +1,132 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Dataset view - a subset of the samples of a dataset, without copying the dataset
+"""
+from typing import Any, Hashable, List, Optional, Sequence, Union
+
+import numpy as np
+
+from fuse.data.dataset.dataset_base import FuseDatasetBase
+from fuse.data.dataset.dataset_descriptor_store import FuseDescriptorStore
+from fuse.data.dataset.dataset_filter import FuseFilterBase
+from fuse.data.sampler.sampler_prefetch import FusePrefetchIndex
+
+
+class FuseDatasetView(FuseDatasetBase):
+    """
+    A subset of the samples of a dataset, typically returned by FuseDatasetDefault.filter().
+    The view keeps just the indices of the samples in the underlying dataset - samples, cache and processors are shared.
+    The view is valid as long as the samples description of the underlying dataset is not modified.
+    """
+
+    def __init__(self, dataset: FuseDatasetBase, indices: Sequence[int]):
+        """
+        :param dataset: the underlying dataset, already created
+        :param indices: the indices of the samples in the underlying dataset
+        """
+        super().__init__()
+        self.dataset = dataset
+        self.indices = np.asarray(indices, dtype=np.int64)
+        samples_description = dataset.samples_description
+        if isinstance(samples_description, FuseDescriptorStore):
+            self.samples_description = samples_description[self.indices]
+        else:
+            self.samples_description = [samples_description[index] for index in self.indices]
+
+    def create(self, **kwargs) -> None:
+        """
+        See base class. Nothing to do - the underlying dataset is already created.
+        """
+        pass
+
+    def __len__(self) -> int:
+        return len(self.indices)
+
+    def __getitem__(self, index: int) -> Any:
+        return self.dataset[self._to_dataset_index(index)]
+
+    def __getitems__(self, indices: List[int]) -> List[Any]:
+        """
+        Get a batch of samples, see FuseDatasetDefault.__getitems__()
+        """
+        dataset_indices = [self._to_dataset_index(index) for index in indices]
+        if hasattr(self.dataset, '__getitems__'):
+            return self.dataset.__getitems__(dataset_indices)
+        return [self.dataset[index] for index in dataset_indices]
+
+    def getitem(self, index: int, **kwargs) -> Any:
+        """
+        See FuseDatasetDefault.getitem()
+        """
+        return self.dataset.getitem(self._to_dataset_index(index), **kwargs)
+
+    def get(self, index: Optional[Union[int, Hashable]], key: Optional[str] = None, use_cache: bool = False) -> Any:
+        """
+        See base class
+        """
+        if index is None:
+            if key is not None and hasattr(self.dataset, 'get_column'):
+                return self.dataset.get_column(key, self.indices)
+            return [self.dataset.get(int(dataset_index), key, use_cache) for dataset_index in self.indices]
+        if not isinstance(index, int):
+            index = self.get_sample_index(index)
+        return self.dataset.get(int(self.indices[index]), key, use_cache)
+
+    def get_column(self, key: str, indices: Optional[Sequence[int]] = None) -> np.ndarray:
+        """
+        See FuseDatasetDefault.get_column()
+        """
+        return self.dataset.get_column(key, self.indices if indices is None else self.indices[np.asarray(indices, dtype=np.int64)])
+
+    def filter(self, sample_filter: FuseFilterBase) -> 'FuseDatasetView':
+        """
+        Select a subset of this view, see FuseDatasetDefault.filter()
+        :param sample_filter: the filter, selects the samples to keep
+        :return: a view of the underlying dataset
+        """
+        columns = {key: self.get_column(key) for key in set(sample_filter.get_keys())}
+        return FuseDatasetView(self.dataset, self.indices[sample_filter(columns)])
+
+    def collate_fn(self, samples: List[Any]) -> Any:
+        """
+        See base class
+        """
+        return self.dataset.collate_fn(samples)
+
+    def summary(self, statistic_keys: Optional[List[str]] = None) -> str:
+        """
+        See base class
+        """
+        return f'View of {len(self)} out of {len(self.dataset)} samples\n' + self.dataset.summary(statistic_keys)
+
+    def get_instance_to_save(self, mode: FuseDatasetBase.SaveMode) -> FuseDatasetBase:
+        """
+        See base class. The underlying dataset is saved - the selected subset is not.
+        """
+        return self.dataset.get_instance_to_save(mode)
+
+    def _to_dataset_index(self, index: int) -> int:
+        """
+        Map an index of the view to an index of the underlying dataset, including the indices to prefetch (see FuseSamplerPrefetch)
+        """
+        if isinstance(index, FusePrefetchIndex):
+            return FusePrefetchIndex(int(self.indices[index]), [int(self.indices[prefetch_index]) for prefetch_index in index.prefetch])
+        return int(self.indices[index])
@@ -20,11 +20,122 @@ Created on June 30, 2021
 """
 Processors Base class
 """
+import hashlib
+import inspect
+import pickle
+import types
 from abc import ABC, abstractmethod
-from typing import Hashable
+from typing import Hashable, Any, List, Sequence
+
+import numpy as np
+import pandas as pd
+import torch
 
 
 class FuseProcessorBase(ABC):
     @abstractmethod
     def __call__(self, sample_desc: Hashable):
         raise NotImplementedError
+
+    def process_batch(self, sample_descs: Sequence[Hashable]) -> List[Any]:
+        """
+        Process a batch of samples, same as calling the processor per sample descriptor.
+        Used by the dataset whenever several samples are processed together (e.g. caching, dataset.get(None, key) and batched getitems).
+        Override it to amortize the per sample cost, e.g. a single table lookup or opening a file once for the entire batch.
+        :param sample_descs: list of sample descriptors
+        :return: list of the processor outputs, one per sample descriptor. None for a sample that failed to load.
+        """
+        return [self(sample_desc) for sample_desc in sample_descs]
+
+    def load(self, sample_desc: Hashable) -> Any:
+        """
+        The I/O bound part of the processor (e.g. reading the raw files), run by the I/O threads of the caching pipeline,
+        see FuseDatasetDefault.create(io_threads=...). The result is passed to process_loaded(), in a CPU worker process.
+        Processors that override it, should override process_loaded() as well, and typically implement
+        __call__() as process_loaded(sample_desc, load(sample_desc)).
+        The default implementation loads nothing - the entire processing is done by process_loaded().
+        :param sample_desc: sample descriptor
+        :return: the loaded data, must be picklable
+        """
+        return None
+
+    def process_loaded(self, sample_desc: Hashable, loaded: Any) -> Any:
+        """
+        The CPU bound part of the processor (e.g. decoding and resampling), see load()
+        :param sample_desc: sample descriptor
+        :param loaded: the data returned by load()
+        :return: the processor output, same as __call__()
+        """
+        return self(sample_desc)
+
+    def fingerprint(self) -> str:
+        """
+        Identify the processor configuration and code version.
+        Used by FuseDatasetDefault(cache_by_processor=True) to recompute only the outputs of processors that changed.
+        The default implementation hashes the class source code and the attributes of the instance.
+        Override it if some of the attributes are irrelevant to the output (e.g. number of threads) or cannot be hashed deterministically.
+        :return: fingerprint string
+        """
+        hasher = hashlib.md5()
+        processor_cls = type(self)
+        hasher.update(f'{processor_cls.__module__}.{processor_cls.__qualname__}'.encode())
+        try:
+            hasher.update(inspect.getsource(processor_cls).encode())
+        except (OSError, TypeError):
+            # source code not available
+            pass
+        self._fingerprint_update(hasher, vars(self), set())
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _fingerprint_update(hasher: Any, value: Any, visited: set) -> None:
+        """
+        Recursively update hasher with a deterministic representation of value
+        """
+        if value is None or isinstance(value, (bool, int, float, complex, str, bytes)):
+            hasher.update(repr(value).encode())
+        elif isinstance(value, np.ndarray):
+            hasher.update(f'{value.dtype.str}{value.shape}'.encode())
+            hasher.update(value.tobytes() if not value.dtype.hasobject else repr(value.tolist()).encode())
+        elif isinstance(value, torch.Tensor):
+            FuseProcessorBase._fingerprint_update(hasher, value.detach().cpu().numpy(), visited)
+        elif isinstance(value, (pd.DataFrame, pd.Series)):
+            hasher.update(repr(list(value.columns) if isinstance(value, pd.DataFrame) else value.name).encode())
+            hasher.update(pd.util.hash_pandas_object(value).values.tobytes())
+        elif isinstance(value, (types.ModuleType, type)):
+            hasher.update(getattr(value, '__qualname__', value.__name__).encode())
+        elif isinstance(value, types.FunctionType):
+            # functions and lambdas - name and byte code
+            hasher.update(value.__qualname__.encode())
+            hasher.update(value.__code__.co_code)
+        elif isinstance(value, types.MethodType):
+            hasher.update(value.__func__.__qualname__.encode())
+        elif isinstance(value, (dict, list, tuple, set, frozenset)) or hasattr(value, '__dict__'):
+            # avoid infinite recursion
+            if id(value) in visited:
+                hasher.update(b'<cycle>')
+                return
+            visited.add(id(value))
+            if isinstance(value, dict):
+                hasher.update(b'{')
+                for item_key, item_value in sorted(value.items(), key=lambda item: repr(item[0])):
+                    hasher.update(repr(item_key).encode())
+                    FuseProcessorBase._fingerprint_update(hasher, item_value, visited)
+                hasher.update(b'}')
+            elif isinstance(value, (set, frozenset)):
+                hasher.update(repr(sorted([repr(item) for item in value])).encode())
+            elif isinstance(value, (list, tuple)):
+                hasher.update(b'[')
+                for item in value:
+                    FuseProcessorBase._fingerprint_update(hasher, item, visited)
+                hasher.update(b']')
+            else:
+                # object - type and attributes
+                hasher.update(f'{type(value).__module__}.{type(value).__qualname__}'.encode())
+                FuseProcessorBase._fingerprint_update(hasher, dict(vars(value)), visited)
+        else:
+            try:
+                hasher.update(pickle.dumps(value, protocol=4))
+            except:
+                # fallback to type name - avoid repr() which might include memory address
+                hasher.update(f'{type(value).__module__}.{type(value).__qualname__}'.encode())
@@ -0,0 +1,94 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Torch batch sampler wrapper - attach the upcoming indices to each batch, used for cache read-ahead
+"""
+from collections import deque
+from typing import Iterable, Iterator, List, Sequence
+
+from torch.utils.data.sampler import Sampler
+
+
+class FusePrefetchIndex(int):
+    """
+    Sample index (int) carrying the indices of the samples expected to be read next by the same DataLoader worker.
+    See FuseDatasetDefault(cache_prefetch_threads=...)
+    """
+
+    def __new__(cls, index: int, prefetch: Sequence[int] = ()):
+        obj = super().__new__(cls, index)
+        obj.prefetch = list(prefetch)
+        return obj
+
+    def __reduce__(self):
+        return FusePrefetchIndex, (int(self), self.prefetch)
+
+
+class FuseSamplerPrefetch(Sampler):
+    """
+    Wraps a batch sampler (e.g. FuseSamplerBalancedBatch or torch BatchSampler over a standard sampler).
+    DataLoader assigns the batches to the workers round robin, so batch k + num_workers will be read by the worker reading batch k.
+    The first index of batch k is replaced by FusePrefetchIndex listing the indices of the next read_ahead batches of that worker,
+    so the dataset can read them from the cache in the background.
+    """
+
+    def __init__(self, batch_sampler: Iterable[List[int]], num_workers: int, read_ahead: int = 1) -> None:
+        """
+        :param batch_sampler: the batch sampler to wrap - yields list of indices per batch
+        :param num_workers: the number of DataLoader workers
+        :param read_ahead: the number of future batches (of the same worker) to prefetch
+        """
+        try:
+            super().__init__()
+        except TypeError:
+            # older torch versions - Sampler.__init__(data_source) is required
+            super().__init__(None)
+        self._batch_sampler = batch_sampler
+        self._stride = max(num_workers, 1)
+        self._read_ahead = read_ahead
+
+    def __iter__(self) -> Iterator[List[int]]:
+        look_ahead = self._stride * self._read_ahead
+        batches = deque()
+        batches_iter = iter(self._batch_sampler)
+
+        for batch in batches_iter:
+            batches.append(list(batch))
+            if len(batches) > look_ahead:
+                yield self._attach(batches)
+                batches.popleft()
+        while batches:
+            yield self._attach(batches)
+            batches.popleft()
+
+    def __len__(self) -> int:
+        return len(self._batch_sampler)
+
+    def _attach(self, batches: deque) -> List[int]:
+        """
+        :return: the first batch in batches, with the indices of the future batches of the same worker attached
+        """
+        batch = batches[0]
+        if len(batch) == 0:
+            return batch
+        prefetch = []
+        for batch_index in range(self._stride, len(batches), self._stride):
+            prefetch.extend(int(index) for index in batches[batch_index])
+        return [FusePrefetchIndex(batch[0], prefetch)] + batch[1:]
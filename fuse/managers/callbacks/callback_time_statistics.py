@@ -19,10 +19,14 @@ Created on June 30, 2021
 
 import logging
 import time
-from typing import Dict
+from typing import Dict, Optional
 
+import numpy as np
 import torch.nn as nn
 
+from fuse.data.cache.cache_base import FuseCacheBase
+from fuse.data.cache.cache_stats import FuseCacheStats
+from fuse.data.dataset.dataset_base import FuseDatasetBase
 from fuse.managers.callbacks.callback_base import FuseCallback
 from fuse.managers.manager_state import FuseManagerState
 from fuse.utils.misc.misc import get_time_delta, time_display
@@ -33,11 +37,14 @@ class FuseTimeStatisticsCallback(FuseCallback):
         Counts time of procedures.
     """
 
-    def __init__(self, num_epochs: int, load_expected_part=0.1) -> None:
+    def __init__(self, num_epochs: int, load_expected_part=0.1, datasets: Optional[Dict[str, FuseDatasetBase]] = None) -> None:
         """
 
         :param num_epochs: total number of epochs (to compute remaining time)
         :param load_expected_part: expected fraction of the loading from the total handle_epoch time.
+        :param datasets: Optional. map mode ('train' / 'validation') to the dataset used in this mode.
+                         If set, a report of the dataset cache statistics (hits, bytes read, read / decompress / unpickle time...)
+                         of each epoch will be logged next to the data loading time.
         """
         super().__init__()
         self.num_epochs = num_epochs
@@ -50,6 +57,10 @@ class FuseTimeStatisticsCallback(FuseCallback):
         self.load_batch_aggregated_time = 0
         self.train_begin_time = None
 
+        self.datasets = datasets or {}
+        # mode -> {cache name -> statistics snapshot}, taken at the beginning of the epoch
+        self.cache_stats_begin: Dict[str, Dict[str, np.ndarray]] = {}
+
         pass
 
     def on_step_begin(self, step: int) -> None:
@@ -81,6 +92,7 @@ class FuseTimeStatisticsCallback(FuseCallback):
         """
         self.epoch_begin_time = time.time()
         self.load_batch_aggregated_time = 0
+        self.cache_stats_begin[mode] = {name: cache.stats.snapshot() for name, cache in self._get_caches(mode).items()}
         pass
 
     def on_epoch_end(self, mode: str, epoch: int, epoch_results: Dict = None) -> None:
@@ -108,6 +120,12 @@ class FuseTimeStatisticsCallback(FuseCallback):
             lgr.info(f'Mode: {mode}, epoch {epoch}: '
                      f'Total time for loading data ({load_time_str}) is greater than expected (maximum {time_display(max_time_for_load)})',
                      {'color': 'blue'})
+
+        # cache report - the statistics of this epoch, aggregated across the data loader workers
+        cache_stats_begin = self.cache_stats_begin.pop(mode, {})
+        for name, cache in self._get_caches(mode).items():
+            stats = cache.stats.get_stats(since=cache_stats_begin.get(name, None))
+            lgr.info(f'Mode: {mode}, epoch {epoch}: {name}: {FuseCacheStats.format_stats(stats)}')
         pass
 
     def on_virtual_batch_begin(self, mode: str, virtual_batch: int) -> None:
@@ -140,3 +158,16 @@ class FuseTimeStatisticsCallback(FuseCallback):
     def on_train_end(self) -> None:
         logging.getLogger('Fuse').debug(f"Time for train: {get_time_delta(self.train_begin_time)}")
         pass
+
+    def _get_caches(self, mode: str) -> Dict[str, FuseCacheBase]:
+        """
+        :return: the caches of the dataset used in this mode, including the backend of a tiered cache
+        """
+        caches = {}
+        cache = getattr(self.datasets.get(mode, None), 'cache', None)
+        if isinstance(cache, FuseCacheBase):
+            caches['cache'] = cache
+            backend = getattr(cache, 'backend', None)
+            if isinstance(backend, FuseCacheBase):
+                caches['cache backend'] = backend
+        return caches
@@ -0,0 +1,137 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+"""
+Shared fixtures of the data tests: synthetic samples, test processors and a dataset factory
+"""
+import os
+import shutil
+import tempfile
+import unittest
+from typing import Any, List
+
+import numpy as np
+import torch
+
+from fuse.data.data_source.data_source_from_list import FuseDataSourceFromList
+from fuse.data.dataset.dataset_default import FuseDatasetDefault
+from fuse.data.processor.processor_base import FuseProcessorBase
+
+
+def create_sample(index: int) -> dict:
+    """
+    :return: synthetic sample, its values derived from index
+    """
+    return {'data': {'descriptor': f'sample_{index}',
+                     'image': torch.full((2, 8, 8), float(index)),
+                     'mask': np.full((8, 8), index, dtype=np.uint8),
+                     'label': index % 3}}
+
+
+def create_descriptors(num_samples: int) -> List[str]:
+    """
+    :return: the descriptors of the first num_samples synthetic samples
+    """
+    return [f'sample_{index}' for index in range(num_samples)]
+
+
+def create_dataset(descriptors: List[Any], processor: FuseProcessorBase, **kwargs) -> FuseDatasetDefault:
+    """
+    Dataset of the given descriptors, with a single processor generating the sample data (not created)
+    :param descriptors: the sample descriptors
+    :param processor: the processor
+    :param kwargs: more FuseDatasetDefault arguments, e.g. cache_dest
+    """
+    return FuseDatasetDefault(data_source=FuseDataSourceFromList(descriptors), input_processors=None, gt_processors=None,
+                              processors=processor, **kwargs)
+
+
+class FuseProcessorTest(FuseProcessorBase):
+    def __call__(self, sample_desc: str):
+        index = int(sample_desc.split('_')[1])
+        return create_sample(index)['data']
+
+
+class FuseProcessorIndexTest(FuseProcessorBase):
+    def __call__(self, sample_desc: int):
+        # int descriptors - python or numpy
+        return create_sample(int(sample_desc))['data']
+
+
+class FuseProcessorCountTest(FuseProcessorBase):
+    num_calls = 0
+
+    def __init__(self, offset: int):
+        self.offset = offset
+
+    def __call__(self, sample_desc: str):
+        FuseProcessorCountTest.num_calls += 1
+        return {'value': int(sample_desc.split('_')[1]) + self.offset}
+
+
+class FuseProcessorBatchTest(FuseProcessorTest):
+    batch_sizes = []
+
+    def process_batch(self, sample_descs):
+        FuseProcessorBatchTest.batch_sizes.append(len(sample_descs))
+        return [self(sample_desc) if sample_desc != 'sample_7' else None for sample_desc in sample_descs]
+
+
+class FuseProcessorLoadTest(FuseProcessorTest):
+    def load(self, sample_desc: str):
+        # I/O stage - runs in the main process
+        return {'loaded_by': os.getpid()}
+
+    def process_loaded(self, sample_desc: str, loaded: dict):
+        sample = self(sample_desc)
+        sample.update(loaded)
+        return sample
+
+
+class FuseProcessorPatchesTest(FuseProcessorBase):
+    def __init__(self, num_patches: int):
+        self.num_patches = num_patches
+
+    def __call__(self, subset_desc: str):
+        # generator - patches are yielded one by one
+        index = int(subset_desc.split('_')[1])
+        for patch_index in range(self.num_patches if index != 0 else 0):
+            yield {'value': index * 1000 + patch_index}
+
+
+class FuseDataTestCaseBase(unittest.TestCase):
+    """
+    Base class of the data test cases: a temporary dir per test, removed once done
+    """
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def check_sample(self, sample: dict, index: int):
+        """
+        Compare a sample to the synthetic sample of the given index
+        """
+        expected = create_sample(index)
+        self.assertEqual(sample['data']['descriptor'], expected['data']['descriptor'])
+        self.assertTrue(torch.equal(sample['data']['image'], expected['data']['image']))
+        self.assertTrue(np.array_equal(sample['data']['mask'], expected['data']['mask']))
+        self.assertEqual(sample['data']['label'], expected['data']['label'])
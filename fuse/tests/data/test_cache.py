@@ -0,0 +1,530 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+import os
+import pickle
+import unittest
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from fuse.data.cache.cache_codecs import FuseSampleSerializer
+from fuse.data.cache.cache_files import FuseCacheFiles
+from fuse.data.cache.cache_mmap import FuseCacheMmap
+from fuse.data.cache.cache_shards import FuseCacheShards
+from fuse.data.cache.cache_shared_memory import FuseCacheSharedMemory
+from fuse.data.cache.cache_tiered import FuseCacheTiered
+from fuse.data.cache.cache_tools import migrate_cache_files_to_shards, benchmark_codecs, trim_caches, inspect_caches, open_cache
+from fuse.data.data_source.data_source_from_list import FuseDataSourceFromList
+from fuse.data.dataset.dataset_default import FuseDatasetDefault
+from fuse.data.dataset.dataset_generator import FuseDatasetGenerator
+from fuse.tests.data.data_test_utils import FuseDataTestCaseBase, FuseProcessorBatchTest, FuseProcessorCountTest, FuseProcessorPatchesTest, \
+    FuseProcessorTest, create_dataset, create_descriptors, create_sample
+
+
+class FuseCacheTestCase(FuseDataTestCaseBase):
+    def test_cache_shards(self):
+        cache_dir = os.path.join(self.tmp_dir, 'shards')
+        # small shards to check rolling over to a new shard file
+        cache = FuseCacheShards(cache_dir, reset_cache=True, max_shard_size=1000)
+        cache.start_caching(None)
+        for index in range(10):
+            cache[f'sample_{index}'] = create_sample(index)
+        cache['bad_sample'] = None
+        cache.save()
+
+        self.assertGreater(len(cache.get_shard_files()), 1)
+        self.assertEqual(len(cache.get_all_keys()), 10)
+        self.assertEqual(len(cache.get_all_keys(include_none=True)), 11)
+        self.assertIsNone(cache['bad_sample'])
+        for index in range(10):
+            self.check_sample(cache[f'sample_{index}'], index)
+
+        # reload
+        cache = FuseCacheShards(cache_dir, reset_cache=False)
+        self.assertIn('sample_3', cache)
+        self.check_sample(cache['sample_3'], 3)
+
+    def test_cache_mmap(self):
+        cache_dir = os.path.join(self.tmp_dir, 'mmap')
+        cache = FuseCacheMmap(cache_dir, reset_cache=True, min_array_size=0)
+        cache.start_caching(None)
+        for index in range(10):
+            cache[f'sample_{index}'] = create_sample(index)
+        cache.save()
+
+        cache = FuseCacheMmap(cache_dir, reset_cache=False)
+        for index in range(10):
+            self.check_sample(cache[f'sample_{index}'], index)
+
+        # in-place modifications should not affect the cache
+        sample = cache['sample_1']
+        sample['data']['image'] += 1
+        sample['data']['mask'][:] = 0
+        self.check_sample(cache['sample_1'], 1)
+
+    def test_cache_shared_memory(self):
+        cache = FuseCacheSharedMemory(min_array_size=0)
+        cache.start_caching(None)
+        for index in range(10):
+            cache[f'sample_{index}'] = create_sample(index)
+        cache['bad_sample'] = None
+        cache.save()
+
+        self.assertEqual(len(cache.get_all_keys()), 10)
+        self.assertIn('bad_sample', cache)
+        self.assertNotIn('sample_10', cache)
+        self.assertIsNone(cache['bad_sample'])
+        for index in range(10):
+            self.check_sample(cache[f'sample_{index}'], index)
+        self.assertGreater(cache.get_memory_usage()['shared_bytes'], 10 * create_sample(0)['data']['image'].numel() * 4)
+
+        # add samples after compacting the index
+        cache.start_caching(None)
+        cache['sample_10'] = create_sample(10)
+        cache.save()
+        self.check_sample(cache['sample_10'], 10)
+        self.check_sample(cache['sample_0'], 0)
+
+        # numpy and python keys - found as in a python dictionary
+        cache = FuseCacheSharedMemory(min_array_size=0)
+        cache.start_caching(None)
+        cache[np.int64(1)] = create_sample(1)
+        cache[2] = create_sample(2)
+        cache[(np.int32(3), 'a')] = create_sample(3)
+        cache.save()
+        self.check_sample(cache[1], 1)
+        self.check_sample(cache[np.int64(2)], 2)
+        self.check_sample(cache[(3, np.str_('a'))], 3)
+        self.assertNotIn(3, cache)
+
+    def test_cache_tiered(self):
+        cache_dir = os.path.join(self.tmp_dir, 'tiered')
+        sample_size = FuseCacheTiered.get_size(create_sample(0))
+        cache = FuseCacheTiered(FuseCacheShards(cache_dir, reset_cache=True), memory_budget=int(sample_size * 2.5))
+        cache.start_caching(None)
+        for index in range(5):
+            cache[f'sample_{index}'] = create_sample(index)
+        cache.save()
+
+        for index in [0, 1, 0, 1, 2, 0]:
+            self.check_sample(cache[f'sample_{index}'], index)
+        stats = cache.get_stats()
+        # 0, 1 and 2 are misses, sample 2 evicts sample 0
+        self.assertEqual((stats['hits'], stats['misses'], stats['evictions'], stats['num_samples']), (2, 4, 2, 2))
+
+        # in-place modification of a sample read (e.g. by augmentation) should not affect the memory tier
+        for _ in range(2):
+            sample = cache['sample_0']
+            sample['data']['image'] += 1
+            sample['data']['mask'][...] = 0
+            self.check_sample(cache['sample_0'], 0)
+
+    def test_cache_stats(self):
+        cache = FuseCacheShards(os.path.join(self.tmp_dir, 'stats'), reset_cache=True, codec='gzip')
+        cache.start_caching(None)
+        for index in range(5):
+            cache[f'sample_{index}'] = create_sample(index)
+        cache.save()
+        for index in range(5):
+            cache[f'sample_{index}']
+        self.assertIsNone(cache['sample_5'])
+
+        stats = cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['writes']), (5, 1, 5))
+        self.assertGreater(stats['bytes_read'], 0)
+        self.assertEqual(stats['bytes_read'], stats['bytes_written'])
+        for timer in ['read', 'decompress', 'unpickle', 'encode', 'write']:
+            self.assertEqual(sum(stats['timers'][timer]['histogram']), stats['timers'][timer]['count'])
+        self.assertEqual(stats['timers']['read']['count'], 5)
+
+        # aggregated across data loader workers
+        dataset = create_dataset(create_descriptors(20), FuseProcessorCountTest(0), cache_dest=os.path.join(self.tmp_dir, 'dataset_stats'),
+                                 cache_type='shards')
+        dataset.create(num_workers=0)
+        snapshot = dataset.cache.stats.snapshot()
+        data_loader = DataLoader(dataset, batch_size=4, num_workers=2, collate_fn=dataset.collate_fn)
+        for _ in range(2):
+            for _ in data_loader:
+                pass
+        stats = dataset.cache.stats.get_stats(since=snapshot)
+        self.assertEqual((stats['hits'], stats['misses']), (40, 0))
+        self.assertEqual(dataset.get_cache_stats()['timers']['read']['count'], 40)
+        dataset.cache.reset_stats()
+        self.assertEqual(dataset.get_cache_stats()['hits'], 0)
+
+    def test_cache_codecs(self):
+        serializer = FuseSampleSerializer('gzip', codec_policy={'data.mask': 'rle+gzip:9', 'data.image': 'shuffle+gzip:1'})
+        sample = create_sample(7)
+        data = serializer.serialize(sample)
+        self.assertLess(len(data), len(FuseSampleSerializer('none').serialize(sample)))
+        self.check_sample(serializer.deserialize(data), 7)
+
+        for cache_cls in [FuseCacheFiles, FuseCacheShards, FuseCacheMmap]:
+            cache_dir = os.path.join(self.tmp_dir, f'codec_{cache_cls.__name__}')
+            cache = cache_cls(cache_dir, reset_cache=True, codec='shuffle+gzip', codec_policy={'data.mask': 'rle'})
+            cache.start_caching(None)
+            for index in range(5):
+                cache[f'sample_{index}'] = create_sample(index)
+            cache.save()
+            cache = cache_cls(cache_dir, reset_cache=False)
+            for index in range(5):
+                self.check_sample(cache[f'sample_{index}'], index)
+
+        results = benchmark_codecs(cache_dir, ['none', 'gzip', 'rle+gzip:1'], num_samples=3)
+        self.assertEqual(list(results['codec']), ['none', 'gzip', 'rle+gzip:1'])
+
+    def test_cache_dtype_policy(self):
+        image = np.random.RandomState(0).uniform(-1, 1, (4, 32, 32)).astype(np.float32)
+        sample = {'data': {'image': torch.from_numpy(image), 'mask': image.copy(), 'other': image.copy(), 'noise': image * 1e3}}
+        dtype_policy = {'data.image': 'uint8:0.01', 'data.mask': 'float16', 'data.noise': 'uint8:0.01'}
+
+        serializer = FuseSampleSerializer('none', dtype_policy=dtype_policy)
+        data = serializer.serialize(sample)
+        self.assertLess(len(data), len(FuseSampleSerializer('none').serialize(sample)))
+        for cache_cls in [FuseCacheShards, FuseCacheMmap]:
+            cache = cache_cls(os.path.join(self.tmp_dir, f'dtype_{cache_cls.__name__}'), reset_cache=True, dtype_policy=dtype_policy)
+            cache.start_caching(None)
+            cache['sample'] = sample
+            cache.save()
+
+        for restored in [serializer.deserialize(data), cache['sample']]:
+            # up converted to the original dtype, within the error bound
+            self.assertEqual(restored['data']['image'].dtype, torch.float32)
+            self.assertLessEqual(np.abs(restored['data']['image'].numpy() - image).max(), 0.01)
+            self.assertEqual(restored['data']['mask'].dtype, np.float32)
+            self.assertLessEqual(np.abs(restored['data']['mask'] - image).max(), 1e-3)
+            # not matched or error bound exceeded - full precision
+            self.assertTrue(np.array_equal(restored['data']['other'], image))
+            self.assertTrue(np.array_equal(restored['data']['noise'], image * 1e3))
+
+        # out of the float16 range - full precision, even without an error bound
+        large = image * 1e6
+        serializer = FuseSampleSerializer('none', dtype_policy={'data.large': 'float16'})
+        restored = serializer.deserialize(serializer.serialize({'data': {'large': large}}))
+        self.assertTrue(np.array_equal(restored['data']['large'], large))
+
+    def test_cache_index_journal(self):
+        for cache_cls in [FuseCacheFiles, FuseCacheShards]:
+            cache_dir = os.path.join(self.tmp_dir, cache_cls.__name__)
+            cache = cache_cls(cache_dir, reset_cache=True)
+            cache.start_caching(None)
+            for index in range(5):
+                cache[f'sample_{index}'] = create_sample(index)
+            # no save() - simulate a crash, including a partially written journal record
+            with open(os.path.join(cache_dir, 'cache_index.pkl.journal'), 'ab') as journal_file:
+                journal_file.write(b'\x10\x00\x00')
+
+            cache = cache_cls(cache_dir, reset_cache=False)
+            self.assertEqual(sorted(cache.get_all_keys()), [f'sample_{index}' for index in range(5)])
+            cache.start_caching(None)
+            cache['sample_5'] = create_sample(5)
+            cache.save()
+            self.assertFalse(os.path.exists(os.path.join(cache_dir, 'cache_index.pkl.journal')))
+
+            cache = cache_cls(cache_dir, reset_cache=False)
+            for index in range(6):
+                self.check_sample(cache[f'sample_{index}'], index)
+
+    def test_cache_files_quota(self):
+        cache_dir = os.path.join(self.tmp_dir, 'quota')
+        cache = FuseCacheFiles(cache_dir, reset_cache=True, eviction_policy='lrc')
+        cache.start_caching(None)
+        for index in range(10):
+            cache[f'sample_{index}'] = create_sample(index)
+        cache.save()
+        entries = cache.get_entries()
+        sample_size = max(entry[2] for entry in entries)
+
+        # least recently created are evicted first
+        num_bytes_freed = cache.evict(max_bytes=sample_size * 6)
+        self.assertGreater(num_bytes_freed, 0)
+        self.assertEqual(sorted(cache.get_all_keys()), [f'sample_{index}' for index in range(4, 10)])
+        # deletions are recorded in the journal
+        cache = FuseCacheFiles(cache_dir, reset_cache=False)
+        self.assertEqual(len(cache.get_all_keys()), 6)
+
+        # least recently used - sample_4 was just read
+        self.check_sample(cache['sample_4'], 4)
+        os.utime(os.path.join(cache_dir, cache._cache_index['sample_5']), (0, 0))
+        cache.evict(max_bytes=sample_size * 5)
+        self.assertNotIn('sample_5', cache)
+        self.assertIn('sample_4', cache)
+
+        # evicted by another process (stale index) - KeyError
+        other_cache = FuseCacheFiles(cache_dir, reset_cache=False)
+        cache.evict(max_bytes=0)
+        self.assertRaises(KeyError, lambda: other_cache['sample_4'])
+
+        # quota enforced while writing
+        cache = FuseCacheFiles(os.path.join(self.tmp_dir, 'quota_write'), reset_cache=True, max_bytes=sample_size * 3)
+        cache.start_caching(None)
+        for index in range(10):
+            cache[f'sample_{index}'] = create_sample(index)
+        cache.save()
+        self.assertLessEqual(sum(entry[2] for entry in cache.get_entries()), sample_size * 3)
+        self.assertEqual(len(cache.get_all_keys()), len(cache.get_entries()))
+
+        # cache dir without index (e.g. creation interrupted) - skipped and not modified
+        no_index_dir = os.path.join(self.tmp_dir, 'no_index')
+        os.makedirs(no_index_dir)
+        with open(os.path.join(no_index_dir, 'cache_properties.pkl'), 'wb') as cache_prop_file:
+            pickle.dump({'single_file': False}, cache_prop_file)
+        self.assertRaises(Exception, open_cache, no_index_dir)
+
+        # global quota - CLI
+        self.assertEqual(len(inspect_caches([self.tmp_dir])), 2)
+        trim_caches([self.tmp_dir], max_bytes=0)
+        self.assertEqual(len(FuseCacheFiles(os.path.join(self.tmp_dir, 'quota_write'), reset_cache=False).get_all_keys()), 0)
+        self.assertEqual(os.listdir(no_index_dir), ['cache_properties.pkl'])
+
+    def test_cache_files_dedup(self):
+        reference = torch.arange(4096, dtype=torch.float32)
+        cache_dir = os.path.join(self.tmp_dir, 'dedup')
+        cache = FuseCacheFiles(cache_dir, reset_cache=True, dedup_min_size=1024)
+        cache.start_caching(None)
+        for index in range(5):
+            sample = create_sample(index)
+            sample['data']['reference'] = reference.clone()
+            cache[f'sample_{index}'] = sample
+        cache.save()
+        # a single copy of the reference, the rest is too small to be shared
+        blob_entries = [entry for entry in cache.get_entries() if entry[0] is None]
+        self.assertEqual(len(blob_entries), 1)
+
+        # the deduplication setting is saved in the cache properties
+        for cache in [FuseCacheFiles(cache_dir, reset_cache=False), open_cache(cache_dir)]:
+            self.assertTrue(cache.is_deduplicated())
+            samples = [cache[f'sample_{index}'] for index in range(5)]
+            for index, sample in enumerate(samples):
+                self.check_sample(sample, index)
+                self.assertTrue(torch.equal(sample['data']['reference'], reference))
+            # each sample gets its own copy of the reference
+            samples[0]['data']['reference'] += 1
+            self.assertTrue(torch.equal(cache['sample_4']['data']['reference'], reference))
+            self.assertTrue(torch.equal(cache['sample_0']['data']['reference'], reference))
+
+        # tools - blob files are restored, counted and trimmed
+        migrate_cache_files_to_shards(cache_dir, os.path.join(self.tmp_dir, 'dedup_shards'))
+        sample = FuseCacheShards(os.path.join(self.tmp_dir, 'dedup_shards'), reset_cache=False)['sample_3']
+        self.check_sample(sample, 3)
+        self.assertTrue(torch.equal(sample['data']['reference'], reference))
+        self.assertEqual(inspect_caches([cache_dir])['shared blobs'][0], 1)
+
+        # shared blob evicted - the samples referring to it are evicted on read
+        cache.remove_entry(*blob_entries[0][:2])
+        self.assertRaises(KeyError, lambda: FuseCacheFiles(cache_dir, reset_cache=False)['sample_1'])
+        trim_caches([cache_dir], max_bytes=0)
+        self.assertEqual(FuseCacheFiles(cache_dir, reset_cache=False).get_entries(), [])
+
+    def test_dataset_cache_quota(self):
+        descriptors = create_descriptors(10)
+        cache_dest = os.path.join(self.tmp_dir, 'dataset_quota')
+        FuseProcessorCountTest.num_calls = 0
+        dataset = create_dataset(descriptors, FuseProcessorCountTest(0), cache_dest=cache_dest, cache_type='files')
+        dataset.create(num_workers=0)
+        self.assertEqual(FuseProcessorCountTest.num_calls, 10)
+
+        # evicted samples are recomputed
+        trim_caches([cache_dest], max_bytes=0)
+        for index in range(10):
+            self.assertEqual(dataset[index]['data']['value'], int(dataset.samples_description[index].split('_')[1]))
+        self.assertEqual(FuseProcessorCountTest.num_calls, 20)
+
+    def test_migrate_files_to_shards(self):
+        src_dir = os.path.join(self.tmp_dir, 'files')
+        dst_dir = os.path.join(self.tmp_dir, 'shards')
+        cache = FuseCacheFiles(src_dir, reset_cache=True)
+        cache.start_caching(None)
+        for index in range(5):
+            cache[f'sample_{index}'] = create_sample(index)
+        cache.save()
+
+        migrate_cache_files_to_shards(src_dir, dst_dir)
+
+        cache = FuseCacheShards(dst_dir, reset_cache=False)
+        self.assertEqual(sorted(cache.get_all_keys()), sorted([f'sample_{index}' for index in range(5)]))
+        for index in range(5):
+            self.check_sample(cache[f'sample_{index}'], index)
+
+    def test_dataset_cache_type(self):
+        descriptors = create_descriptors(20)
+        for cache_type, num_workers in [('files', 2), ('shards', 0), ('shards', 2), ('mmap', 2), ('memory', 2), ('shared_memory', 2)]:
+            cache_dest = 'memory' if cache_type in ['memory', 'shared_memory'] else os.path.join(self.tmp_dir, f'dataset_{cache_type}_{num_workers}')
+            dataset = create_dataset(descriptors, FuseProcessorTest(), cache_dest=cache_dest, cache_type=cache_type)
+            dataset.create(num_workers=num_workers)
+            self.assertEqual(len(dataset), 20)
+            for index in range(len(dataset)):
+                sample = dataset[index]
+                self.check_sample(sample, int(sample['data']['descriptor'].split('_')[1]))
+
+    def test_dataset_lazy_cache(self):
+        descriptors = create_descriptors(20)
+        cache_dest = os.path.join(self.tmp_dir, 'dataset_lazy')
+        FuseProcessorCountTest.num_calls = 0
+        dataset = create_dataset(descriptors, FuseProcessorCountTest(0), cache_dest=cache_dest, cache_type='shards')
+        dataset.create(lazy_cache=True)
+        self.assertEqual(len(dataset), 20)
+        self.assertEqual(FuseProcessorCountTest.num_calls, 0)
+
+        # first epoch computes the samples, using DataLoader workers
+        data_loader = DataLoader(dataset, batch_size=4, num_workers=2, collate_fn=dataset.collate_fn)
+        values = sorted(value for batch in data_loader for value in batch['data']['value'])
+        self.assertEqual(values, list(range(20)))
+        for index in range(20):
+            self.assertEqual(dataset[index]['data']['value'], int(dataset.samples_description[index].split('_')[1]))
+        dataset.flush_cache()
+        self.assertEqual(FuseProcessorCountTest.num_calls, 0)
+        self.assertFalse(dataset.cache.is_compacted())
+
+        # the journal fragments written by the previous run are merged
+        dataset = create_dataset(descriptors, FuseProcessorCountTest(0), cache_dest=cache_dest, cache_type='shards')
+        dataset.create(lazy_cache=True)
+        self.assertTrue(dataset.cache.is_compacted())
+        self.assertEqual(len(dataset.cache.get_all_keys()), 20)
+
+        # all the samples are cached
+        dataset = create_dataset(descriptors, FuseProcessorCountTest(0), cache_dest=cache_dest, cache_type='shards')
+        dataset.create(num_workers=0)
+        self.assertEqual(FuseProcessorCountTest.num_calls, 0)
+        self.assertEqual(len(dataset), 20)
+
+        # a sample that failed to load is replaced by the next sample, and dropped by the next create()
+        cache_dest = os.path.join(self.tmp_dir, 'dataset_lazy_invalid')
+        for lazy_cache in [True, False]:
+            dataset = create_dataset(descriptors[5:10], FuseProcessorBatchTest(), cache_dest=cache_dest, cache_type='shards')
+            dataset.create(num_workers=0, lazy_cache=lazy_cache)
+            if lazy_cache:
+                self.assertEqual(len(dataset), 5)
+                self.assertEqual([dataset[index]['data']['descriptor'] for index in range(5)],
+                                 ['sample_5', 'sample_6', 'sample_8', 'sample_8', 'sample_9'])
+                dataset.flush_cache()
+        self.assertEqual(dataset.samples_description, ['sample_5', 'sample_6', 'sample_8', 'sample_9'])
+
+    def test_dataset_generator_cache(self):
+        descriptors = [f'volume_{index}' for index in range(4)]
+        for cache_dest, cache_type in [('generator', 'shards'), ('memory', 'files')]:
+            for num_workers in [0, 2]:
+                if cache_dest != 'memory':
+                    cache_dest = os.path.join(self.tmp_dir, f'generator_{num_workers}')
+                dataset = FuseDatasetGenerator(data_source=FuseDataSourceFromList(descriptors), processor=FuseProcessorPatchesTest(50),
+                                               cache_dest=cache_dest, cache_type=cache_type)
+                dataset.create(num_workers=num_workers)
+                # volume_0 has no patches
+                self.assertEqual(len(dataset), 150)
+                values = sorted(dataset[index]['data']['value'] for index in range(len(dataset)))
+                self.assertEqual(values, sorted(index * 1000 + patch_index for index in range(1, 4) for patch_index in range(50)))
+
+        # a subset partially cached (first sample missing) is generated again
+        cache_dest = os.path.join(self.tmp_dir, 'generator_partial')
+        cache = FuseCacheShards(cache_dest, reset_cache=True)
+        cache.start_caching()
+        cache[('volume_1', 3)] = {'data': {'value': -1, 'descriptor': ('volume_1', 3)}}
+        cache[('volume_1', 7)] = {'data': {'value': -1, 'descriptor': ('volume_1', 7)}}
+        cache.save()
+        dataset = FuseDatasetGenerator(data_source=FuseDataSourceFromList(descriptors), processor=FuseProcessorPatchesTest(5),
+                                       cache_dest=cache_dest, cache_type='shards')
+        dataset.create(num_workers=0)
+        self.assertEqual(len(dataset), 15)
+        self.assertEqual(dataset.get(('volume_1', 3))['data']['value'], 1003)
+        # samples of the partial subset not generated again are removed
+        self.assertNotIn(('volume_1', 7), dataset.samples_description)
+
+        # a subset not completely cached is not listed
+        cache = FuseCacheShards(cache_dest, reset_cache=False)
+        cache.start_caching()
+        cache[('volume_4', 1)] = {'data': {'value': -1, 'descriptor': ('volume_4', 1)}}
+        cache.save()
+        dataset = FuseDatasetGenerator(data_source=FuseDataSourceFromList(descriptors + ['volume_4']), processor=FuseProcessorPatchesTest(5),
+                                       cache_dest=cache_dest, cache_type='shards')
+        dataset.create(num_workers=0)
+        self.assertEqual(len(dataset), 20)
+        self.assertEqual(dataset.get(('volume_4', 1))['data']['value'], 4001)
+
+    def test_dataset_cache_sample_fields(self):
+        descriptors = create_descriptors(20)
+        cache_dest = os.path.join(self.tmp_dir, 'dataset_fields')
+        for num_workers in [0, 2]:
+            dataset = create_dataset(descriptors, FuseProcessorTest(), cache_dest=cache_dest, cache_type='shards')
+            dataset.create(num_workers=num_workers)
+            dataset.cache_sample_fields(['data.label', 'data.descriptor'], num_workers=num_workers)
+
+            labels = dataset.get(None, 'data.label', use_cache=True)
+            self.assertIsInstance(labels, np.ndarray)
+            self.assertEqual(labels.tolist(), [int(desc.split('_')[1]) % 3 for desc in dataset.samples_description])
+            self.assertEqual(dataset.get(None, 'data.descriptor', use_cache=True), dataset.samples_description)
+            self.assertEqual(dataset.get(5, 'data.label', use_cache=True), labels[5])
+
+            # subset of the samples, in a different order
+            dataset.samples_description = dataset.samples_description[::-2]
+            labels = dataset.get(None, 'data.label', use_cache=True)
+            self.assertEqual(labels.tolist(), [int(desc.split('_')[1]) % 3 for desc in dataset.samples_description])
+
+        # fields cache dir created by previous versions - converted
+        legacy_cache_dest = os.path.join(self.tmp_dir, 'dataset_fields_legacy')
+        create_dataset(descriptors, FuseProcessorTest(), cache_dest=legacy_cache_dest, cache_type='shards').create(num_workers=0)
+        legacy_cache = FuseCacheFiles(os.path.join(legacy_cache_dest, 'fields'), reset_cache=True, single_file=True)
+        legacy_cache.start_caching(None)
+        for desc in descriptors:
+            legacy_cache[(desc, 'data.label')] = int(desc.split('_')[1]) % 3
+        legacy_cache.save()
+        dataset = create_dataset(descriptors, FuseProcessorCountTest(0), cache_dest=legacy_cache_dest, cache_type='shards')
+        dataset.create(num_workers=0)
+        FuseProcessorCountTest.num_calls = 0
+        dataset.cache_sample_fields(['data.label'], num_workers=0)
+        labels = dataset.get(None, 'data.label', use_cache=True)
+        self.assertEqual(labels.tolist(), [int(desc.split('_')[1]) % 3 for desc in dataset.samples_description])
+        self.assertTrue(os.path.exists(os.path.join(legacy_cache_dest, 'fields', 'columns_index.pkl')))
+        self.assertEqual(FuseProcessorCountTest.num_calls, 0)
+
+    def test_dataset_cache_by_processor(self):
+        descriptors = create_descriptors(10)
+        cache_dest = os.path.join(self.tmp_dir, 'by_processor')
+
+        def open_dataset(gt_offset: int) -> FuseDatasetDefault:
+            FuseProcessorCountTest.num_calls = 0
+            dataset = FuseDatasetDefault(data_source=FuseDataSourceFromList(descriptors),
+                                         input_processors={'image': FuseProcessorCountTest(0)},
+                                         gt_processors={'label': FuseProcessorCountTest(gt_offset)},
+                                         cache_dest=cache_dest, cache_type='shards', cache_by_processor=True)
+            dataset.create(num_workers=0)
+            return dataset
+
+        dataset = open_dataset(gt_offset=100)
+        self.assertEqual(FuseProcessorCountTest.num_calls, 20)
+
+        # no change - nothing to recompute
+        dataset = open_dataset(gt_offset=100)
+        self.assertEqual(FuseProcessorCountTest.num_calls, 0)
+        self.assertEqual(dataset[3]['data']['gt']['label']['value'], 103)
+
+        # only the changed processor is recomputed
+        dataset = open_dataset(gt_offset=200)
+        self.assertEqual(FuseProcessorCountTest.num_calls, 10)
+        self.assertEqual(len(dataset), 10)
+        sample = dataset[3]
+        self.assertEqual(FuseProcessorCountTest.num_calls, 10)
+        self.assertEqual(sample['data']['descriptor'], 'sample_3')
+        self.assertEqual(sample['data']['input']['image']['value'], 3)
+        self.assertEqual(sample['data']['gt']['label']['value'], 203)
+
+
+if __name__ == '__main__':
+    unittest.main()
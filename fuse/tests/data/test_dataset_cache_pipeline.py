@@ -0,0 +1,62 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+import os
+import unittest
+
+from fuse.data.cache.cache_pipeline import FuseCachePipeline
+from fuse.tests.data.data_test_utils import FuseDataTestCaseBase, FuseProcessorLoadTest, create_dataset, create_descriptors
+
+
+class FuseDatasetCachePipelineTestCase(FuseDataTestCaseBase):
+    def test_dataset_cache_pipeline(self):
+        descriptors = create_descriptors(20)
+        for num_workers in [0, 2]:
+            dataset = create_dataset(descriptors, FuseProcessorLoadTest(), cache_dest=os.path.join(self.tmp_dir, f'pipeline_{num_workers}'),
+                                     cache_type='shards', processor_batch_size=3)
+            dataset.create(num_workers=num_workers, io_threads=2)
+            self.assertEqual(len(dataset), 20)
+            for index in range(len(dataset)):
+                sample = dataset[index]
+                self.check_sample(sample, int(dataset.samples_description[index].split('_')[1]))
+                self.assertEqual(sample['data']['loaded_by'], os.getpid())
+
+        # statistics per stage
+        written = []
+        pipeline = FuseCachePipeline(load_func=lambda task: task * 2, transform_func=lambda loaded: loaded + 1, write_func=written.append,
+                                     io_threads=3, cpu_workers=0, queue_size=2)
+        stats = pipeline.run(range(10), progress=False)
+        self.assertEqual(sorted(written), [task * 2 + 1 for task in range(10)])
+        for stage in FuseCachePipeline.STAGES:
+            self.assertEqual(stats[stage]['count'], 10)
+            self.assertGreater(stats[stage]['throughput'], 0)
+
+        # a failure of any stage is raised
+        def failing_transform(loaded):
+            if loaded == 8:
+                raise ValueError('failed')
+            return loaded
+
+        pipeline = FuseCachePipeline(load_func=lambda task: task * 2, transform_func=failing_transform, write_func=written.append,
+                                     io_threads=2, cpu_workers=0, queue_size=1)
+        self.assertRaises(ValueError, pipeline.run, range(10), False)
+
+
+if __name__ == '__main__':
+    unittest.main()
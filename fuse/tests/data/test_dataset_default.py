@@ -0,0 +1,140 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+import os
+import pickle
+import unittest
+
+from torch.utils.data import DataLoader
+
+from fuse.data.augmentor.augmentor_default import FuseAugmentorDefault
+from fuse.data.data_source.data_source_from_list import FuseDataSourceFromList
+from fuse.data.dataset.dataset_default import FuseDatasetDefault
+from fuse.tests.data.data_test_utils import FuseDataTestCaseBase, FuseProcessorBatchTest, FuseProcessorTest, create_dataset, \
+    create_descriptors
+
+
+class FuseDatasetDefaultTestCase(FuseDataTestCaseBase):
+    def test_dataset_getitems(self):
+        def add_op(aug_input, add: float):
+            return aug_input + add
+
+        def batch_add_op(aug_input, add: float):
+            return [value + add for value in aug_input]
+
+        descriptors = create_descriptors(20)
+        augmentor = FuseAugmentorDefault([(('data.label',), add_op, {'add': 1000}, {}),
+                                          (('data.label',), batch_add_op, {'add': 100}, {'batch': True})])
+        dataset = create_dataset(descriptors, FuseProcessorTest(), cache_dest=os.path.join(self.tmp_dir, 'dataset_getitems'),
+                                 cache_type='shards', augmentor=augmentor, filter_keys=['data.mask'])
+        dataset.create(num_workers=0)
+
+        # same as getitem(), including repeated and uncached indices
+        indices = [3, 1, 3, 19, 0]
+        del dataset.cache._cache_index[dataset.samples_description[19]]
+        samples = dataset.getitems(indices)
+        for index, sample in zip(indices, samples):
+            self.assertEqual(sample['data']['label'], dataset.getitem(index)['data']['label'])
+            self.assertEqual(sample['data']['label'], int(dataset.samples_description[index].split('_')[1]) % 3 + 1100)
+            self.assertNotIn('mask', sample['data'])
+        self.assertIsNot(samples[0], samples[2])
+
+        # bulk read of the cache
+        samples_desc = dataset.samples_description[:10]
+        values = dataset.cache.get_many(samples_desc + ['missing'])
+        self.assertEqual(list(sorted(values.keys())), sorted(samples_desc))
+        for desc, value in values.items():
+            self.check_sample(value, int(desc.split('_')[1]))
+
+        # DataLoader uses __getitems__
+        data_loader = DataLoader(dataset, batch_size=4, num_workers=0, collate_fn=dataset.collate_fn)
+        labels = [int(label) for batch in data_loader for label in batch['data']['label']]
+        self.assertEqual(sorted(labels), sorted(index % 3 + 1100 for index in range(20)))
+
+    def test_dataset_descriptor_index(self):
+        descriptors = create_descriptors(20)
+        dataset = create_dataset(descriptors, FuseProcessorTest(), cache_dest=os.path.join(self.tmp_dir, 'descriptor_index'),
+                                 cache_type='shards')
+        dataset.create(num_workers=0)
+        self.assertEqual(dataset.get_sample_index('sample_12'), dataset.samples_description.index('sample_12'))
+        self.assertEqual(dataset.get('sample_12', 'data.label'), 0)
+
+        # kept consistent by filter()
+        dataset.filter('data.label', [0])
+        self.assertNotIn('sample_12', dataset.sample_descriptor_to_index)
+        self.assertRaises(ValueError, dataset.get_sample_index, 'sample_12')
+        for index, desc in enumerate(dataset.samples_description):
+            self.assertEqual(dataset.get_sample_index(desc), index)
+
+        # and by assignment
+        dataset.samples_description = ['sample_5', 'sample_1']
+        self.assertEqual(dataset.get_sample_index('sample_1'), 1)
+        self.assertEqual(dataset.get('sample_1', 'data.descriptor'), 'sample_1')
+
+        # and by in-place modifications, including those that keep the length
+        dataset.samples_description[0] = 'sample_7'
+        self.assertEqual(dataset.get_sample_index('sample_7'), 0)
+        self.assertRaises(ValueError, dataset.get_sample_index, 'sample_5')
+        dataset.samples_description.reverse()
+        self.assertEqual(dataset.get_sample_index('sample_7'), 1)
+        self.assertEqual(pickle.loads(pickle.dumps(dataset)).get_sample_index('sample_7'), 1)
+
+        # set explicitly
+        dataset.sample_descriptor_to_index = {'sample_1': 0, 'sample_7': 1}
+        self.assertEqual(dataset.get_sample_index('sample_7'), 1)
+
+    def test_dataset_process_batch(self):
+        descriptors = create_descriptors(20)
+        dataset = create_dataset(descriptors, FuseProcessorBatchTest(), cache_dest=os.path.join(self.tmp_dir, 'process_batch'),
+                                 cache_type='shards', processor_batch_size=8)
+        FuseProcessorBatchTest.batch_sizes = []
+        dataset.create(num_workers=0)
+        self.assertEqual(sorted(FuseProcessorBatchTest.batch_sizes), [4, 8, 8])
+        # failed sample skipped
+        self.assertEqual(len(dataset), 19)
+        self.assertNotIn('sample_7', dataset.samples_description)
+        for index in range(len(dataset)):
+            self.check_sample(dataset[index], int(dataset.samples_description[index].split('_')[1]))
+
+        FuseProcessorBatchTest.batch_sizes = []
+        dataset.cache_sample_fields(['data.label'], num_workers=0, cache_dest='memory')
+        self.assertEqual(FuseProcessorBatchTest.batch_sizes, [])
+
+        # not cached - processed per batch
+        dataset = create_dataset(descriptors[:6], FuseProcessorBatchTest())
+        dataset.create()
+        FuseProcessorBatchTest.batch_sizes = []
+        samples = dataset.getitems([4, 1, 4])
+        self.assertEqual(FuseProcessorBatchTest.batch_sizes, [3])
+        self.assertEqual([sample['data']['descriptor'] for sample in samples], ['sample_4', 'sample_1', 'sample_4'])
+        self.assertIsNot(samples[0], samples[2])
+        labels = dataset.get(None, 'data.label')
+        self.assertEqual(FuseProcessorBatchTest.batch_sizes, [3, 6])
+        self.assertEqual(labels, [index % 3 for index in range(6)])
+
+        # multiple processors - a sample that failed is not processed by the next processors
+        dataset = FuseDatasetDefault(data_source=FuseDataSourceFromList(descriptors[5:10]),
+                                     input_processors={'image': FuseProcessorBatchTest()}, gt_processors={'label': FuseProcessorBatchTest()})
+        samples = FuseDatasetDefault.getitems_without_augmentation_static(dataset.processors, descriptors[5:10], 'data')
+        self.assertEqual([sample is None for sample in samples], [False, False, True, False, False])
+        self.assertEqual(samples[0]['data']['gt']['label']['descriptor'], 'sample_5')
+
+
+if __name__ == '__main__':
+    unittest.main()
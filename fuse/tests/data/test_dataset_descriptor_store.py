@@ -0,0 +1,86 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+import os
+import pickle
+import unittest
+
+import numpy as np
+from torch.utils.data import DataLoader
+
+from fuse.data.dataset.dataset_descriptor_store import FuseDescriptorStore
+from fuse.data.dataset.dataset_filter import FuseFilterIsIn
+from fuse.tests.data.data_test_utils import FuseDataTestCaseBase, FuseProcessorTest, FuseProcessorIndexTest, create_dataset, create_descriptors
+
+
+class FuseDescriptorStoreTestCase(FuseDataTestCaseBase):
+    def test_descriptor_store(self):
+        descriptors = [(f'patient_{index % 7}', index) for index in range(1000)] + [('patient_0', 0)]
+        store = FuseDescriptorStore(descriptors)
+        self.assertEqual(store, descriptors)
+        self.assertLess(store.nbytes(), len(pickle.dumps(descriptors)))
+        self.assertEqual(store.index(('patient_3', 10)), 10)
+        self.assertEqual(store.index(('patient_0', 0)), 0)
+        self.assertIn(('patient_6', 13), store)
+        self.assertNotIn(('patient_6', 14), store)
+        self.assertNotIn(('patient_9', 2), store)
+        self.assertNotIn('patient_6', store)
+        self.assertEqual(store[-1], ('patient_0', 0))
+        self.assertEqual(store[5:20:5], descriptors[5:20:5])
+        self.assertEqual(store[[3, 1]].index(('patient_1', 1)), 1)
+        self.assertEqual(pickle.loads(pickle.dumps(store)), descriptors)
+        self.assertFalse(FuseDescriptorStore.is_supported([{'id': 1}]))
+        self.assertRaises(ValueError, FuseDescriptorStore, ['sample_1', 2])
+        self.assertFalse(FuseDescriptorStore.is_supported([1, 2 ** 63]))
+        self.assertFalse(FuseDescriptorStore.is_supported([('a', np.uint64(2 ** 63))]))
+
+        # dataset
+        descriptors = create_descriptors(20)
+        dataset = create_dataset(descriptors, FuseProcessorTest(), cache_dest=os.path.join(self.tmp_dir, 'descriptor_store'),
+                                 cache_type='shards', compact_descriptors=True)
+        dataset.create(num_workers=0)
+        self.assertIsInstance(dataset.samples_description, FuseDescriptorStore)
+        self.assertEqual(dataset.get_sample_index('sample_12'), dataset.samples_description.index('sample_12'))
+        self.assertRaises(ValueError, dataset.get_sample_index, 'sample_20')
+        self.check_sample(dataset[dataset.get_sample_index('sample_12')], 12)
+        dataloader = DataLoader(dataset, batch_size=5, num_workers=2, collate_fn=dataset.collate_fn)
+        self.assertEqual(sum(len(batch['data']['descriptor']) for batch in dataloader), 20)
+
+        view = dataset.filter(FuseFilterIsIn('data.label', [1]))
+        self.assertIsInstance(view.samples_description, FuseDescriptorStore)
+        self.assertEqual(view.get('sample_4', 'data.descriptor'), 'sample_4')
+        dataset.filter('data.label', [0])
+        self.assertIsInstance(dataset.samples_description, FuseDescriptorStore)
+        self.assertRaises(ValueError, dataset.get_sample_index, 'sample_12')
+        for index, desc in enumerate(dataset.samples_description):
+            self.assertEqual(dataset.get_sample_index(desc), index)
+
+        # numpy and python int descriptors - all the samples are read from the shared memory cache
+        descriptors = [np.int64(index) if index % 2 else index for index in range(10)]
+        dataset = create_dataset(descriptors, FuseProcessorIndexTest(), cache_dest='memory', cache_type='shared_memory',
+                                 compact_descriptors=True)
+        dataset.create(num_workers=0)
+        for index in range(10):
+            self.check_sample(dataset[index], index)
+        stats = dataset.cache.get_stats()
+        self.assertEqual((stats['hits'], stats['misses']), (10, 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,66 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+import os
+import unittest
+
+import numpy as np
+from torch.utils.data import DataLoader
+
+from fuse.data.dataset.dataset_filter import FuseFilterIsIn, FuseFilterRange, FuseFilterFunc
+from fuse.tests.data.data_test_utils import FuseDataTestCaseBase, FuseProcessorTest, create_dataset, create_descriptors
+
+
+class FuseDatasetFilterTestCase(FuseDataTestCaseBase):
+    def test_dataset_filter_view(self):
+        descriptors = create_descriptors(20)
+        dataset = create_dataset(descriptors, FuseProcessorTest(), cache_dest=os.path.join(self.tmp_dir, 'filter_view'), cache_type='shards')
+        dataset.create(num_workers=0)
+        dataset.cache_sample_fields(['data.label', 'data.descriptor'], num_workers=0)
+
+        def get_index(desc: str) -> int:
+            return int(desc.split('_')[1])
+
+        # composed filters - a view, the dataset is not modified
+        view = dataset.filter(FuseFilterIsIn('data.label', [0, 2]) & ~FuseFilterRange('data.label', min_value=2))
+        self.assertEqual(len(dataset), 20)
+        self.assertEqual(sorted(view.samples_description), sorted(desc for desc in descriptors if get_index(desc) % 3 == 0))
+        for index in range(len(view)):
+            self.assertEqual(view[index]['data']['label'], 0)
+            self.assertEqual(view[index]['data']['descriptor'], view.samples_description[index])
+        self.assertEqual(view.get_column('data.label').tolist(), [0] * len(view))
+
+        # filter a view
+        even = view.filter(FuseFilterFunc('data.descriptor', lambda column: np.array([get_index(desc) % 2 == 0 for desc in column])))
+        self.assertEqual(sorted(even.samples_description), sorted(desc for desc in descriptors if get_index(desc) % 6 == 0))
+        self.assertEqual(even.get('sample_6', 'data.label'), 0)
+        data_loader = DataLoader(even, batch_size=2, num_workers=0, collate_fn=even.collate_fn)
+        self.assertEqual(sorted(desc for batch in data_loader for desc in batch['data']['descriptor']), sorted(even.samples_description))
+
+        # or
+        view = dataset.filter(FuseFilterIsIn('data.descriptor', ['sample_1']) | FuseFilterRange('data.label', max_value=2, include_max=True))
+        self.assertEqual(len(view), 20)
+
+        # backward compatible - remove the samples with the given values, in place
+        self.assertIsNone(dataset.filter('data.label', [1, 2]))
+        self.assertEqual(sorted(dataset.samples_description), sorted(desc for desc in descriptors if get_index(desc) % 3 == 0))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+import unittest
+
+from torch.utils.data import DataLoader
+
+from fuse.data.augmentor.augmentor_default import FuseAugmentorDefault
+from fuse.data.data_source.data_source_from_list import FuseDataSourceFromList
+from fuse.data.dataset.dataset_iterable import FuseDatasetIterable
+from fuse.tests.data.data_test_utils import FuseDataTestCaseBase, FuseProcessorTest, create_descriptors
+
+
+class FuseDatasetIterableTestCase(FuseDataTestCaseBase):
+    def test_dataset_iterable(self):
+        def add_op(aug_input, add: float):
+            return aug_input + add
+
+        descriptors = create_descriptors(20)
+        augmentor = FuseAugmentorDefault([(('data.label',), add_op, {'add': 100}, {})])
+        dataset = FuseDatasetIterable(data_source=FuseDataSourceFromList(descriptors),
+                                      input_processors=None, gt_processors=None, processors=FuseProcessorTest(),
+                                      augmentor=augmentor, filter_keys=['data.mask'], num_samples=20)
+        dataset.create()
+
+        # sharded across the workers - each sample exactly once
+        data_loader = DataLoader(dataset, batch_size=3, num_workers=2, collate_fn=dataset.collate_fn)
+        self.assertEqual(len(data_loader), 7)
+        batches = list(data_loader)
+        seen = sorted(desc for batch in batches for desc in batch['data']['descriptor'])
+        self.assertEqual(seen, sorted(descriptors))
+        for batch in batches:
+            self.assertNotIn('mask', batch['data'])
+            for desc, label in zip(batch['data']['descriptor'], batch['data']['label']):
+                self.assertEqual(int(label), int(desc.split('_')[1]) % 3 + 100)
+
+        # and across the ranks
+        seen = []
+        for rank in range(3):
+            dataset_rank = FuseDatasetIterable(data_source=descriptors, input_processors=None, gt_processors=None,
+                                               processors=FuseProcessorTest(), rank=rank, world_size=3)
+            seen += [sample['data']['descriptor'] for sample in dataset_rank]
+        self.assertEqual(sorted(seen), sorted(descriptors))
+
+        # shuffle buffer - a permutation, reproducible per epoch
+        dataset = FuseDatasetIterable(data_source=descriptors, input_processors=None, gt_processors=None,
+                                      processors=FuseProcessorTest(), shuffle_buffer_size=8, seed=1)
+        epoch_0 = [sample['data']['descriptor'] for sample in dataset]
+        self.assertEqual(sorted(epoch_0), sorted(descriptors))
+        self.assertNotEqual(epoch_0, descriptors)
+        self.assertEqual([sample['data']['descriptor'] for sample in dataset], epoch_0)
+        dataset.set_epoch(1)
+        self.assertNotEqual([sample['data']['descriptor'] for sample in dataset], epoch_0)
+
+        self.assertRaises(TypeError, len, dataset)
+        self.assertRaises(Exception, dataset.get, 0, None)
+
+
+if __name__ == '__main__':
+    unittest.main()
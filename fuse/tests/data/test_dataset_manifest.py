@@ -0,0 +1,80 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+import os
+import pickle
+import unittest
+
+from fuse.data.data_source.data_source_from_list import FuseDataSourceFromList
+from fuse.data.dataset.dataset_default import FuseDatasetDefault
+from fuse.data.dataset.dataset_manifest import FuseDatasetManifest
+from fuse.tests.data.data_test_utils import FuseDataTestCaseBase, FuseProcessorCountTest, create_descriptors
+
+
+class FuseDatasetManifestTestCase(FuseDataTestCaseBase):
+    def test_dataset_manifest(self):
+        class FuseDataSourceCountTest(FuseDataSourceFromList):
+            num_calls = 0
+
+            def get_samples_description(self):
+                FuseDataSourceCountTest.num_calls += 1
+                return super().get_samples_description()
+
+        descriptors = create_descriptors(20)
+        cache_dest = os.path.join(self.tmp_dir, 'manifest')
+
+        def open_dataset(use_manifest: bool, gt_offset: int = 0) -> FuseDatasetDefault:
+            dataset = FuseDatasetDefault(data_source=FuseDataSourceCountTest(descriptors),
+                                         input_processors={'image': FuseProcessorCountTest(0)},
+                                         gt_processors={'label': FuseProcessorCountTest(gt_offset)},
+                                         cache_dest=cache_dest, cache_type='shards', cache_by_processor=True)
+            dataset.create(num_workers=0, use_manifest=use_manifest)
+            return dataset
+
+        # written when cached
+        dataset = open_dataset(use_manifest=True)
+        self.assertEqual(FuseDataSourceCountTest.num_calls, 1)
+        manifest = FuseDatasetManifest.load(os.path.join(cache_dest, FuseDatasetManifest.FILE_NAME))
+        self.assertEqual(manifest.get_samples_description(), dataset.samples_description)
+        self.assertEqual(manifest.fields, ['data.input.image', 'data.gt.label'])
+
+        # opened without scanning the data source
+        dataset = open_dataset(use_manifest=True)
+        self.assertEqual(FuseDataSourceCountTest.num_calls, 1)
+        self.assertEqual(dataset.samples_description, manifest.get_samples_description())
+        self.assertEqual(dataset[3]['data']['gt']['label']['value'], int(dataset.samples_description[3].split('_')[1]))
+
+        # a processor changed - the manifest doesn't match
+        open_dataset(use_manifest=True, gt_offset=100)
+        self.assertEqual(FuseDataSourceCountTest.num_calls, 2)
+
+        # corrupted
+        manifest_file_name = os.path.join(cache_dest, FuseDatasetManifest.FILE_NAME)
+        with open(manifest_file_name, 'rb') as manifest_file:
+            header = pickle.load(manifest_file)
+        header['payload'] = header['payload'].replace(b'sample_1', b'sample_X')
+        with open(manifest_file_name, 'wb') as manifest_file:
+            pickle.dump(header, manifest_file)
+        self.assertIsNone(FuseDatasetManifest.load(manifest_file_name))
+        open_dataset(use_manifest=True, gt_offset=100)
+        self.assertEqual(FuseDataSourceCountTest.num_calls, 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -17,14 +17,18 @@ Created on June 30, 2021
 
 """
 
+import os
 import unittest
 import numpy as np
 import torchvision
+from torch.utils.data import BatchSampler, SequentialSampler
 from torch.utils.data.dataloader import DataLoader
 from torchvision import transforms
 
 from fuse.data.dataset.dataset_wrapper import FuseDatasetWrapper
 from fuse.data.sampler.sampler_balanced_batch import FuseSamplerBalancedBatch
+from fuse.data.sampler.sampler_prefetch import FuseSamplerPrefetch, FusePrefetchIndex
+from fuse.tests.data.data_test_utils import FuseDataTestCaseBase, FuseProcessorCountTest, create_dataset, create_descriptors
 from fuse.utils.utils_hierarchical_dict import FuseUtilsHierarchicalDict
 
 
@@ -126,5 +130,29 @@ class FuseSamplerBalancedTestCase(unittest.TestCase):
         pass
 
 
+class FuseSamplerPrefetchTestCase(FuseDataTestCaseBase):
+    def test_dataset_cache_prefetch(self):
+        descriptors = create_descriptors(20)
+        dataset = create_dataset(descriptors, FuseProcessorCountTest(0), cache_dest=os.path.join(self.tmp_dir, 'dataset_prefetch'),
+                                 cache_type='shards', cache_prefetch_threads=2)
+        dataset.create(num_workers=0)
+
+        # batch k + 1 is attached to batch k
+        batch_sampler = FuseSamplerPrefetch(BatchSampler(SequentialSampler(dataset), batch_size=4, drop_last=False), num_workers=0)
+        batches = list(batch_sampler)
+        self.assertEqual(len(batches), len(batch_sampler))
+        self.assertEqual([[int(index) for index in batch] for batch in batches], [list(range(i, i + 4)) for i in range(0, 20, 4)])
+        self.assertIsInstance(batches[0][0], FusePrefetchIndex)
+        self.assertEqual(batches[0][0].prefetch, [4, 5, 6, 7])
+        self.assertEqual(batches[-1][0].prefetch, [])
+
+        data_loader = DataLoader(dataset, batch_sampler=batch_sampler, num_workers=0, collate_fn=dataset.collate_fn)
+        values = [value for batch in data_loader for value in batch['data']['value']]
+        self.assertEqual(values, [int(desc.split('_')[1]) for desc in dataset.samples_description])
+        stats = dataset.get_cache_prefetch_stats()
+        self.assertEqual(stats['hits'], 16)
+        self.assertEqual(stats['misses'], 4)
+
+
 if __name__ == '__main__':
     unittest.main()
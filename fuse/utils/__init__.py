@@ -1,10 +1,10 @@
 
 from fuse.utils.ndict import NDict
-from fuse.utils.data.collate import CollateToBatchList, uncollate
+from fuse.utils.data.collate import CollateToBatchList, CollateCompiled, uncollate
 
 from fuse.utils.rand.param_sampler import Uniform, RandInt, RandBool, Choice, draw_samples_recursively 
 from fuse.utils.rand.seed import Seed
 set_seed = Seed.set_seed
 from fuse.utils.file_io.file_io import read_dataframe, save_dataframe
-from fuse.utils.data.collate import CollateToBatchList, uncollate
+from fuse.utils.data.collate import CollateToBatchList, CollateCompiled, uncollate
 
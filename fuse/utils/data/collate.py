@@ -16,7 +16,9 @@ limitations under the License.
 Created on June 30, 2021
 
 """
-from typing import Any, Callable, Dict, List, Sequence, Tuple
+from functools import reduce
+from operator import getitem
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 from fuse.utils import NDict
 
@@ -98,6 +100,125 @@ class CollateToBatchList(Callable):
             collected_values.append(value)
         return collected_values, has_error
         
+class CollateCompiled(Callable):
+    """
+    Collate list of samples (nested dictionaries) to a batch dictionary: tensors and numpy arrays are stacked,
+    other values are collected to a list. Same output as FuseDatasetDefault.collate_fn(), with less per batch overhead:
+    the schema (keys, types, shapes and dtypes of the first sample) is inferred once and compiled to a gather plan per key,
+    and re-compiled only when the first sample of a batch doesn't match it.
+    Tensors and arrays are stacked directly into preallocated output buffers, optionally pinned (tensors only) and reused.
+    """
+    def __init__(self, avoid_stack_keys: Sequence[str] = tuple(), num_buffers: int = 0, pin_memory: bool = False):
+        """
+        :param avoid_stack_keys: list of keys to just collect to a list and avoid stack operation
+        :param num_buffers: 0 - allocate new output buffers per batch.
+                            Otherwise, the number of output buffers per key, reused round robin: the tensors of a batch are overwritten
+                            num_buffers batches later. Use it only when each batch is consumed (e.g. copied to GPU) before,
+                            and not within DataLoader workers - batches are passed to the main process without copying.
+        :param pin_memory: allocate the tensor output buffers in pinned memory, for faster (and asynchronous) copies to GPU.
+                           Intended for collating in the main process (num_workers=0), otherwise use DataLoader(pin_memory=True).
+                           Ignored if CUDA is not available.
+        """
+        self._avoid_stack_keys = set(avoid_stack_keys)
+        self._num_buffers = num_buffers
+        self._pin_memory = pin_memory and torch.cuda.is_available()
+        self._reset_plan(None)
+
+    def __getstate__(self) -> dict:
+        # output buffers are process specific, pinned memory in particular
+        state = self.__dict__.copy()
+        state['_schema'] = None
+        state['_plan'] = []
+        state['_buffers'] = {}
+        return state
+
+    def __call__(self, samples: List[Dict]) -> Dict:
+        """
+        collate list of samples into batch_dict
+        :param samples: list of samples, None samples are skipped
+        :return: batch_dict
+        """
+        samples = [sample for sample in samples if sample is not None]
+        schema = self._get_schema(samples[0])
+        if schema != self._schema:
+            self._reset_plan(schema)
+
+        batch_size = len(samples)
+        buffer_index = self._next_buffer
+        if self._num_buffers > 0:
+            self._next_buffer = (self._next_buffer + 1) % self._num_buffers
+
+        batch_dict = {}
+        for path, kind, shape, dtype in self._plan:
+            try:
+                values = [reduce(getitem, path, sample) for sample in samples]
+                if kind == 'tensor':
+                    value = torch.stack(values, out=self._get_buffer(path, kind, shape, dtype, batch_size, buffer_index))
+                elif kind == 'ndarray':
+                    value = np.stack(values, out=self._get_buffer(path, kind, shape, dtype, batch_size, buffer_index))
+                else:
+                    value = values
+            except:
+                print(f'Error: Failed to collect key {".".join(path)}')
+                raise
+            # set the value in the nested batch dict
+            node = batch_dict
+            for key in path[:-1]:
+                node = node.setdefault(key, {})
+            node[path[-1]] = value
+
+        return batch_dict
+
+    def _get_schema(self, sample: Dict, path: Tuple = ()) -> Tuple:
+        """
+        :return: tuple of the leaves of sample: (path, kind, shape, dtype), kind is one of 'tensor', 'ndarray', 'list'
+        """
+        schema = []
+        for key, value in sample.items():
+            key_path = path + (key,)
+            if isinstance(value, dict):
+                schema.extend(self._get_schema(value, key_path))
+            elif isinstance(value, torch.Tensor):
+                schema.append((key_path, 'tensor', tuple(value.shape), value.dtype))
+            elif isinstance(value, np.ndarray):
+                schema.append((key_path, 'ndarray', value.shape, value.dtype))
+            else:
+                schema.append((key_path, 'list', None, None))
+        return tuple(schema)
+
+    def _reset_plan(self, schema: Optional[Tuple]) -> None:
+        """
+        Compile the gather plan of a schema: a list of (path, kind, shape, dtype)
+        """
+        self._schema = schema
+        self._plan = []
+        self._buffers = {}
+        self._next_buffer = 0
+        if schema is None:
+            return
+        for path, kind, shape, dtype in schema:
+            if kind == 'ndarray' and dtype.hasobject:
+                kind = 'list'
+            if '.'.join(path) in self._avoid_stack_keys:
+                kind = 'list'
+            self._plan.append((path, kind, shape, dtype))
+
+    def _get_buffer(self, path: Tuple, kind: str, shape: Tuple, dtype: Any, batch_size: int, buffer_index: int) -> Any:
+        """
+        :return: output buffer of batch_size items of the given shape and dtype
+        """
+        buffers = self._buffers.get(path, None) if self._num_buffers > 0 else None
+        buffer = buffers[buffer_index] if buffers is not None else None
+        if buffer is None or len(buffer) < batch_size:
+            if kind == 'tensor':
+                buffer = torch.empty((batch_size,) + shape, dtype=dtype, pin_memory=self._pin_memory)
+            else:
+                buffer = np.empty((batch_size,) + shape, dtype=dtype)
+            if self._num_buffers > 0:
+                self._buffers.setdefault(path, [None] * self._num_buffers)[buffer_index] = buffer
+        return buffer[:batch_size]
+
+
 def uncollate(batch: Dict) -> List[Dict]:
     """
     Reverse collate method
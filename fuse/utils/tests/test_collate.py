@@ -0,0 +1,72 @@
+"""
+(C) Copyright 2021 IBM Corp.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+   http://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+Created on June 30, 2021
+
+"""
+
+import unittest
+
+import numpy
+import torch
+
+from fuse.utils.data.collate import CollateCompiled
+
+
+def _create_sample(index: int) -> dict:
+    return {'data': {'input': {'image': torch.full((3, 4), float(index))},
+                     'mask': numpy.full((4,), index, dtype=numpy.uint8),
+                     'descriptor': f'sample_{index}'},
+            'label': index % 2}
+
+
+class TestCollate(unittest.TestCase):
+    """
+    Test collate functions
+    """
+
+    def test_collate_compiled(self):
+        collate = CollateCompiled(avoid_stack_keys=('data.mask',))
+        batch = collate([_create_sample(index) for index in range(4)] + [None])
+        self.assertEqual(batch['data']['input']['image'].shape, (4, 3, 4))
+        self.assertTrue(torch.equal(batch['data']['input']['image'][2], torch.full((3, 4), 2.0)))
+        self.assertIsInstance(batch['data']['mask'], list)
+        self.assertEqual(batch['data']['descriptor'], [f'sample_{index}' for index in range(4)])
+        self.assertEqual(batch['label'], [0, 1, 0, 1])
+
+        # schema changed - re-compiled
+        samples = [_create_sample(index) for index in range(3)]
+        for sample in samples:
+            sample['data']['input']['image'] = sample['data']['input']['image'][:2]
+            sample['extra'] = numpy.zeros(2)
+        batch = collate(samples)
+        self.assertEqual(batch['data']['input']['image'].shape, (3, 2, 4))
+        self.assertEqual(batch['extra'].shape, (3, 2))
+
+    def test_collate_compiled_reuse_buffers(self):
+        collate = CollateCompiled(num_buffers=2)
+        batches = [collate([_create_sample(batch_index * 10 + index) for index in range(4)]) for batch_index in range(3)]
+        # buffers reused round robin - batch 0 overwritten by batch 2
+        self.assertEqual(batches[0]['data']['input']['image'].data_ptr(), batches[2]['data']['input']['image'].data_ptr())
+        self.assertNotEqual(batches[1]['data']['input']['image'].data_ptr(), batches[2]['data']['input']['image'].data_ptr())
+        self.assertTrue(numpy.array_equal(batches[2]['data']['mask'][:, 0], [20, 21, 22, 23]))
+
+        # smaller batch - a view of the buffer
+        batch = collate([_create_sample(index) for index in range(2)])
+        self.assertEqual(batch['data']['input']['image'].shape, (2, 3, 4))
+
+
+if __name__ == '__main__':
+    unittest.main()